@@ -1,7 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from pydantic import BaseModel
+from typing import Optional
+from app.services.auth_service import get_optional_user
 from app.services.retrieval import query_rag
-from app.services.metrics_service import get_metrics_service
+from app.services.metrics_service import get_metrics_service, DEFAULT_ORG_ID
+from app.services.tracing import trace_request
+from app.services.telemetry import CHAT_REQUESTS, CHAT_LATENCY, CHAT_ROUTES, ERRORS
 import time
 import os
 import re
@@ -19,6 +23,9 @@ class ChatResponse(BaseModel):
 # Feature flag for metrics (default: enabled)
 ENABLE_METRICS = os.getenv("ENABLE_METRICS", "true").lower() == "true"
 
+# Expose per-stage durations to clients via the Server-Timing header (default: disabled)
+ENABLE_SERVER_TIMING = os.getenv("ENABLE_SERVER_TIMING", "false").lower() == "true"
+
 def detect_question_category(query_text: str) -> str:
     """
     Automatically detect the category of a question based on keywords.
@@ -50,15 +57,37 @@ def estimate_tokens_from_text(text: str) -> int:
     return len(text) // 4
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, response: Response, user: Optional[dict] = Depends(get_optional_user)):
+    with trace_request() as trace:
+        return _handle_chat(request, response, trace, user)
+
+def _handle_chat(request: ChatRequest, response: Response, trace, user: Optional[dict] = None) -> ChatResponse:
+    """
+    Answer a chat request inside an active trace so every stage is timed.
+
+    The tenant comes from the caller's token, never from the request body:
+    signed-in agents are answered from the shared knowledge base plus their
+    organization's uploads, anonymous callers from the shared knowledge base only.
+    """
     start_time = time.time()
+    org_id = user["org_slug"] if user else None
+    metrics_org_id = org_id or DEFAULT_ORG_ID
     
     try:
-        result = query_rag(request.query)
+        result = query_rag(request.query, org_id)
         
         # Calculate response time
         response_time_ms = int((time.time() - start_time) * 1000)
         
+        # Fallback message instead of an answer (knowledge base loading or unavailable, RAG error)
+        fallback_error = result.get("error")
+        
+        # Operational counters are always on; they are in-memory and cheap
+        route = "maps" if "Google Maps Places API" in result.get("sources", []) else "rag"
+        CHAT_REQUESTS.inc(status="success")
+        CHAT_ROUTES.inc(route=route)
+        CHAT_LATENCY.observe(response_time_ms / 1000, route=route)
+        
         # Log metrics if enabled
         if ENABLE_METRICS:
             try:
@@ -89,13 +118,23 @@ async def chat_endpoint(request: ChatRequest):
                     question_category=question_category,
                     source_type=source_type,
                     agent_id=request.agent_id,
-                    success=True,
+                    success=fallback_error is None,
+                    error_message=fallback_error,
                     tokens_used=total_tokens,
-                    cost_estimate=cost_estimate
+                    cost_estimate=cost_estimate,
+                    org_id=metrics_org_id,
+                    stages=trace.stages,
+                    # Only knowledge base answers are evaluated (Maps answers keep a null accuracy_score)
+                    answer=result.get("answer") if source_type != "Maps" and fallback_error is None else None,
+                    context=result.get("context")
                 )
             except Exception as metrics_error:
                 # Don't fail the request if metrics logging fails
                 print(f"Metrics logging error: {metrics_error}")
+                ERRORS.inc(component="metrics")
+        
+        if ENABLE_SERVER_TIMING:
+            response.headers["Server-Timing"] = trace.server_timing()
         
         return ChatResponse(
             answer=result["answer"],
@@ -103,6 +142,8 @@ async def chat_endpoint(request: ChatRequest):
         )
     except Exception as e:
         response_time_ms = int((time.time() - start_time) * 1000)
+        CHAT_REQUESTS.inc(status="error")
+        ERRORS.inc(component="chat")
         
         # Log failed query if metrics enabled
         if ENABLE_METRICS:
@@ -114,9 +155,12 @@ async def chat_endpoint(request: ChatRequest):
                     question_category=detect_question_category(request.query),
                     agent_id=request.agent_id,
                     success=False,
-                    error_message=str(e)
+                    error_message=str(e),
+                    org_id=metrics_org_id,
+                    stages=trace.stages
                 )
             except Exception as metrics_error:
                 print(f"Metrics logging error: {metrics_error}")
+                ERRORS.inc(component="metrics")
         
         raise HTTPException(status_code=500, detail=str(e))
@@ -5,17 +5,47 @@ All Rights Reserved.
 Dashboard API Endpoints
 Provides metrics and analytics data for the performance dashboard.
 """
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-from app.services.metrics_service import get_metrics_service
+from typing import Iterable, Iterator, List, Dict, Any, Optional
+from datetime import datetime
+import csv
+import io
+import json
+import zlib
+from app.services.metrics_service import get_metrics_service, DEFAULT_ORG_ID, EXPORT_COLUMNS
+from app.services.metrics_stream import get_metrics_broadcaster, next_delta
+from app.services.analytics_archive import get_analytics_archive
 
 router = APIRouter()
 
+# Live stream tuning: coalescing window and keep-alive interval (seconds)
+STREAM_FLUSH_INTERVAL_S = 1.0
+STREAM_HEARTBEAT_S = 15.0
+
+class MetricDelta(BaseModel):
+    """One metric in the current and comparison window"""
+    current: float
+    previous: float
+    delta: Optional[float] = None
+    delta_percent: Optional[float] = None
+
+class PeriodComparison(BaseModel):
+    """Current window compared with an earlier window of the same length"""
+    compare: str
+    offset_hours: int
+    current_start: str
+    previous_start: str
+    metrics: Dict[str, MetricDelta]
+
 class MetricsSummary(BaseModel):
     """Summary metrics model"""
     total_queries: int
     avg_response_time_ms: float
+    p50_response_time_ms: float
+    p90_response_time_ms: float
+    p99_response_time_ms: float
     success_rate: float
     unique_agents: int
     period_hours: int
@@ -25,7 +55,7 @@ class MetricsSummary(BaseModel):
     internal_accuracy_percent: float
     external_accuracy_percent: float
     aht_reduction_percent: float
-    aht_delta_percent: float
+    aht_delta_percent: Optional[float] = None
     
     rag_count: int
     rag_percentage: float
@@ -37,6 +67,8 @@ class MetricsSummary(BaseModel):
     rate_limit_status: str
     cost_breakdown: str
 
+    comparison: Optional[PeriodComparison] = None
+
 class CategoryMetric(BaseModel):
     """Question category metric"""
     category: str
@@ -49,6 +81,9 @@ class HourlyTrend(BaseModel):
     time: str # Renamed from hour
     queryVolume: int # Renamed from query_count
     avg_response_time_ms: float
+    p50_response_time_ms: float
+    p90_response_time_ms: float
+    p99_response_time_ms: float
     success_rate: float
 
 class AgentMetric(BaseModel):
@@ -56,6 +91,9 @@ class AgentMetric(BaseModel):
     name: str # Renamed from agent_id
     queryCount: int # Renamed
     avgTimeMs: float # Renamed
+    p50TimeMs: float
+    p90TimeMs: float
+    p99TimeMs: float
     accuracyPercent: float # Added
     lastActive: str # Renamed
 
@@ -65,72 +103,280 @@ class SourceMetric(BaseModel):
     count: int
     percentage: float
 
+class StageMetric(BaseModel):
+    """Per-stage latency metric"""
+    stage: str
+    count: int
+    avg_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    time_share_percent: float
+
+class TopQuestion(BaseModel):
+    """Frequently asked question"""
+    question: str
+    count: int
+    avg_response_time_ms: float
+    success_rate: float
+
+class TopQuery(BaseModel):
+    """Heavy-hitter question with its estimated frequency"""
+    question: str
+    count: int
+    max_error: int
+
+class HistoryPoint(BaseModel):
+    """Long-range aggregate for one day (or the whole period)"""
+    date: Optional[str] = None
+    query_count: int
+    avg_response_time_ms: float
+    p50_response_time_ms: float
+    p90_response_time_ms: float
+    p99_response_time_ms: float
+    success_rate: float
+    accuracy_percent: float
+    tokens_used: int
+    estimated_cost: float
+    rag_count: int
+    maps_count: int
+
+class MetricsHistory(BaseModel):
+    """Long-range report over archived and recent queries"""
+    period_days: int
+    archived_partitions: int
+    totals: HistoryPoint
+    daily: List[HistoryPoint]
+
 @router.get("/metrics/summary", response_model=MetricsSummary)
 async def get_metrics_summary(
-    hours: int = Query(default=24, ge=1, le=168, description="Hours to look back (1-168)")
+    hours: int = Query(default=24, ge=1, le=168, description="Hours to look back (1-168)"),
+    org_id: str = Query(default=DEFAULT_ORG_ID, description="Tenant to report on"),
+    compare: str = Query(default="previous", pattern="^(previous|day|week)$", description="Comparison window"),
+    compare_offset_hours: Optional[int] = Query(default=None, ge=1, le=8760, description="Custom comparison shift (hours)")
 ):
     """
-    Get summary metrics for the dashboard
+    Get summary metrics for the dashboard, compared with an earlier window
     """
     try:
         service = get_metrics_service()
-        data = service.get_summary_metrics(hours=hours)
+        data = service.get_summary_metrics(
+            hours=hours, org_id=org_id, compare=compare, compare_offset_hours=compare_offset_hours
+        )
         return MetricsSummary(**data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch metrics summary: {str(e)}")
 
 @router.get("/metrics/categories", response_model=List[CategoryMetric])
 async def get_question_categories(
-    hours: int = Query(default=24, ge=1, le=168)
+    hours: int = Query(default=24, ge=1, le=168),
+    org_id: str = Query(default=DEFAULT_ORG_ID)
 ):
     """
     Get breakdown of questions by category
     """
     try:
         service = get_metrics_service()
-        data = service.get_question_categories(hours=hours)
+        data = service.get_question_categories(hours=hours, org_id=org_id)
         return [CategoryMetric(**item) for item in data]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch categories: {str(e)}")
 
 @router.get("/metrics/trends", response_model=List[HourlyTrend])
 async def get_hourly_trends(
-    hours: int = Query(default=24, ge=1, le=168)
+    hours: int = Query(default=24, ge=1, le=168),
+    org_id: str = Query(default=DEFAULT_ORG_ID),
+    granularity: Optional[str] = Query(default=None, description="Bucket width (1m, 5m, 15m, 1h, 1d, ...) or auto")
 ):
     """
-    Get hourly query trends
+    Get query trends (hourly unless a granularity is requested)
     """
     try:
         service = get_metrics_service()
-        data = service.get_hourly_trends(hours=hours)
+        data = service.get_hourly_trends(hours=hours, org_id=org_id, granularity=granularity)
         return [HourlyTrend(**item) for item in data]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch trends: {str(e)}")
 
 @router.get("/metrics/agents", response_model=List[AgentMetric])
 async def get_agent_performance(
-    hours: int = Query(default=24, ge=1, le=168)
+    hours: int = Query(default=24, ge=1, le=168),
+    org_id: str = Query(default=DEFAULT_ORG_ID)
 ):
     """
     Get performance metrics per agent
     """
     try:
         service = get_metrics_service()
-        data = service.get_agent_performance(hours=hours)
+        data = service.get_agent_performance(hours=hours, org_id=org_id)
         return [AgentMetric(**item) for item in data]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch agent metrics: {str(e)}")
 
 @router.get("/metrics/sources", response_model=List[SourceMetric])
 async def get_source_distribution(
-    hours: int = Query(default=24, ge=1, le=168)
+    hours: int = Query(default=24, ge=1, le=168),
+    org_id: str = Query(default=DEFAULT_ORG_ID)
 ):
     """
     Get distribution of query sources (RAG, Maps, etc.)
     """
     try:
         service = get_metrics_service()
-        data = service.get_source_distribution(hours=hours)
+        data = service.get_source_distribution(hours=hours, org_id=org_id)
         return [SourceMetric(**item) for item in data]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch source distribution: {str(e)}")
+
+@router.get("/metrics/stages", response_model=List[StageMetric])
+async def get_stage_breakdown(
+    hours: int = Query(default=24, ge=1, le=168),
+    org_id: str = Query(default=DEFAULT_ORG_ID)
+):
+    """
+    Get latency breakdown per chat pipeline stage
+    """
+    try:
+        service = get_metrics_service()
+        data = service.get_stage_breakdown(hours=hours, org_id=org_id)
+        return [StageMetric(**item) for item in data]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch stage breakdown: {str(e)}")
+
+@router.get("/metrics/top-questions", response_model=List[TopQuestion])
+async def get_top_questions(
+    hours: int = Query(default=24, ge=1, le=168),
+    limit: int = Query(default=10, ge=1, le=100),
+    org_id: str = Query(default=DEFAULT_ORG_ID)
+):
+    """
+    Get the most frequently asked questions
+    """
+    try:
+        service = get_metrics_service()
+        data = service.get_top_questions(hours=hours, org_id=org_id, limit=limit)
+        return [TopQuestion(**item) for item in data]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch top questions: {str(e)}")
+
+@router.get("/metrics/top-queries", response_model=List[TopQuery])
+async def get_top_queries(
+    hours: int = Query(default=24, ge=1, le=168),
+    k: int = Query(default=10, ge=1, le=100),
+    org_id: str = Query(default=DEFAULT_ORG_ID)
+):
+    """
+    Get the most frequent questions from streaming heavy-hitter sketches
+    """
+    try:
+        service = get_metrics_service()
+        data = service.get_top_queries(hours=hours, org_id=org_id, k=k)
+        return [TopQuery(**item) for item in data]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch top queries: {str(e)}")
+
+@router.get("/metrics/history", response_model=MetricsHistory)
+async def get_metrics_history(
+    days: int = Query(default=30, ge=1, le=365, description="Days to look back (e.g. 30, 90, 365)"),
+    org_id: str = Query(default=DEFAULT_ORG_ID)
+):
+    """
+    Get long-range daily analytics from the Parquet archive plus recent data
+    """
+    archive = get_analytics_archive()
+    if not archive.available():
+        raise HTTPException(status_code=503, detail="Long-range analytics are not available (duckdb/pyarrow not installed)")
+    try:
+        return MetricsHistory(**archive.history(days=days, org_id=org_id))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch metrics history: {str(e)}")
+
+def _gzip_chunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    """Gzip a stream of text chunks incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@router.get("/metrics/export")
+def export_queries(
+    request: Request,
+    fmt: str = Query(default="ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    org_id: str = Query(default=DEFAULT_ORG_ID),
+    start: Optional[datetime] = Query(default=None, description="Inclusive lower bound (ISO 8601)"),
+    end: Optional[datetime] = Query(default=None, description="Exclusive upper bound (ISO 8601)"),
+    category: Optional[str] = Query(default=None),
+    agent_id: Optional[str] = Query(default=None),
+    source: Optional[str] = Query(default=None)
+):
+    """
+    Stream raw query logs as NDJSON or CSV (gzip-compressed when accepted).
+    Rows are read page by page, so memory use does not grow with the range.
+    """
+    service = get_metrics_service()
+    pages = service.iter_queries(
+        org_id=org_id, start=start, end=end, category=category, agent_id=agent_id, source=source
+    )
+
+    def body() -> Iterator[str]:
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+            writer.writeheader()
+            for page in pages:
+                writer.writerows(page)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for page in pages:
+                yield "".join(json.dumps(row) + "\n" for row in page)
+
+    filename = f"queries-{org_id}-{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    content = body()
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        content = _gzip_chunks(content)
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(
+        content,
+        media_type="text/csv" if fmt == "csv" else "application/x-ndjson",
+        headers=headers,
+    )
+
+@router.get("/metrics/stream")
+async def stream_metrics(
+    request: Request,
+    org_id: str = Query(default=DEFAULT_ORG_ID, description="Tenant to subscribe to")
+):
+    """
+    Server-Sent Events stream of incremental metric deltas.
+    Dashboards load the snapshot once, then apply these deltas instead of polling.
+    """
+    broadcaster = get_metrics_broadcaster()
+    subscription = broadcaster.subscribe(org_id)
+
+    async def event_stream():
+        try:
+            # Tell EventSource clients how long to wait before reconnecting
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                delta = await next_delta(subscription, STREAM_FLUSH_INTERVAL_S, STREAM_HEARTBEAT_S)
+                if delta is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"event: delta\ndata: {json.dumps(delta)}\n\n"
+        finally:
+            broadcaster.unsubscribe(org_id, subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,77 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Knowledge Base API Endpoints
+Document uploads and ingestion status. Uploads are stored and queued; the
+ingestion workers (see ingestion_jobs) embed them in the background.
+
+All endpoints require a bearer token; the tenant is the token's organization,
+and only its admins can upload (uploaded content is served to its guests).
+"""
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import List, Optional
+from app.services.auth_service import get_current_user
+from app.services.ingestion_jobs import get_ingestion_queue
+
+router = APIRouter()
+
+class KBDocumentStatus(BaseModel):
+    """Uploaded document and its ingestion progress"""
+    doc_id: str
+    org_id: str
+    filename: str
+    content_hash: Optional[str] = None
+    status: str  # queued, processing, active, failed
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    error_message: Optional[str] = None
+    uploaded_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    duplicate: bool = False
+
+@router.post("/kb/documents", response_model=KBDocumentStatus, status_code=202)
+async def upload_document(
+    file: UploadFile = File(...),
+    user: dict = Depends(get_current_user)
+):
+    """
+    Upload a PDF or text file to the knowledge base.
+    Returns immediately with the queued document; poll its status for progress.
+    Content the tenant already uploaded is not processed again (duplicate=true).
+    """
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only organization admins can upload documents")
+    queue = get_ingestion_queue()
+    try:
+        # Hashing and writing the file are blocking: keep them off the event loop
+        document, duplicate = await run_in_threadpool(
+            queue.submit, user["org_slug"], file.filename, file.file, user.get("user_id")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to store document: {str(e)}")
+    return KBDocumentStatus(**document, duplicate=duplicate)
+
+@router.get("/kb/documents", response_model=List[KBDocumentStatus])
+async def list_documents(
+    status: Optional[str] = Query(default=None, pattern="^(queued|processing|active|failed)$"),
+    user: dict = Depends(get_current_user)
+):
+    """List the tenant's documents, newest first"""
+    try:
+        documents = await run_in_threadpool(get_ingestion_queue().list_documents, user["org_slug"], status)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to list documents: {str(e)}")
+    return [KBDocumentStatus(**document) for document in documents]
+
+@router.get("/kb/documents/{doc_id}", response_model=KBDocumentStatus)
+async def get_document(doc_id: str, user: dict = Depends(get_current_user)):
+    """Status and progress of one of the tenant's documents"""
+    document = await run_in_threadpool(get_ingestion_queue().get_document, doc_id, user["org_slug"])
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return KBDocumentStatus(**document)
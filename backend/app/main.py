@@ -2,10 +2,20 @@
 Copyright (c) 2025 Sheers Software Sdn. Bhd.
 All Rights Reserved.
 """
-from fastapi import FastAPI
+import time
+_IMPORT_STARTED = time.monotonic()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from app.api import chat, dashboard
+from app.api import chat, dashboard, knowledge_base
+from app.services.telemetry import render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.services.analytics_archive import start_archive_worker
+from app.services.analytics_store import ANALYTICS_BACKEND
+from app.services.evaluation import start_evaluation_worker
+from app.services.index_versions import get_index_manager, start_index_loader
+from app.services.ingestion_jobs import start_ingestion_workers
 import os
 
 load_dotenv()
@@ -16,8 +26,67 @@ if not os.getenv("OPENAI_API_KEY"):
 if not os.getenv("GOOGLE_MAPS_API_KEY"):
     print("WARNING: GOOGLE_MAPS_API_KEY not found in environment variables. Location services will fail.")
 
+# Only import GCS utilities in cloud environment
+try:
+    from app.services.gcs_utils import GCSIndexPoller, GCSKnowledgeBase, download_vector_db_from_gcs
+    GCS_AVAILABLE = True
+except ImportError:
+    GCS_AVAILABLE = False
+    print("GCS utilities not available (running in local mode)")
+
+# Sync the vector DB from GCS if in cloud environment
+# (GCS credentials are automatically available in Cloud Run)
+IN_CLOUD = bool(os.getenv("GOOGLE_CLOUD_PROJECT") or os.getenv("K_SERVICE"))
+
+# Nightly-style retention: compact closed days of raw queries into Parquet (feature-flagged).
+# Off by default with the shared PostgreSQL store, whose rows must not move to one instance's disk.
+_SHARED_STORE = ANALYTICS_BACKEND in ("postgres", "postgresql")
+ENABLE_ANALYTICS_ARCHIVE = os.getenv("ENABLE_ANALYTICS_ARCHIVE", "false" if _SHARED_STORE else "true").lower() == "true"
+
+# Groundedness scoring of logged answers off the request path (feature-flagged)
+ENABLE_ACCURACY_EVALUATION = os.getenv("ENABLE_ACCURACY_EVALUATION", "true").lower() == "true"
+
+# Hot swap to newly published vector index versions (feature-flagged)
+ENABLE_INDEX_HOT_SWAP = os.getenv("ENABLE_INDEX_HOT_SWAP", "true").lower() == "true"
+
+# Knowledge base uploads, embedded by background ingestion workers (feature-flagged)
+ENABLE_KB_UPLOADS = os.getenv("ENABLE_KB_UPLOADS", "true").lower() == "true"
+
 
-app = FastAPI(title="Club Med Resort Genius API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start background work without blocking startup: the port opens (and
+    /health answers) straight away, while the vector index is fetched and
+    warmed in the background; /ready reports when it is live.
+    """
+    timings = {"imports": time.monotonic() - _IMPORT_STARTED}
+    started = time.monotonic()
+    if ENABLE_ANALYTICS_ARCHIVE:
+        start_archive_worker()
+        print("✓ Analytics archive job started")
+    if ENABLE_ACCURACY_EVALUATION:
+        start_evaluation_worker()
+        print("✓ Answer evaluation worker started")
+    if ENABLE_KB_UPLOADS:
+        # On Cloud Run, uploads and the versions built from them are shared through GCS
+        start_ingestion_workers(shared=GCSKnowledgeBase() if GCS_AVAILABLE and IN_CLOUD else None)
+        print("✓ Knowledge base ingestion workers started")
+    timings["workers"] = time.monotonic() - started
+
+    started = time.monotonic()
+    fetch = download_vector_db_from_gcs if GCS_AVAILABLE and IN_CLOUD else None
+    if fetch is not None:
+        print("Cloud environment detected. Syncing vector DB from GCS in the background...")
+    # In the cloud the watcher also follows the live version in GCS
+    start_index_loader(fetch, watch=ENABLE_INDEX_HOT_SWAP, poll=GCSIndexPoller() if fetch is not None else None)
+    timings["index_loader"] = time.monotonic() - started
+    print("✓ Startup: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items())
+          + " (vector index loading in the background)")
+    yield
+
+
+app = FastAPI(title="Club Med Resort Genius API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -36,6 +105,9 @@ if ENABLE_DASHBOARD:
     app.include_router(dashboard.router, prefix="/api")
     print("✓ Dashboard API enabled")
 
+if ENABLE_KB_UPLOADS:
+    app.include_router(knowledge_base.router, prefix="/api")
+
 
 @app.get("/")
 async def root():
@@ -44,3 +116,19 @@ async def root():
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+@app.get("/ready")
+async def readiness_check(response: Response):
+    """Readiness: 200 once the vector index is open and warmed, 503 before"""
+    index_manager = get_index_manager()
+    if index_manager.active_path is None:
+        response.status_code = 503
+        return {"status": index_manager.phase or "loading"}
+    return {"status": "ready", "index_version": os.path.basename(index_manager.active_path)}
+
+# Prometheus/OpenMetrics scrape endpoint (feature-flagged)
+ENABLE_PROMETHEUS_METRICS = os.getenv("ENABLE_PROMETHEUS_METRICS", "true").lower() == "true"
+if ENABLE_PROMETHEUS_METRICS:
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
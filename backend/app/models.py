@@ -2,12 +2,12 @@
 Multi-tenant data models for SaaS deployment.
 All tables include org_id for tenant isolation.
 """
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, ForeignKey, Text, DECIMAL, UUID
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, DateTime, ForeignKey, Text, DECIMAL, UUID, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID, JSONB
 import uuid
-from app.database import Base
+from app.database import Base, DATABASE_URL
 
 # Use PostgreSQL UUID if available, otherwise string for SQLite
 try:
@@ -15,6 +15,9 @@ try:
 except:
     UUIDType = String(36)
 
+# JSON columns are native JSONB on PostgreSQL, plain text elsewhere
+JSONType = JSONB if "postgresql" in DATABASE_URL else Text
+
 class Organization(Base):
     """
     Tenant/Organization table.
@@ -29,7 +32,7 @@ class Organization(Base):
     max_users = Column(Integer, default=10)
     max_kb_docs = Column(Integer, default=100)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    settings = Column(JSONB if "postgresql" in Base.metadata.bind.url.drivername else Text, default={})
+    settings = Column(JSONType, default={})
     
     # Relationships
     users = relationship("User", back_populates="organization", cascade="all, delete-orphan")
@@ -108,7 +111,12 @@ class KBDocument(Base):
     content_hash = Column(String(64))  # SHA-256 for deduplication
     uploaded_by = Column(UUIDType, ForeignKey("users.user_id"))
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
-    status = Column(String(50), default="processing")  # processing, active, failed
+    status = Column(String(50), default="queued")  # queued, processing, active, failed
+    # Ingestion job progress (see app.services.ingestion_jobs)
+    chunks_total = Column(Integer, default=0)
+    chunks_embedded = Column(Integer, default=0)
+    error_message = Column(Text)
+    updated_at = Column(DateTime(timezone=True))  # Also the processing lease heartbeat
     
     # Relationships
     organization = relationship("Organization", back_populates="kb_documents")
@@ -117,26 +125,36 @@ class Query(Base):
     """
     Analytics query table (tenant-scoped).
     Enhanced version of previous metrics table.
+    Range-partitioned by month on timestamp; partitions are created on demand
+    by the analytics store, so the partition key is part of the primary key.
     """
     __tablename__ = "queries"
     
     id = Column(UUIDType, primary_key=True, default=uuid.uuid4)
-    org_id = Column(UUIDType, ForeignKey("organizations.org_id", ondelete="CASCADE"), nullable=False, index=True)
+    org_id = Column(UUIDType, ForeignKey("organizations.org_id", ondelete="CASCADE"), nullable=False)
     user_id = Column(UUIDType, ForeignKey("users.user_id"))
     session_id = Column(UUIDType, ForeignKey("chat_sessions.session_id"))
-    timestamp = Column(DateTime(timezone=True), server_default=func.now(), index=True)
-    query_text = Column(Text, nullable=False)
+    timestamp = Column(DateTime(timezone=True), primary_key=True, server_default=func.now(), nullable=False)
+    query_text = Column(Text)  # Legacy inline text; new rows reference text_dictionary
+    query_text_id = Column(BigInteger)
     response_time_ms = Column(Integer, nullable=False)
     question_category = Column(String(100))
     source_type = Column(String(50))
     agent_id = Column(String(255))  # Legacy field, use user_id instead
     success = Column(Boolean, default=True)
-    error_message = Column(Text)
+    error_message = Column(Text)  # Legacy inline text
+    error_message_id = Column(BigInteger)
     tokens_used = Column(Integer, default=0)
     cost_estimate = Column(DECIMAL(10, 6), default=0.0)
     accuracy_score = Column(DECIMAL(3, 2), default=0.0)
     aht_saved_s = Column(Integer, default=0)
 
+    __table_args__ = (
+        # Dashboard reads are always a tenant-scoped time window
+        Index("idx_queries_org_timestamp", "org_id", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
 class KBEmbedding(Base):
     """
     Embeddings table for pgvector (tenant-scoped).
@@ -149,4 +167,5 @@ class KBEmbedding(Base):
     content = Column(Text, nullable=False)
     # embedding column will be added via Alembic migration with pgvector type
     # embedding = Column(Vector(1536))  # For OpenAI text-embedding-3-small
-    metadata = Column(JSONB if "postgresql" in Base.metadata.bind.url.drivername else Text)
+    # "metadata" is reserved on declarative models, so the attribute is renamed
+    chunk_metadata = Column("metadata", JSONType)
@@ -0,0 +1,319 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Analytics Archive
+Compacts closed days of raw query rows into compressed Parquet partitions
+(org_id=<tenant>/date=<YYYY-MM-DD>/) and serves long-range reports over them
+with DuckDB, so the hot analytics database only holds the dashboard window.
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from .analytics_store import get_analytics_store, DEFAULT_ORG_ID
+from .telemetry import ERRORS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+ARCHIVE_DIR = Path(os.getenv("ANALYTICS_ARCHIVE_DIR", str(Path(__file__).parent.parent.parent / "analytics_archive")))
+
+# Days kept in the hot database: the dashboard's 168-hour window plus today
+HOT_RETENTION_DAYS = int(os.getenv("ANALYTICS_HOT_RETENTION_DAYS", "8"))
+
+# How often the retention job runs
+ARCHIVE_INTERVAL_S = int(os.getenv("ANALYTICS_ARCHIVE_INTERVAL_S", "3600"))
+
+PARQUET_COMPRESSION = "zstd"
+
+# Columns written to Parquet; org_id and date are encoded in the partition path
+ARCHIVE_COLUMNS = (
+    "id", "timestamp", "query_text", "response_time_ms", "question_category", "source_type",
+    "agent_id", "success", "error_message", "tokens_used", "cost_estimate",
+    "accuracy_score", "aht_saved_s",
+)
+
+# Archive rows carry their text inline (Parquet dictionary-encodes it per column)
+ARCHIVE_SELECT = """
+    SELECT q.id, q.timestamp, COALESCE(q.query_text, qt.text), q.response_time_ms, q.question_category,
+           q.source_type, q.agent_id, q.success, COALESCE(q.error_message, et.text), q.tokens_used,
+           q.cost_estimate, q.accuracy_score, q.aht_saved_s
+    FROM queries q
+    LEFT JOIN text_dictionary qt ON qt.id = q.query_text_id
+    LEFT JOIN text_dictionary et ON et.id = q.error_message_id
+"""
+
+
+def _naive(value) -> datetime:
+    """Database timestamp (string or datetime) as a naive local datetime"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+class AnalyticsArchive:
+    """Parquet archive of closed days plus the DuckDB long-range query path"""
+
+    def __init__(self, archive_dir: Path = ARCHIVE_DIR):
+        self.archive_dir = Path(archive_dir)
+        self.store = get_analytics_store()
+        # The worker can start before anything else has created the tables
+        self.store.create_schema()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available() -> bool:
+        return pa is not None and duckdb is not None
+
+    def _schema(self):
+        return pa.schema([
+            ("id", pa.string()),
+            ("timestamp", pa.timestamp("us")),
+            ("query_text", pa.string()),
+            ("response_time_ms", pa.int32()),
+            ("question_category", pa.string()),
+            ("source_type", pa.string()),
+            ("agent_id", pa.string()),
+            ("success", pa.bool_()),
+            ("error_message", pa.string()),
+            ("tokens_used", pa.int32()),
+            ("cost_estimate", pa.float64()),
+            ("accuracy_score", pa.float64()),
+            ("aht_saved_s", pa.int32()),
+        ])
+
+    def _partition_dir(self, tenant: str, day: str) -> Path:
+        return self.archive_dir / f"org_id={tenant}" / f"date={day}"
+
+    def _write_partition(self, tenant: str, day: str, rows: List[tuple]) -> Path:
+        """Write one day of rows; the file name is derived from the row ids so a re-run overwrites"""
+        columns = {name: [] for name in ARCHIVE_COLUMNS}
+        for row in rows:
+            for name, value in zip(ARCHIVE_COLUMNS, row):
+                columns[name].append(value)
+        columns["id"] = [str(value) for value in columns["id"]]
+        columns["timestamp"] = [_naive(value) for value in columns["timestamp"]]
+        columns["success"] = [bool(value) for value in columns["success"]]
+        columns["cost_estimate"] = [float(value or 0.0) for value in columns["cost_estimate"]]
+        columns["accuracy_score"] = [float(value) if value is not None else None for value in columns["accuracy_score"]]
+
+        digest = hashlib.sha1("\n".join(sorted(columns["id"])).encode()).hexdigest()[:16]
+        partition = self._partition_dir(tenant, day)
+        partition.mkdir(parents=True, exist_ok=True)
+        path = partition / f"part-{digest}.parquet"
+
+        # Write then rename so readers never see a partial file
+        tmp_path = path.with_suffix(".parquet.tmp")
+        pq.write_table(pa.Table.from_pydict(columns, schema=self._schema()), tmp_path, compression=PARQUET_COMPRESSION)
+        os.replace(tmp_path, path)
+        return path
+
+    def archive_closed_days(self, now: Optional[datetime] = None) -> int:
+        """
+        Move raw rows older than the hot retention window into Parquet, one
+        partition per tenant and day, then delete them and reclaim space.
+        Skipped on PostgreSQL: partitions are written to this instance's disk,
+        so rows deleted from the shared database would be lost to every other
+        instance (and to every later deploy).
+
+        Returns:
+            Number of rows archived
+        """
+        if pa is None:
+            print("Analytics archive skipped: pyarrow is not installed")
+            return 0
+        if self.store.name == "postgres":
+            print("Analytics archive skipped: the PostgreSQL store is shared, and partitions are local to this instance")
+            return 0
+
+        boundary = datetime.combine((now or datetime.now()).date() - timedelta(days=HOT_RETENTION_DAYS - 1), datetime.min.time())
+        sql = self.store.sql
+
+        with self._lock:
+            conn = self.store.connect()
+            cursor = conn.cursor()
+            cursor.execute(sql("""
+                SELECT DISTINCT org_id, {day} FROM queries
+                WHERE timestamp < ?
+            """), (boundary,))
+            closed_days = cursor.fetchall()
+
+            archived = 0
+            for tenant, day in closed_days:
+                tenant = str(tenant or DEFAULT_ORG_ID)
+                start = datetime.fromisoformat(str(day))
+                end = start + timedelta(days=1)
+
+                cursor.execute(sql(ARCHIVE_SELECT + """
+                    WHERE q.org_id = ? AND q.timestamp >= ? AND q.timestamp < ?
+                """), (tenant, start, end))
+                rows = cursor.fetchall()
+                if not rows:
+                    continue
+
+                self._write_partition(tenant, start.strftime('%Y-%m-%d'), rows)
+
+                # Rows are only removed once their partition is on disk
+                cursor.execute(sql("DELETE FROM query_stages WHERE org_id = ? AND timestamp >= ? AND timestamp < ?"), (tenant, start, end))
+                cursor.execute(sql("DELETE FROM query_evaluations WHERE org_id = ? AND timestamp >= ? AND timestamp < ?"), (tenant, start, end))
+                cursor.execute(sql("DELETE FROM queries WHERE org_id = ? AND timestamp >= ? AND timestamp < ?"), (tenant, start, end))
+                conn.commit()
+                archived += len(rows)
+
+            conn.close()
+
+        if archived:
+            self.store.vacuum()
+            print(f"Analytics archive: compacted {archived} rows from {len(closed_days)} tenant-days")
+        return archived
+
+    def _hot_table(self, tenant: str, since: datetime):
+        """Rows still in the hot database for the window, as an Arrow table"""
+        conn = self.store.connect()
+        cursor = self.store.streaming_cursor(conn)
+        cursor.execute(self.store.sql("""
+            SELECT timestamp, response_time_ms, success, tokens_used, cost_estimate, accuracy_score, source_type
+            FROM queries
+            WHERE org_id = ? AND timestamp >= ?
+        """), (tenant, since))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+
+        return pa.Table.from_pydict(
+            {
+                "timestamp": [_naive(row[0]) for row in rows],
+                "response_time_ms": [row[1] for row in rows],
+                "success": [bool(row[2]) for row in rows],
+                "tokens_used": [row[3] or 0 for row in rows],
+                "cost_estimate": [float(row[4] or 0.0) for row in rows],
+                "accuracy_score": [float(row[5]) if row[5] is not None else None for row in rows],
+                "source_type": [row[6] for row in rows],
+            },
+            schema=pa.schema([
+                ("timestamp", pa.timestamp("us")),
+                ("response_time_ms", pa.int32()),
+                ("success", pa.bool_()),
+                ("tokens_used", pa.int32()),
+                ("cost_estimate", pa.float64()),
+                ("accuracy_score", pa.float64()),
+                ("source_type", pa.string()),
+            ]),
+        )
+
+    def history(self, days: int, org_id: str = DEFAULT_ORG_ID) -> Dict[str, Any]:
+        """
+        Daily series and window totals over archived partitions plus the hot
+        database, for long-range (30/90/365 day) reports.
+        """
+        if not self.available():
+            raise RuntimeError("Long-range analytics require duckdb and pyarrow")
+
+        tenant = self.store.tenant_key(org_id)
+        since_day = date.today() - timedelta(days=days - 1)
+        since = datetime.combine(since_day, datetime.min.time())
+
+        # Partition pruning happens on the path, before DuckDB opens any file
+        files = [
+            str(path)
+            for partition in sorted((self.archive_dir / f"org_id={tenant}").glob("date=*"))
+            if partition.name[len("date="):] >= since_day.isoformat()
+            for path in partition.glob("*.parquet")
+        ]
+
+        con = duckdb.connect()
+        con.register("hot_queries", self._hot_table(tenant, since))
+        relations = ["SELECT timestamp, response_time_ms, success, tokens_used, cost_estimate, accuracy_score, source_type FROM hot_queries"]
+        if files:
+            relations.append(
+                "SELECT timestamp, response_time_ms, success, tokens_used, cost_estimate, accuracy_score, source_type "
+                "FROM read_parquet(?)"
+            )
+        source = " UNION ALL ".join(relations)
+        params = [files] if files else []
+
+        aggregates = """
+            COUNT(*) AS query_count,
+            AVG(response_time_ms) AS avg_response_time_ms,
+            quantile_cont(response_time_ms, [0.5, 0.9, 0.99]) AS latency_quantiles,
+            AVG(CASE WHEN success THEN 1.0 ELSE 0.0 END) * 100 AS success_rate,
+            AVG(accuracy_score) * 100 AS accuracy_percent,
+            SUM(tokens_used) AS tokens_used,
+            SUM(cost_estimate) AS estimated_cost,
+            COUNT(CASE WHEN source_type = 'RAG' THEN 1 END) AS rag_count,
+            COUNT(CASE WHEN source_type = 'Maps' THEN 1 END) AS maps_count
+        """
+        daily = con.execute(f"""
+            SELECT CAST(timestamp AS DATE) AS day, {aggregates}
+            FROM ({source})
+            GROUP BY day
+            ORDER BY day
+        """, params).fetchall()
+        totals = con.execute(f"SELECT NULL AS day, {aggregates} FROM ({source})", params).fetchone()
+        con.close()
+
+        def _format(row) -> Dict[str, Any]:
+            quantiles = row[3] or [0.0, 0.0, 0.0]
+            return {
+                "query_count": row[1],
+                "avg_response_time_ms": round(float(row[2] or 0), 2),
+                "p50_response_time_ms": round(float(quantiles[0]), 2),
+                "p90_response_time_ms": round(float(quantiles[1]), 2),
+                "p99_response_time_ms": round(float(quantiles[2]), 2),
+                "success_rate": round(float(row[4] if row[4] is not None else 100.0), 2),
+                "accuracy_percent": round(float(row[5] or 0), 1),
+                "tokens_used": int(row[6] or 0),
+                "estimated_cost": round(float(row[7] or 0), 4),
+                "rag_count": row[8],
+                "maps_count": row[9],
+            }
+
+        return {
+            "period_days": days,
+            "archived_partitions": len(files),
+            "totals": _format(totals),
+            "daily": [dict(date=row[0].isoformat(), **_format(row)) for row in daily],
+        }
+
+    def run_forever(self):
+        """Retention loop for the background thread"""
+        while True:
+            try:
+                self.archive_closed_days()
+            except Exception as e:
+                print(f"Analytics archive error: {e}")
+                ERRORS.inc(component="archive")
+            time.sleep(ARCHIVE_INTERVAL_S)
+
+
+# Global instance
+_analytics_archive = None
+
+def get_analytics_archive() -> AnalyticsArchive:
+    """Get or create the global analytics archive instance"""
+    global _analytics_archive
+    if _analytics_archive is None:
+        _analytics_archive = AnalyticsArchive()
+    return _analytics_archive
+
+
+def start_archive_worker() -> threading.Thread:
+    """Run the retention job periodically in a daemon thread"""
+    thread = threading.Thread(target=get_analytics_archive().run_forever, name="analytics-archive", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,720 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Analytics Storage Backends
+Pluggable persistence for MetricsService. SQLite (analytics.db) is the
+local-dev default; PostgreSQL writes raw events to the tenant-scoped
+SQLAlchemy `Query` model so analytics survive instance restarts and are
+shared between Cloud Run instances.
+
+Select with ANALYTICS_BACKEND=sqlite|postgres (PostgreSQL uses DATABASE_URL).
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+# Local analytics database - stored alongside backend
+SQLITE_DB_PATH = Path(__file__).parent.parent.parent / "analytics.db"
+
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "sqlite").lower()
+
+# Tenant used when a caller does not identify its organization
+DEFAULT_ORG_ID = "default"
+
+# Raw query columns written per event, in insert order. Query and error text
+# are dictionary-encoded: rows reference text_dictionary ids.
+QUERY_COLUMNS = (
+    "timestamp", "query_text_id", "response_time_ms", "question_category", "source_type",
+    "agent_id", "success", "error_message_id", "tokens_used", "cost_estimate",
+    "accuracy_score", "aht_saved_s", "org_id",
+)
+
+# Text hash -> dictionary id entries cached per process before the cache is reset
+TEXT_CACHE_SIZE = 100000
+
+QueryId = Union[int, str]
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used to deduplicate questions (case, spacing, trailing punctuation)"""
+    return " ".join(text.lower().split()).rstrip("?!. ")
+
+
+def text_hash(text: str) -> str:
+    """Dictionary key for a text"""
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class AnalyticsStore:
+    """
+    Base class for analytics backends.
+
+    MetricsService writes portable SQL with `?` placeholders and `{hour}` /
+    `{day}` macros for the hourly / daily bucket of `timestamp`; each store adapts it to its
+    dialect and owns schema creation, tenant resolution and raw inserts.
+    """
+
+    name = "base"
+    placeholder = "?"
+    hour_expression = ""
+    day_expression = ""
+    # Whether writes should be buffered and flushed in batches (remote databases)
+    buffered_writes = False
+
+    def __init__(self):
+        # text_hash -> text_dictionary id
+        self._text_ids: Dict[str, int] = {}
+
+    def connect(self):
+        """Open a DB-API connection (caller commits and closes)"""
+        raise NotImplementedError
+
+    def sql(self, query: str) -> str:
+        """Adapt portable SQL to this backend's dialect"""
+        query = query.replace("{hour}", self.hour_expression).replace("{day}", self.day_expression)
+        if self.placeholder != "?":
+            query = query.replace("?", self.placeholder)
+        return query
+
+    def streaming_cursor(self, conn):
+        """Cursor suitable for iterating large result sets"""
+        return conn.cursor()
+
+    def create_schema(self):
+        """Create or migrate all analytics tables"""
+        raise NotImplementedError
+
+    def tenant_key(self, org_id: str, create: bool = False) -> str:
+        """Value stored in org_id columns for a tenant identifier (created if missing when `create`)"""
+        return org_id
+
+    def new_query_id(self) -> Optional[QueryId]:
+        """Pre-assign an id for buffered writes (None if the database assigns it)"""
+        return None
+
+    def lock_row(self, cursor, table: str, *key: Any):
+        """
+        Hold a lock on a row key (present or not) until the transaction ends,
+        for read-merge-write updates. A no-op where writers are serialized:
+        a SQLite write transaction already holds the database write lock.
+        """
+
+    def insert_queries(self, cursor, rows: List[Dict[str, Any]], return_ids: bool = True) -> List[QueryId]:
+        """
+        Bulk insert raw query rows and return their ids in order.
+        Bulk loads that do not need the ids pass return_ids=False (returns []).
+        """
+        raise NotImplementedError
+
+    def intern_texts(self, cursor, texts: List[Optional[str]]) -> List[Optional[int]]:
+        """
+        Map texts to text_dictionary ids, adding unseen ones.
+        The first text seen for a normalized form is kept as its display text.
+        Callers should commit straight after so cached ids always exist.
+        """
+        hashes = [text_hash(text) if text else None for text in texts]
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key is not None and key not in self._text_ids:
+                missing.setdefault(key, text)
+
+        if missing:
+            if len(self._text_ids) + len(missing) > TEXT_CACHE_SIZE:
+                self._text_ids.clear()
+            for key, text in missing.items():
+                cursor.execute(self.sql("""
+                    INSERT INTO text_dictionary (text_hash, text) VALUES (?, ?)
+                    ON CONFLICT(text_hash) DO NOTHING
+                """), (key, text))
+            keys = list(missing)
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                cursor.execute(self.sql(f"""
+                    SELECT text_hash, id FROM text_dictionary
+                    WHERE text_hash IN ({", ".join("?" for _ in chunk)})
+                """), chunk)
+                self._text_ids.update(cursor.fetchall())
+
+        return [self._text_ids[key] if key is not None else None for key in hashes]
+
+    def backfill_text_ids(self, conn, batch_size: int = 5000) -> int:
+        """Dictionary-encode rows that still carry inline query/error text"""
+        cursor = conn.cursor()
+        total = 0
+        while True:
+            cursor.execute(self.sql("""
+                SELECT id, query_text, error_message FROM queries
+                WHERE query_text_id IS NULL AND query_text IS NOT NULL
+                LIMIT ?
+            """), (batch_size,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            query_text_ids = self.intern_texts(cursor, [row[1] for row in rows])
+            error_message_ids = self.intern_texts(cursor, [row[2] for row in rows])
+            conn.commit()
+
+            cursor.executemany(self.sql("""
+                UPDATE queries
+                SET query_text_id = ?, error_message_id = ?, query_text = NULL, error_message = NULL
+                WHERE id = ?
+            """), [(query_text_id, error_message_id, row[0])
+                   for row, query_text_id, error_message_id in zip(rows, query_text_ids, error_message_ids)])
+            conn.commit()
+            total += len(rows)
+
+        if total:
+            print(f"Migrating database: Dictionary-encoded text of {total} queries")
+        return total
+
+    def vacuum(self):
+        """Reclaim space after large deletes"""
+
+
+class SQLiteAnalyticsStore(AnalyticsStore):
+    """Local SQLite file (development and single-instance deployments)"""
+
+    name = "sqlite"
+    hour_expression = "strftime('%Y-%m-%d %H:00:00', timestamp)"
+    day_expression = "date(timestamp)"
+
+    # query_text / error_message only hold rows written before dictionary encoding
+    QUERIES_DDL = """
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            query_text TEXT,
+            query_text_id INTEGER REFERENCES text_dictionary(id),
+            response_time_ms INTEGER NOT NULL,
+            question_category TEXT,
+            source_type TEXT,
+            agent_id TEXT,
+            success BOOLEAN DEFAULT TRUE,
+            error_message TEXT,
+            error_message_id INTEGER REFERENCES text_dictionary(id),
+            tokens_used INTEGER DEFAULT 0,
+            cost_estimate REAL DEFAULT 0.0,
+            accuracy_score REAL DEFAULT 0.0,
+            aht_saved_s INTEGER DEFAULT 0,
+            org_id TEXT DEFAULT 'default'
+        )
+    """
+
+    def __init__(self, db_path: Path = SQLITE_DB_PATH):
+        super().__init__()
+        self.db_path = db_path
+
+    def connect(self):
+        return sqlite3.connect(self.db_path)
+
+    def create_schema(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        # Distinct query/error texts, keyed by a hash of the normalized text
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS text_dictionary (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text_hash TEXT NOT NULL UNIQUE,
+                text TEXT NOT NULL
+            )
+        """)
+
+        # Queries table - tracks every query
+        cursor.execute(self.QUERIES_DDL.format(table="queries"))
+
+        # Conversions table - tracks booking conversions
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                query_id INTEGER,
+                conversion_type TEXT,
+                value REAL,
+                FOREIGN KEY (query_id) REFERENCES queries(id)
+            )
+        """)
+
+        # Performance snapshots - hourly aggregated data
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS performance_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                snapshot_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                total_queries INTEGER,
+                avg_response_time_ms REAL,
+                success_rate REAL,
+                unique_agents INTEGER
+            )
+        """)
+
+        # Hourly rollups - counters plus a mergeable latency sketch per
+        # (hour, tenant, dimension, key), maintained at log time
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS hourly_rollups (
+                hour TEXT NOT NULL,
+                org_id TEXT NOT NULL,
+                dimension TEXT NOT NULL,
+                dim_key TEXT NOT NULL,
+                query_count INTEGER DEFAULT 0,
+                success_count INTEGER DEFAULT 0,
+                total_response_time_ms INTEGER DEFAULT 0,
+                tokens_used INTEGER DEFAULT 0,
+                cost_estimate REAL DEFAULT 0.0,
+                accuracy_total REAL DEFAULT 0.0,
+                accuracy_count INTEGER DEFAULT 0,
+                aht_saved_s INTEGER DEFAULT 0,
+                latency_sketch BLOB,
+                top_queries BLOB,
+                PRIMARY KEY (hour, org_id, dimension, dim_key)
+            )
+        """)
+
+        # Trend tiers at other resolutions than hourly (1m/5m expire, 1d is kept)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS trend_rollups (
+                resolution TEXT NOT NULL,
+                org_id TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                query_count INTEGER DEFAULT 0,
+                success_count INTEGER DEFAULT 0,
+                total_response_time_ms INTEGER DEFAULT 0,
+                latency_sketch BLOB,
+                PRIMARY KEY (resolution, org_id, bucket)
+            )
+        """)
+
+        # Per-request stage durations (ms), one row per traced query
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS query_stages (
+                query_id INTEGER PRIMARY KEY,
+                timestamp DATETIME NOT NULL,
+                org_id TEXT,
+                routing_ms REAL,
+                embedding_ms REAL,
+                vector_search_ms REAL,
+                llm_ms REAL,
+                places_ms REAL,
+                metrics_write_ms REAL,
+                FOREIGN KEY (query_id) REFERENCES queries(id)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_query_stages_timestamp ON query_stages(timestamp)")
+
+        # Agents table - track agent usage
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS agents (
+                agent_id TEXT PRIMARY KEY,
+                first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+                total_queries INTEGER DEFAULT 0
+            )
+        """)
+
+        # Event log batches already loaded, so replaying a segment is idempotent
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS event_log_batches (
+                batch_key TEXT PRIMARY KEY,
+                loaded_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Answers and retrieved context awaiting groundedness scoring
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS query_evaluations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                query_id INTEGER NOT NULL,
+                timestamp DATETIME NOT NULL,
+                org_id TEXT,
+                answer TEXT,
+                context TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_query_evaluations_timestamp ON query_evaluations(timestamp)")
+
+        # Resume positions of background workers
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS worker_checkpoints (
+                worker TEXT PRIMARY KEY,
+                position INTEGER DEFAULT 0,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Uploaded knowledge base documents; the row is also the ingestion job (see KBDocument)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS kb_documents (
+                doc_id TEXT PRIMARY KEY,
+                org_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                file_url TEXT NOT NULL,
+                content_hash TEXT,
+                uploaded_by TEXT,
+                uploaded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                status TEXT DEFAULT 'queued',
+                chunks_total INTEGER DEFAULT 0,
+                chunks_embedded INTEGER DEFAULT 0,
+                error_message TEXT,
+                updated_at DATETIME
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_kb_documents_org_hash ON kb_documents(org_id, content_hash)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_kb_documents_status ON kb_documents(status)")
+
+        conn.commit()
+        self._migrate(conn)
+        conn.close()
+
+    def _migrate(self, conn):
+        """Simple migration to add new columns if they don't exist"""
+        cursor = conn.cursor()
+
+        try:
+            # Check if new columns exist
+            cursor.execute("SELECT tokens_used FROM queries LIMIT 1")
+        except sqlite3.OperationalError:
+            # Add missing columns
+            print("Migrating database: Adding new metric columns...")
+            try:
+                cursor.execute("ALTER TABLE queries ADD COLUMN tokens_used INTEGER DEFAULT 0")
+                cursor.execute("ALTER TABLE queries ADD COLUMN cost_estimate REAL DEFAULT 0.0")
+                cursor.execute("ALTER TABLE queries ADD COLUMN accuracy_score REAL DEFAULT 0.0")
+                cursor.execute("ALTER TABLE queries ADD COLUMN aht_saved_s INTEGER DEFAULT 0")
+                conn.commit()
+            except Exception as e:
+                print(f"Migration warning: {e}")
+
+        try:
+            cursor.execute("SELECT org_id FROM queries LIMIT 1")
+        except sqlite3.OperationalError:
+            print("Migrating database: Adding tenant column...")
+            try:
+                cursor.execute(f"ALTER TABLE queries ADD COLUMN org_id TEXT DEFAULT '{DEFAULT_ORG_ID}'")
+                conn.commit()
+            except Exception as e:
+                print(f"Migration warning: {e}")
+
+        try:
+            cursor.execute("SELECT query_text_id FROM queries LIMIT 1")
+        except sqlite3.OperationalError:
+            # query_text was NOT NULL, which SQLite cannot relax in place: rebuild the table
+            print("Migrating database: Rebuilding queries table for dictionary-encoded text...")
+            columns = ("id, timestamp, query_text, response_time_ms, question_category, source_type, agent_id, "
+                       "success, error_message, tokens_used, cost_estimate, accuracy_score, aht_saved_s, org_id")
+            cursor.execute(self.QUERIES_DDL.format(table="queries_rebuild"))
+            cursor.execute(f"INSERT INTO queries_rebuild ({columns}) SELECT {columns} FROM queries")
+            cursor.execute("DROP TABLE queries")
+            cursor.execute("ALTER TABLE queries_rebuild RENAME TO queries")
+            conn.commit()
+
+        try:
+            cursor.execute("SELECT top_queries FROM hourly_rollups LIMIT 1")
+        except sqlite3.OperationalError:
+            print("Migrating database: Adding heavy-hitter sketches to rollups...")
+            cursor.execute("ALTER TABLE hourly_rollups ADD COLUMN top_queries BLOB")
+            conn.commit()
+
+        try:
+            cursor.execute("SELECT accuracy_count FROM hourly_rollups LIMIT 1")
+        except sqlite3.OperationalError:
+            # Every existing row was scored when it was written
+            print("Migrating database: Adding scored-query counts to rollups...")
+            cursor.execute("ALTER TABLE hourly_rollups ADD COLUMN accuracy_count INTEGER DEFAULT 0")
+            cursor.execute("UPDATE hourly_rollups SET accuracy_count = query_count")
+            conn.commit()
+
+        if self.backfill_text_ids(conn):
+            conn.execute("VACUUM")
+
+        # Every dashboard read is a tenant-scoped time window
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_queries_org_timestamp ON queries(org_id, timestamp)")
+        conn.commit()
+
+    def insert_queries(self, cursor, rows: List[Dict[str, Any]], return_ids: bool = True) -> List[QueryId]:
+        sql = f"""
+            INSERT INTO queries ({", ".join(QUERY_COLUMNS)})
+            VALUES ({", ".join("?" for _ in QUERY_COLUMNS)})
+        """
+        if not return_ids:
+            cursor.executemany(sql, (tuple(row[column] for column in QUERY_COLUMNS) for row in rows))
+            return []
+
+        # Row-at-a-time inside one transaction: a local file has no round-trip
+        # cost and this is the only way to collect every AUTOINCREMENT id
+        ids = []
+        for row in rows:
+            cursor.execute(sql, tuple(row[column] for column in QUERY_COLUMNS))
+            ids.append(cursor.lastrowid)
+        return ids
+
+    def vacuum(self):
+        conn = self.connect()
+        conn.execute("VACUUM")
+        conn.close()
+
+
+class PostgresAnalyticsStore(AnalyticsStore):
+    """
+    PostgreSQL via the shared SQLAlchemy engine.
+
+    Raw events go to the `queries` table defined by the `Query` model, range
+    partitioned by month on `timestamp`; partitions are created on demand.
+    Rows are written with multi-row INSERTs from a buffered writer.
+    """
+
+    name = "postgres"
+    placeholder = "%s"
+    hour_expression = "to_char(date_trunc('hour', timestamp), 'YYYY-MM-DD HH24:00:00')"
+    day_expression = "to_char(date_trunc('day', timestamp), 'YYYY-MM-DD')"
+    buffered_writes = True
+
+    def __init__(self):
+        super().__init__()
+        # Imported lazily so SQLite-only deployments never touch the ORM layer
+        from psycopg2.extras import execute_values
+        from app.database import engine
+        from app.models import Query
+
+        self._execute_values = execute_values
+        self.engine = engine
+        self.query_table = Query.__table__
+        self._partitions = set()
+        self._tenants: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def connect(self):
+        return self.engine.raw_connection()
+
+    def streaming_cursor(self, conn):
+        # Named cursors stream rows from the server instead of buffering them all
+        return conn.cursor(name=f"analytics_{uuid.uuid4().hex}")
+
+    def create_schema(self):
+        from app.models import Base, Organization, User, ChatSession, Query, KBDocument
+
+        # Tenant tables plus the partitioned queries parent table
+        Base.metadata.create_all(
+            self.engine,
+            tables=[Organization.__table__, User.__table__, ChatSession.__table__, Query.__table__,
+                    KBDocument.__table__],
+        )
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS text_dictionary (
+                id BIGSERIAL PRIMARY KEY,
+                text_hash TEXT NOT NULL UNIQUE,
+                text TEXT NOT NULL
+            )
+        """)
+        # Tables created before dictionary encoding
+        cursor.execute("ALTER TABLE queries ADD COLUMN IF NOT EXISTS query_text_id BIGINT")
+        cursor.execute("ALTER TABLE queries ADD COLUMN IF NOT EXISTS error_message_id BIGINT")
+        cursor.execute("ALTER TABLE queries ALTER COLUMN query_text DROP NOT NULL")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversions (
+                id BIGSERIAL PRIMARY KEY,
+                timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                query_id UUID,
+                conversion_type TEXT,
+                value DOUBLE PRECISION
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS hourly_rollups (
+                hour TEXT NOT NULL,
+                org_id TEXT NOT NULL,
+                dimension TEXT NOT NULL,
+                dim_key TEXT NOT NULL,
+                query_count BIGINT DEFAULT 0,
+                success_count BIGINT DEFAULT 0,
+                total_response_time_ms BIGINT DEFAULT 0,
+                tokens_used BIGINT DEFAULT 0,
+                cost_estimate DOUBLE PRECISION DEFAULT 0.0,
+                accuracy_total DOUBLE PRECISION DEFAULT 0.0,
+                accuracy_count BIGINT DEFAULT 0,
+                aht_saved_s BIGINT DEFAULT 0,
+                latency_sketch BYTEA,
+                top_queries BYTEA,
+                PRIMARY KEY (hour, org_id, dimension, dim_key)
+            )
+        """)
+        cursor.execute("ALTER TABLE hourly_rollups ADD COLUMN IF NOT EXISTS top_queries BYTEA")
+        # Rows that predate late-arriving accuracy scores were all scored when written
+        cursor.execute("ALTER TABLE hourly_rollups ADD COLUMN IF NOT EXISTS accuracy_count BIGINT")
+        cursor.execute("UPDATE hourly_rollups SET accuracy_count = query_count WHERE accuracy_count IS NULL")
+        cursor.execute("ALTER TABLE hourly_rollups ALTER COLUMN accuracy_count SET DEFAULT 0")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS trend_rollups (
+                resolution TEXT NOT NULL,
+                org_id TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                query_count BIGINT DEFAULT 0,
+                success_count BIGINT DEFAULT 0,
+                total_response_time_ms BIGINT DEFAULT 0,
+                latency_sketch BYTEA,
+                PRIMARY KEY (resolution, org_id, bucket)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS query_stages (
+                query_id UUID PRIMARY KEY,
+                timestamp TIMESTAMPTZ NOT NULL,
+                org_id TEXT,
+                routing_ms DOUBLE PRECISION,
+                embedding_ms DOUBLE PRECISION,
+                vector_search_ms DOUBLE PRECISION,
+                llm_ms DOUBLE PRECISION,
+                places_ms DOUBLE PRECISION,
+                metrics_write_ms DOUBLE PRECISION
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_query_stages_timestamp ON query_stages(timestamp)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS agents (
+                agent_id TEXT PRIMARY KEY,
+                first_seen TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                last_seen TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                total_queries BIGINT DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS event_log_batches (
+                batch_key TEXT PRIMARY KEY,
+                loaded_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS query_evaluations (
+                seq BIGSERIAL PRIMARY KEY,
+                query_id UUID NOT NULL,
+                timestamp TIMESTAMPTZ NOT NULL,
+                org_id TEXT,
+                answer TEXT,
+                context TEXT,
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_query_evaluations_timestamp ON query_evaluations(timestamp)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS worker_checkpoints (
+                worker TEXT PRIMARY KEY,
+                position BIGINT DEFAULT 0,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Ingestion job columns on kb_documents tables created before they existed
+        for column in ("chunks_total INTEGER DEFAULT 0", "chunks_embedded INTEGER DEFAULT 0",
+                       "error_message TEXT", "updated_at TIMESTAMPTZ"):
+            cursor.execute(f"ALTER TABLE kb_documents ADD COLUMN IF NOT EXISTS {column}")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_kb_documents_org_hash ON kb_documents(org_id, content_hash)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_kb_documents_status ON kb_documents(status)")
+        conn.commit()
+        self.backfill_text_ids(conn)
+        conn.close()
+
+        # The default tenant must exist for single-property deployments
+        self.tenant_key(DEFAULT_ORG_ID, create=True)
+
+    def tenant_key(self, org_id: str, create: bool = False) -> str:
+        """Resolve an organization slug (or UUID) to its org_id"""
+        if org_id in self._tenants:
+            return self._tenants[org_id]
+
+        try:
+            key = str(uuid.UUID(org_id))
+        except ValueError:
+            conn = self.connect()
+            cursor = conn.cursor()
+            cursor.execute("SELECT org_id FROM organizations WHERE slug = %s", (org_id,))
+            row = cursor.fetchone()
+            if row is None and create:
+                cursor.execute(
+                    "INSERT INTO organizations (org_id, name, slug) VALUES (%s, %s, %s) RETURNING org_id",
+                    (str(uuid.uuid4()), org_id, org_id),
+                )
+                row = cursor.fetchone()
+                conn.commit()
+            conn.close()
+            if row is None:
+                raise ValueError(f"Unknown organization: {org_id}")
+            key = str(row[0])
+
+        self._tenants[org_id] = key
+        return key
+
+    def new_query_id(self) -> QueryId:
+        return str(uuid.uuid4())
+
+    def lock_row(self, cursor, table: str, *key: Any):
+        # Transaction-scoped advisory lock, so rows that do not exist yet are covered too
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))",
+                       ("\0".join(str(part) for part in (table, *key)),))
+
+    def _ensure_partition(self, timestamp: datetime):
+        """
+        Create the monthly partition covering a timestamp if it is missing.
+        Committed on its own connection, and only then cached: a flush that
+        rolls back must not leave the month marked as created.
+        """
+        start = timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+        if start in self._partitions:
+            return
+
+        end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+        with self._lock:
+            if start in self._partitions:
+                return
+            conn = self.connect()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS queries_y{start.year}m{start.month:02d}
+                    PARTITION OF queries
+                    FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+                """)
+                conn.commit()
+            finally:
+                conn.close()
+            self._partitions.add(start)
+
+    def insert_queries(self, cursor, rows: List[Dict[str, Any]], return_ids: bool = True) -> List[QueryId]:
+        for timestamp in {row["timestamp"].replace(day=1, hour=0, minute=0, second=0, microsecond=0) for row in rows}:
+            self._ensure_partition(timestamp)
+
+        ids = [row.get("query_id") or self.new_query_id() for row in rows]
+        columns = ("id",) + QUERY_COLUMNS
+        # execute_values renders one multi-row INSERT per page of rows
+        self._execute_values(
+            cursor,
+            f"INSERT INTO {self.query_table.name} ({', '.join(columns)}) VALUES %s",
+            [(query_id,) + tuple(row[column] for column in QUERY_COLUMNS) for query_id, row in zip(ids, rows)],
+            page_size=1000,
+        )
+        return ids if return_ids else []
+
+    def vacuum(self):
+        # Autovacuum reclaims space on PostgreSQL; partitions are dropped whole
+        pass
+
+
+# Global instance
+_analytics_store = None
+
+def get_analytics_store() -> AnalyticsStore:
+    """Get or create the configured analytics store"""
+    global _analytics_store
+    if _analytics_store is None:
+        if ANALYTICS_BACKEND in ("postgres", "postgresql"):
+            _analytics_store = PostgresAnalyticsStore()
+        else:
+            _analytics_store = SQLiteAnalyticsStore()
+    return _analytics_store
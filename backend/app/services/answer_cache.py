@@ -0,0 +1,113 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Answer Cache
+Recent knowledge base answers by tenant and question, served while the
+vector index is still loading (see retrieval.query_rag). Questions are
+matched after lowercasing and collapsing whitespace and trailing punctuation.
+
+Tiers, checked in order:
+- Memory: per-process LRU (ANSWER_CACHE_ITEMS)
+- Redis (optional, REDIS_URL): shared by every instance, so a cold-starting
+  instance can answer what others answered recently; entries expire after
+  ANSWER_CACHE_TTL_S
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .telemetry import CACHE_REQUESTS
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+ENABLE_ANSWER_CACHE = os.getenv("ENABLE_ANSWER_CACHE", "true").lower() == "true"
+
+ANSWER_CACHE_ITEMS = int(os.getenv("ANSWER_CACHE_ITEMS", "500"))
+ANSWER_CACHE_TTL_S = int(os.getenv("ANSWER_CACHE_TTL_S", str(86400)))
+
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_KEY_PREFIX = "answer:"
+
+_SPACE = re.compile(r"\s+")
+
+
+def question_key(org_id: str, question: str) -> str:
+    normalized = _SPACE.sub(" ", question.lower()).strip().rstrip("?!. ")
+    return hashlib.sha256(f"{org_id}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """Memory LRU of recent answers, with an optional shared Redis tier"""
+
+    def __init__(self, items: int = ANSWER_CACHE_ITEMS, redis_url: Optional[str] = REDIS_URL):
+        self.items = items
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                print("Answer cache: REDIS_URL is set but the redis package is not installed")
+            else:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=1.0)
+
+    def _remember(self, key: str, result: Dict[str, Any]):
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.items:
+                self._memory.popitem(last=False)
+
+    def get(self, org_id: str, question: str) -> Optional[Dict[str, Any]]:
+        """Cached result (answer, sources, context) for a question, or None"""
+        key = question_key(org_id, question)
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+
+        if result is None and self._redis is not None:
+            try:
+                data = self._redis.get(REDIS_KEY_PREFIX + key)
+            except Exception as e:
+                # Redis is an accelerator: errors are logged and treated as misses
+                print(f"Answer cache: Redis get failed ({e})")
+                data = None
+            if data:
+                result = json.loads(data)
+                self._remember(key, result)
+
+        CACHE_REQUESTS.inc(cache="answer", result="hit" if result is not None else "miss")
+        return result
+
+    def put(self, org_id: str, question: str, result: Dict[str, Any]):
+        key = question_key(org_id, question)
+        self._remember(key, result)
+        if self._redis is not None:
+            try:
+                self._redis.set(REDIS_KEY_PREFIX + key, json.dumps(result), ex=ANSWER_CACHE_TTL_S)
+            except Exception as e:
+                print(f"Answer cache: Redis set failed ({e})")
+
+
+# Global instance
+_answer_cache = None
+_cache_lock = threading.Lock()
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Get or create the global answer cache (None when ENABLE_ANSWER_CACHE is off)"""
+    global _answer_cache
+    if not ENABLE_ANSWER_CACHE:
+        return None
+    with _cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+    return _answer_cache
@@ -7,7 +7,8 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import HTTPException, status
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.orm import Session
 from app.models import User, Organization
 import uuid
@@ -18,6 +19,8 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+bearer_scheme = HTTPBearer()
+optional_bearer_scheme = HTTPBearer(auto_error=False)
 
 class AuthService:
     """
@@ -48,7 +51,7 @@ class AuthService:
         
         to_encode.update({"exp": expire})
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-       return encoded_jwt
+        return encoded_jwt
     
     @staticmethod
     def decode_token(token: str) -> dict:
@@ -221,3 +224,24 @@ def get_auth_service() -> AuthService:
     if _auth_service is None:
         _auth_service = AuthService()
     return _auth_service
+
+
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)) -> dict:
+    """
+    FastAPI dependency: the verified token payload (user_id, org_id, org_slug, role)
+    of the calling user. Responds 401 if the token is invalid or expired.
+    """
+    return AuthService.decode_token(credentials.credentials)
+
+
+def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_bearer_scheme)
+) -> Optional[dict]:
+    """
+    FastAPI dependency for endpoints that also serve anonymous callers: the
+    verified token payload, or None without a token. Responds 401 if a token
+    is sent but invalid or expired.
+    """
+    if credentials is None:
+        return None
+    return AuthService.decode_token(credentials.credentials)
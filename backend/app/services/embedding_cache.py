@@ -0,0 +1,216 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Embedding Cache
+Content-addressed cache of embedding vectors keyed by (model, dimensions,
+sha256(text)), so identical chunk text is never embedded twice across index
+rebuilds and repeated guest questions skip the embedding round-trip.
+
+Tiers, checked in order and written through on a miss:
+- Memory: per-process LRU (EMBEDDING_CACHE_MEMORY_ITEMS)
+- Disk: SQLite file under EMBEDDING_CACHE_DIR
+- Redis (optional, REDIS_URL): shared by every instance, entries expire after
+  EMBEDDING_CACHE_REDIS_TTL_S
+
+Vectors are stored as float32, the precision the embeddings API returns.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from langchain_core.embeddings import Embeddings
+from .telemetry import CACHE_REQUESTS
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+ENABLE_EMBEDDING_CACHE = os.getenv("ENABLE_EMBEDDING_CACHE", "true").lower() == "true"
+
+EMBEDDING_CACHE_DIR = Path(os.getenv("EMBEDDING_CACHE_DIR", str(Path(__file__).parent.parent.parent / "embedding_cache")))
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+
+REDIS_URL = os.getenv("REDIS_URL")
+EMBEDDING_CACHE_REDIS_TTL_S = int(os.getenv("EMBEDDING_CACHE_REDIS_TTL_S", str(30 * 86400)))
+REDIS_KEY_PREFIX = "emb:"
+
+# Keys per SQL IN (...) lookup, below SQLite's variable limit
+_LOOKUP_CHUNK = 500
+
+
+def cache_key(model: str, dimensions: Optional[int], text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model}:{dimensions or 'default'}:{digest}"
+
+
+def _pack(vector: Sequence[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(data: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    """Memory LRU over a SQLite disk store, with an optional Redis tier"""
+
+    def __init__(self, directory: Path = EMBEDDING_CACHE_DIR, memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+                 redis_url: Optional[str] = REDIS_URL):
+        self.memory_items = memory_items
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        directory.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(directory / "embeddings.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._db.commit()
+        self._db_lock = threading.Lock()
+
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                print("Embedding cache: REDIS_URL is set but the redis package is not installed")
+            else:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=1.0)
+
+    def _remember(self, key: str, vector: List[float]):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _redis_call(self, client, method: str, *args):
+        """Redis is an accelerator: errors are logged and treated as misses"""
+        try:
+            return getattr(client, method)(*args)
+        except Exception as e:
+            print(f"Embedding cache: Redis {method} failed ({e})")
+            return None
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """Cached vectors for the keys that are present in any tier"""
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        for start in range(0, len(missing), _LOOKUP_CHUNK):
+            chunk = missing[start:start + _LOOKUP_CHUNK]
+            with self._db_lock:
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+            for key, data in rows:
+                found[key] = _unpack(data)
+                self._remember(key, found[key])
+
+        missing = [key for key in missing if key not in found]
+        if missing and self._redis is not None:
+            values = self._redis_call(self._redis, "mget", [REDIS_KEY_PREFIX + key for key in missing]) or []
+            shared = {key: _unpack(data) for key, data in zip(missing, values) if data}
+            if shared:
+                # Promote shared entries so the next lookup stays local
+                self._put_local(shared)
+                found.update(shared)
+        return found
+
+    def _put_local(self, vectors: Dict[str, List[float]]):
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, _pack(vector)) for key, vector in vectors.items()],
+            )
+            self._db.commit()
+
+    def put_many(self, vectors: Dict[str, List[float]]):
+        if not vectors:
+            return
+        self._put_local(vectors)
+        if self._redis is not None:
+            pipe = self._redis.pipeline(transaction=False)
+            for key, vector in vectors.items():
+                pipe.set(REDIS_KEY_PREFIX + key, _pack(vector), ex=EMBEDDING_CACHE_REDIS_TTL_S)
+            self._redis_call(pipe, "execute")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Drop-in Embeddings wrapper that only sends cache misses to the wrapped
+    model. Documents and queries share entries (the same model embeds both).
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.dimensions = getattr(embeddings, "dimensions", None)
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, texts: Iterable[str]) -> List[str]:
+        return [cache_key(self.model, self.dimensions, text) for text in texts]
+
+    def lookup(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Cached vector per text, or None where it would have to be embedded"""
+        keys = self.keys(texts)
+        found = self.cache.get_many(keys)
+        return [found.get(key) for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = self.keys(texts)
+        found = self.cache.get_many(keys)
+
+        # Embed each distinct missing text once
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        hits = len(texts) - sum(key in missing for key in keys)
+        self.hits += hits
+        self.misses += len(missing)
+        if hits:
+            CACHE_REQUESTS.inc(hits, cache="embedding", result="hit")
+        if missing:
+            CACHE_REQUESTS.inc(len(missing), cache="embedding", result="miss")
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            self.cache.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+# Global instance
+_embedding_cache = None
+_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Get or create the global embedding cache"""
+    global _embedding_cache
+    with _cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+def cached_embeddings(embeddings: Embeddings) -> Embeddings:
+    """Wrap an embedding model with the global cache (unless ENABLE_EMBEDDING_CACHE is off)"""
+    if not ENABLE_EMBEDDING_CACHE:
+        return embeddings
+    return CachedEmbeddings(embeddings, get_embedding_cache())
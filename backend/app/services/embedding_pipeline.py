@@ -0,0 +1,184 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Embedding Pipeline
+Ingestion stage that embeds chunks in token-bounded batches, sends batches
+concurrently under a tokens-per-minute budget and retries rate-limited or
+failed requests with exponential backoff. Completed batches are handed back
+in order of completion so the caller can write them to the index straight
+away; a run that fails part-way keeps everything written so far.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # Missing package or encoding download blocked: fall back to the ~4 characters per token estimate
+    _ENCODING = None
+
+# Batch limits: OpenAI accepts up to 2048 inputs and 300k tokens per embeddings request
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "50000"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+# Requests in flight, and the account's embedding token rate limit
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "1000000"))
+
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+EMBEDDING_BACKOFF_BASE_S = 1.0
+EMBEDDING_BACKOFF_MAX_S = 60.0
+
+
+def count_tokens(text: str) -> int:
+    """Token count under the embedding models' tokenizer"""
+    if _ENCODING is None:
+        return max(1, len(text) // 4)
+    return len(_ENCODING.encode(text, disallowed_special=()))
+
+
+def token_batches(items: Iterable[Tuple[Any, str]], max_tokens: int = EMBEDDING_BATCH_TOKENS,
+                  max_items: int = EMBEDDING_BATCH_SIZE) -> Iterator[List[Tuple[Any, str, int]]]:
+    """
+    Group (key, text) pairs into batches bounded by total tokens and count.
+    Consumes the input lazily, so only one batch is held at a time.
+    """
+    batch: List[Tuple[Any, str, int]] = []
+    batch_tokens = 0
+    for key, text in items:
+        tokens = count_tokens(text)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append((key, text, tokens))
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+class TokenBudget:
+    """Token bucket refilled continuously at tokens_per_minute (thread-safe)"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        """Block until `tokens` can be spent (a request larger than the bucket waits for a full one)"""
+        tokens = min(float(tokens), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._available >= tokens:
+                    self._available -= tokens
+                    return
+                wait_s = (tokens - self._available) / self.rate
+            time.sleep(wait_s)
+
+
+class EmbeddingStage:
+    """Concurrent, budgeted, retrying embedding of token-bounded batches"""
+
+    def __init__(
+        self,
+        embeddings,
+        concurrency: int = EMBEDDING_CONCURRENCY,
+        tokens_per_minute: int = EMBEDDING_TOKENS_PER_MINUTE,
+        max_retries: int = EMBEDDING_MAX_RETRIES
+    ):
+        self.embeddings = embeddings
+        self.concurrency = concurrency
+        self.budget = TokenBudget(tokens_per_minute)
+        self.max_retries = max_retries
+        self._retries = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, batch: Sequence[Tuple[Any, str, int]]) -> List[List[float]]:
+        texts = [text for _, text, _ in batch]
+        if hasattr(self.embeddings, "lookup"):
+            # Cached texts cost nothing, so only the misses count against the rate limit
+            cached = self.embeddings.lookup(texts)
+            tokens = sum(item_tokens for (_, _, item_tokens), vector in zip(batch, cached) if vector is None)
+        else:
+            tokens = sum(item_tokens for _, _, item_tokens in batch)
+        if tokens:
+            self.budget.acquire(tokens)
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(EMBEDDING_BACKOFF_MAX_S, EMBEDDING_BACKOFF_BASE_S * 2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"Embedding batch of {len(texts)} failed ({e}); retrying in {delay:.1f}s")
+                with self._lock:
+                    self._retries += 1
+                time.sleep(delay)
+
+    def run(
+        self,
+        batches: Iterable[List[Tuple[Any, str, int]]],
+        on_batch: Callable[[List[Tuple[Any, str, int]], List[List[float]]], None]
+    ) -> Dict[str, float]:
+        """
+        Embed batches and call on_batch(batch, vectors) from the calling
+        thread as each completes. At most 2 x concurrency batches are pending,
+        so memory stays bounded when `batches` is a generator.
+
+        Returns:
+            Totals and throughput (chunks/s, tokens/s)
+        """
+        started = time.monotonic()
+        chunks = tokens = 0
+        self._retries = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embedding") as executor:
+            pending = {}
+            batch_iter = iter(batches)
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < 2 * self.concurrency:
+                    batch = next(batch_iter, None)
+                    if batch is None:
+                        exhausted = True
+                        break
+                    pending[executor.submit(self._embed, batch)] = batch
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                error = None
+                for future in done:
+                    batch = pending.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        continue
+                    on_batch(batch, future.result())
+                    chunks += len(batch)
+                    tokens += sum(batch_tokens for _, _, batch_tokens in batch)
+                if error is not None:
+                    # Batches already written stay written; queued ones are dropped for the resumed run
+                    for future in pending:
+                        future.cancel()
+                    raise error
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        return {
+            "chunks": chunks,
+            "tokens": tokens,
+            "seconds": round(elapsed, 2),
+            "chunks_per_s": round(chunks / elapsed, 1),
+            "tokens_per_s": round(tokens / elapsed, 1),
+            "retries": self._retries,
+        }
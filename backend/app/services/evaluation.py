@@ -0,0 +1,243 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Answer Evaluation
+Background worker that scores the groundedness of logged answers against the
+passages they were generated from and writes the scores back as
+`accuracy_score`. Answers are queued by MetricsService in query_evaluations;
+the worker reads them in batches after a persisted high-water mark, so it
+resumes where it stopped and never runs on the chat request path. Scored
+answers leave the queue; unscored ones expire after
+EVALUATION_QUEUE_RETENTION_HOURS (see MetricsService).
+
+Signals (averaged):
+- Lexical: share of the answer's content words and word pairs found in the context
+- Embedding (ENABLE_EMBEDDING_GROUNDEDNESS): best cosine similarity to a passage
+- Judge (EVALUATION_JUDGE=stub|openai): LLM verdict; "stub" is an offline stand-in
+"""
+import math
+import os
+import re
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+from .embedding_cache import cached_embeddings
+from .metrics_service import get_metrics_service
+from .telemetry import ERRORS
+
+try:
+    from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+except ImportError:
+    OpenAIEmbeddings = None
+    ChatOpenAI = None
+
+# Answers scored per batch, and the sustained scoring rate across batches
+EVALUATION_BATCH_SIZE = int(os.getenv("EVALUATION_BATCH_SIZE", "50"))
+EVALUATION_MAX_PER_MINUTE = int(os.getenv("EVALUATION_MAX_PER_MINUTE", "600"))
+
+# Idle wait when nothing is queued
+EVALUATION_POLL_INTERVAL_S = 10
+
+# Queued rows younger than this are left for the next pass (see pending_evaluations)
+EVALUATION_SETTLE_S = 5
+
+# Checkpoint name in worker_checkpoints
+EVALUATION_WORKER = "accuracy_evaluation"
+
+ENABLE_EMBEDDING_GROUNDEDNESS = os.getenv("ENABLE_EMBEDDING_GROUNDEDNESS", "false").lower() == "true"
+EVALUATION_JUDGE = os.getenv("EVALUATION_JUDGE", "none").lower()
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Words that carry no evidence of grounding
+_STOPWORDS = frozenset("""
+    a an and are as at be been but by can do does for from has have how i if in into is it its
+    me my of on or our so than that the their them then there these they this to was we were
+    what when where which who will with you your
+""".split())
+
+JUDGE_PROMPT = """
+Rate how well the answer is supported by the context, from 0 (unsupported) to 1 (fully supported).
+Reply with the number only.
+
+Context:
+{context}
+
+Answer:
+{answer}
+"""
+
+
+def content_words(text: str) -> List[str]:
+    """Lowercased words with stopwords and markup removed"""
+    return [word for word in _WORD_PATTERN.findall(text.lower()) if word not in _STOPWORDS]
+
+
+def lexical_groundedness(answer: str, context: Sequence[str]) -> float:
+    """
+    Precision of the answer's words and adjacent word pairs against the
+    context (0-1). Pairs penalize answers that reuse vocabulary but not facts.
+    """
+    answer_words = content_words(answer)
+    context_words = content_words(" ".join(context))
+    if not answer_words or not context_words:
+        return 0.0
+
+    vocabulary = set(context_words)
+    word_precision = sum(word in vocabulary for word in answer_words) / len(answer_words)
+
+    answer_pairs = list(zip(answer_words, answer_words[1:]))
+    if not answer_pairs:
+        return word_precision
+    context_pairs = set(zip(context_words, context_words[1:]))
+    pair_precision = sum(pair in context_pairs for pair in answer_pairs) / len(answer_pairs)
+    return (word_precision + pair_precision) / 2
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class StubJudge:
+    """Offline stand-in for the LLM judge: deterministic, derived from lexical overlap"""
+
+    def judge(self, answer: str, context: Sequence[str]) -> float:
+        return 1.0 if lexical_groundedness(answer, context) >= 0.5 else 0.0
+
+
+class OpenAIJudge:
+    """LLM-as-judge groundedness rating"""
+
+    def __init__(self, model: str = "gpt-4o-mini"):
+        if ChatOpenAI is None:
+            raise RuntimeError("EVALUATION_JUDGE=openai requires langchain_openai")
+        self.model = ChatOpenAI(model=model, temperature=0)
+
+    def judge(self, answer: str, context: Sequence[str]) -> float:
+        reply = self.model.invoke(JUDGE_PROMPT.format(context="\n\n---\n\n".join(context), answer=answer))
+        try:
+            return min(1.0, max(0.0, float(reply.content.strip())))
+        except ValueError:
+            return 0.0
+
+
+class GroundednessScorer:
+    """Combines the enabled groundedness signals into one 0-1 score"""
+
+    def __init__(self, use_embeddings: bool = ENABLE_EMBEDDING_GROUNDEDNESS, judge: str = EVALUATION_JUDGE):
+        self.embeddings = None
+        if use_embeddings:
+            if OpenAIEmbeddings is None:
+                print("Embedding groundedness disabled: langchain_openai is not installed")
+            else:
+                # Retrieved passages are KB chunks, usually already cached by ingestion
+                self.embeddings = cached_embeddings(OpenAIEmbeddings(model="text-embedding-3-small"))
+
+        self.judge = None
+        if judge == "stub":
+            self.judge = StubJudge()
+        elif judge == "openai":
+            self.judge = OpenAIJudge()
+
+    def _embedding_scores(self, items: Sequence[Tuple[str, Sequence[str]]]) -> List[Optional[float]]:
+        """Best answer-to-passage similarity per item, embedding the whole batch in one call"""
+        texts = []
+        for answer, context in items:
+            texts.append(answer)
+            texts.extend(context)
+        vectors = iter(self.embeddings.embed_documents(texts))
+
+        scores = []
+        for _answer, context in items:
+            answer_vector = next(vectors)
+            passage_vectors = [next(vectors) for _ in context]
+            scores.append(max((_cosine(answer_vector, v) for v in passage_vectors), default=0.0))
+        return scores
+
+    def score_batch(self, items: Sequence[Tuple[str, Sequence[str]]]) -> List[float]:
+        """Groundedness of each (answer, context) pair"""
+        signals = [[lexical_groundedness(answer, context)] for answer, context in items]
+
+        if self.embeddings is not None:
+            for item_signals, score in zip(signals, self._embedding_scores(items)):
+                item_signals.append(max(0.0, score))
+
+        if self.judge is not None:
+            for item_signals, (answer, context) in zip(signals, items):
+                item_signals.append(self.judge.judge(answer, context) if context else 0.0)
+
+        return [round(sum(item_signals) / len(item_signals), 4) for item_signals in signals]
+
+
+class EvaluationWorker:
+    """Scores queued answers in rate-limited batches"""
+
+    def __init__(
+        self,
+        scorer: Optional[GroundednessScorer] = None,
+        batch_size: int = EVALUATION_BATCH_SIZE,
+        max_per_minute: int = EVALUATION_MAX_PER_MINUTE
+    ):
+        self.scorer = scorer or GroundednessScorer()
+        self.batch_size = batch_size
+        self.max_per_minute = max_per_minute
+
+    def run_once(self) -> int:
+        """
+        Score the next batch after the high-water mark.
+
+        Returns:
+            Number of answers scored
+        """
+        service = get_metrics_service()
+        position = service.get_checkpoint(EVALUATION_WORKER)
+        batch = service.pending_evaluations(position, self.batch_size, EVALUATION_SETTLE_S)
+        if not batch:
+            return 0
+
+        scores = self.scorer.score_batch([(evaluation["answer"], evaluation["context"]) for evaluation in batch])
+        for evaluation, score in zip(batch, scores):
+            evaluation["score"] = score
+
+        if not service.record_accuracy_scores(batch, EVALUATION_WORKER, position):
+            # Another instance scored this batch first
+            return 0
+        return len(batch)
+
+    def run_forever(self):
+        """Evaluation loop for the background thread"""
+        while True:
+            started = time.monotonic()
+            scored = 0
+            try:
+                scored = self.run_once()
+            except Exception as e:
+                print(f"Answer evaluation error: {e}")
+                ERRORS.inc(component="evaluation")
+
+            if scored:
+                # A batch of n answers occupies n / max_per_minute minutes
+                time.sleep(max(0.0, scored * 60.0 / self.max_per_minute - (time.monotonic() - started)))
+            else:
+                time.sleep(EVALUATION_POLL_INTERVAL_S)
+
+
+# Global instance
+_evaluation_worker = None
+
+def get_evaluation_worker() -> EvaluationWorker:
+    """Get or create the global evaluation worker"""
+    global _evaluation_worker
+    if _evaluation_worker is None:
+        _evaluation_worker = EvaluationWorker()
+    return _evaluation_worker
+
+
+def start_evaluation_worker() -> threading.Thread:
+    """Run answer evaluation in a daemon thread"""
+    thread = threading.Thread(target=get_evaluation_worker().run_forever, name="answer-evaluation", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,224 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Metrics Event Log
+Append-only segment files that turn metrics ingestion into a sequential
+buffered write. Each process appends length-prefixed records to its own open
+segment; writes are fsynced in batches and segments are rotated by size or
+age. Closed segments are loaded into the analytics store in bulk by the
+compactor (MetricsService.compact_event_log) and then deleted. Segments left
+open by a crashed process are closed on the next startup and replayed.
+"""
+import atexit
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+EVENT_LOG_DIR = Path(os.getenv("METRICS_EVENT_LOG_DIR", str(Path(__file__).parent.parent.parent / "metrics_log")))
+
+# A segment is closed once it reaches either limit
+SEGMENT_MAX_BYTES = int(os.getenv("METRICS_SEGMENT_MAX_BYTES", str(16 * 1024 * 1024)))
+SEGMENT_MAX_AGE_S = float(os.getenv("METRICS_SEGMENT_MAX_AGE_S", "5"))
+
+# Appended records are fsynced together at this interval (the crash-loss window)
+FSYNC_INTERVAL_S = float(os.getenv("METRICS_FSYNC_INTERVAL_S", "0.2"))
+
+# Record header: payload length and CRC32 of the payload
+RECORD_HEADER = struct.Struct("<II")
+
+OPEN_SUFFIX = ".open"
+CLOSED_SUFFIX = ".log"
+
+
+def _try_lock(f) -> bool:
+    """Take an exclusive non-blocking lock on an open file"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def read_segment(path: Path) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Yield (offset, event) for each record in a segment.
+    Reading stops at a truncated or corrupt record, which can only be the
+    unsynced tail of a segment whose writer crashed.
+    """
+    with open(path, "rb") as f:
+        offset = 0
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < RECORD_HEADER.size:
+                break
+            length, checksum = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            yield offset, json.loads(payload)
+            offset += RECORD_HEADER.size + length
+    print(f"Metrics event log: ignoring torn tail of {path.name} at offset {offset}")
+
+
+class SegmentLog:
+    """Per-process writer for the segmented metrics event log (thread-safe)"""
+
+    def __init__(
+        self,
+        log_dir: Path = EVENT_LOG_DIR,
+        max_bytes: int = SEGMENT_MAX_BYTES,
+        max_age_s: float = SEGMENT_MAX_AGE_S,
+        fsync_interval_s: float = FSYNC_INTERVAL_S
+    ):
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.fsync_interval_s = fsync_interval_s
+
+        # Host and pid keep segment names unique across instances sharing a directory
+        self.prefix = f"segment-{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
+        self._seq = 0
+        self._file = None
+        self._path: Optional[Path] = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        self.recover()
+
+        self._thread = threading.Thread(target=self._run, name="metrics-event-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def recover(self) -> int:
+        """Close segments whose writer is gone so the compactor picks them up"""
+        recovered = 0
+        for path in self.log_dir.glob(f"segment-*{OPEN_SUFFIX}"):
+            if path == self._path:
+                continue
+            try:
+                with open(path, "ab") as f:
+                    # A live writer holds the lock on its open segment
+                    if not _try_lock(f):
+                        continue
+                    os.replace(path, path.with_suffix(CLOSED_SUFFIX))
+                    recovered += 1
+            except FileNotFoundError:
+                continue
+        if recovered:
+            print(f"Metrics event log: recovered {recovered} unclosed segments")
+        return recovered
+
+    def _open_segment(self):
+        self._path = self.log_dir / f"{self.prefix}-{self._seq:06d}{OPEN_SUFFIX}"
+        self._file = open(self._path, "ab")
+        _try_lock(self._file)
+        self._size = 0
+        self._opened_at = time.monotonic()
+
+    def _sync(self):
+        if self._dirty:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def _rotate(self):
+        """Sync and close the open segment, making it visible to the compactor"""
+        self._sync()
+        self._file.close()
+        os.replace(self._path, self._path.with_suffix(CLOSED_SUFFIX))
+        self._file = None
+        self._path = None
+        self._seq += 1
+
+    def append(self, event: Dict[str, Any]):
+        """Append one event (durable after the next fsync batch)"""
+        payload = json.dumps(event, default=str, separators=(",", ":")).encode("utf-8")
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(record)
+            self._size += len(record)
+            self._dirty = True
+            if self._size >= self.max_bytes:
+                self._rotate()
+
+    def _run(self):
+        while True:
+            time.sleep(self.fsync_interval_s)
+            try:
+                with self._lock:
+                    if self._file is None:
+                        continue
+                    self._sync()
+                    # Idle segments are closed too, so events never wait on traffic to be loaded
+                    if time.monotonic() - self._opened_at >= self.max_age_s:
+                        self._rotate()
+            except Exception as e:
+                print(f"Metrics event log sync error: {e}")
+
+    def close(self):
+        """Close the open segment (called at exit)"""
+        with self._lock:
+            if self._file is not None:
+                self._rotate()
+
+    def closed_segments(self) -> List[Path]:
+        """Segments ready for compaction, oldest first"""
+        paths = []
+        for path in self.log_dir.glob(f"segment-*{CLOSED_SUFFIX}"):
+            try:
+                paths.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        return [path for _, path in sorted(paths)]
+
+    def pending(self) -> int:
+        return len(self.closed_segments())
+
+    @contextmanager
+    def claim(self, path: Path):
+        """
+        Lock a closed segment for compaction. Yields False if another
+        compactor holds it or it is already gone.
+        """
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            yield False
+            return
+        try:
+            yield _try_lock(f) and path.exists()
+        finally:
+            f.close()
+
+
+# Global instance
+_event_log = None
+
+def get_event_log() -> SegmentLog:
+    """Get or create the global metrics event log"""
+    global _event_log
+    if _event_log is None:
+        _event_log = SegmentLog()
+    return _event_log
@@ -1,115 +1,426 @@
 """
 Utility module for Google Cloud Storage operations.
-Handles downloading and caching the ChromaDB vector database from GCS.
+Syncs vector index versions (see index_versions) between the local index root and GCS.
+
+Bucket layout:
+    vector_indexes/CURRENT                  name of the live version
+    vector_indexes/<version>/manifest.json  index version and its files: path, size, md5
+    vector_indexes/objects/<md5>            file contents, stored once per distinct file
+
+Files are content-addressed, so an upload only sends files that no earlier
+version already stored, and a download only fetches files that differ from
+the local live version. Transfers run concurrently on a thread pool and every
+file is checked against the manifest. A download is assembled in a staging
+directory, then renamed into place and published atomically.
+
+Each version also has a snapshot, vector_indexes/<version>/snapshot.tar.zst:
+the whole index as one zstd-compressed tar, followed by a footer holding the
+SHA-256 and length of the compressed bytes. A cold start (no local index)
+fetches it in a single request, extracting while it downloads, and only
+publishes the version once the footer checks out. Instances that already
+have an index sync file by file.
+
+Buckets that only hold the legacy chroma_db_v2/ prefix are installed the same way.
+Running instances poll the CURRENT object (GCSIndexPoller) and sync when it changes.
+
+Uploaded knowledge base files are kept under kb_uploads/ (see
+GCSKnowledgeBase), so any instance can run or resume their ingestion jobs.
 """
+import base64
+import hashlib
+import json
 import os
 import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Optional, Tuple
 from google.cloud import storage
+from .index_versions import INDEX_ROOT, RETIRED_MARKER, current_index_path, current_version, publish
+from .telemetry import UPSTREAM_LATENCY, ERRORS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # GCS Configuration
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "hotel-agent-vectordb")
-GCS_DB_PATH = "chroma_db_v2"  # Path in bucket
-LOCAL_DB_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "chroma_db_v2")
+GCS_INDEX_PREFIX = "vector_indexes"  # Path in bucket
+GCS_DB_PATH = "chroma_db_v2"  # Legacy path in bucket
+GCS_KB_UPLOAD_PREFIX = "kb_uploads"  # Uploaded knowledge base files
+
+# Concurrent transfers; per-object latency rather than bandwidth dominates serial sync
+GCS_SYNC_WORKERS = int(os.getenv("GCS_SYNC_WORKERS", "8"))
+
+GCS_SNAPSHOT_ZSTD_LEVEL = int(os.getenv("GCS_SNAPSHOT_ZSTD_LEVEL", "6"))
+
+SNAPSHOT_NAME = "snapshot.tar.zst"
+# Snapshot footer: magic, SHA-256 of the compressed bytes before it, their length
+SNAPSHOT_FOOTER = struct.Struct(">8s32sQ")
+SNAPSHOT_MAGIC = b"IDXSNAP1"
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+_sync_lock = threading.Lock()
+
+
+def _md5(path: str, copy_to: Optional[str] = None) -> str:
+    """Hex md5 of a file, optionally copying it to `copy_to` in the same pass"""
+    digest = hashlib.md5()
+    with open(path, "rb") as src:
+        dst = open(copy_to, "wb") if copy_to else None
+        try:
+            for block in iter(lambda: src.read(_HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+                if dst:
+                    dst.write(block)
+        finally:
+            if dst:
+                dst.close()
+    return digest.hexdigest()
+
+
+def build_manifest(index_path: str, version: str) -> Dict:
+    """Manifest of an index directory: version and {relative path: {size, md5}}"""
+    paths = []
+    for root, _dirs, files in os.walk(index_path):
+        for file in files:
+            if file != RETIRED_MARKER:
+                paths.append(os.path.relpath(os.path.join(root, file), index_path).replace(os.sep, "/"))
+    with ThreadPoolExecutor(max_workers=GCS_SYNC_WORKERS) as executor:
+        digests = executor.map(lambda rel: _md5(os.path.join(index_path, rel)), paths)
+        files = {
+            rel: {"size": os.path.getsize(os.path.join(index_path, rel)), "md5": md5}
+            for rel, md5 in zip(paths, digests)
+        }
+    return {"version": version, "created_at": datetime.now().isoformat(), "files": files}
+
+
+def _manifest_digest(files: Dict[str, Dict]) -> str:
+    return hashlib.md5(json.dumps(files, sort_keys=True).encode()).hexdigest()[:8]
+
+
+class _HashingWriter:
+    """Write-through file wrapper that hashes and counts what passes through"""
+
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self.digest = hashlib.sha256()
+        self.length = 0
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        self.length += len(data)
+        return self.raw.write(data)
+
+
+class _FooterReader:
+    """Read-through stream wrapper that hashes the payload and holds back the snapshot footer"""
+
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self.digest = hashlib.sha256()
+        self.length = 0
+        self._tail = b""
+        self._eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._tail) < size + SNAPSHOT_FOOTER.size):
+            block = self.raw.read(max(size, _HASH_BLOCK_SIZE))
+            self._eof = not block
+            self._tail += block
+        available = len(self._tail) - SNAPSHOT_FOOTER.size
+        count = max(0, available if size < 0 else min(size, available))
+        data, self._tail = self._tail[:count], self._tail[count:]
+        self.digest.update(data)
+        self.length += len(data)
+        return data
+
+    def verify(self):
+        """Consume the rest of the stream and check the footer"""
+        while self.read(_HASH_BLOCK_SIZE):
+            pass
+        if len(self._tail) != SNAPSHOT_FOOTER.size:
+            raise ValueError("Snapshot footer missing")
+        magic, sha256, length = SNAPSHOT_FOOTER.unpack(self._tail)
+        if magic != SNAPSHOT_MAGIC or sha256 != self.digest.digest() or length != self.length:
+            raise ValueError("Snapshot integrity check failed")
+
+
+def write_snapshot(index_path: str, files: Dict[str, Dict], out_path: str) -> Dict[str, Any]:
+    """Write a snapshot of the manifest's files to out_path; returns its size and SHA-256"""
+    with open(out_path, "wb") as raw:
+        hashing = _HashingWriter(raw)
+        compressor = zstandard.ZstdCompressor(level=GCS_SNAPSHOT_ZSTD_LEVEL, threads=-1, write_checksum=True)
+        with compressor.stream_writer(hashing, closefd=False) as compressed:
+            with tarfile.open(fileobj=compressed, mode="w|") as tar:
+                for rel in sorted(files):
+                    tar.add(os.path.join(index_path, rel), arcname=rel, recursive=False)
+        raw.write(SNAPSHOT_FOOTER.pack(SNAPSHOT_MAGIC, hashing.digest.digest(), hashing.length))
+    return {"size": hashing.length + SNAPSHOT_FOOTER.size, "sha256": hashing.digest.hexdigest()}
+
+
+def extract_snapshot(stream: BinaryIO, target: Path):
+    """Extract a snapshot stream into target as it is read, then verify its footer"""
+    reader = _FooterReader(stream)
+    with zstandard.ZstdDecompressor().stream_reader(reader, read_across_frames=False, closefd=False) as decompressed:
+        with tarfile.open(fileobj=decompressed, mode="r|") as tar:
+            tar.extractall(target, filter="data")
+    reader.verify()
+
+
+def _install(version: str, fill: Callable[[Path], Any], root: Path = INDEX_ROOT) -> Any:
+    """Build `version` in a staging directory with fill(staging), then move it into place and publish it"""
+    target = root / version
+    staging = root / f".{version}.partial"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    try:
+        result = fill(staging)
+        if target.exists():
+            # An unpublished leftover of the same version (the live one is never rebuilt)
+            shutil.rmtree(target)
+        os.rename(staging, target)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    publish(version, root)
+    return result
+
+
+def _sync_files(staging: Path, files: Dict[str, Dict], blob_for: Callable[[str, Dict], storage.Blob],
+                base: Optional[str]) -> Tuple[int, int]:
+    """
+    Fill staging with `files`, copying those unchanged from `base` and
+    downloading the rest concurrently, each verified against the manifest.
+
+    Returns:
+        (files downloaded, bytes downloaded)
+    """
+
+    def fetch(item: Tuple[str, Dict]) -> Optional[int]:
+        rel, meta = item
+        dst = staging / rel
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if base:
+            # Unchanged files are copied locally (verified while copying) instead of downloaded
+            src = os.path.join(base, rel)
+            if os.path.isfile(src) and os.path.getsize(src) == meta["size"] and _md5(src, str(dst)) == meta["md5"]:
+                return None
+        with UPSTREAM_LATENCY.time(service="gcs", operation="download"):
+            blob_for(rel, meta).download_to_filename(str(dst))
+        if os.path.getsize(dst) != meta["size"] or (meta["md5"] and _md5(str(dst)) != meta["md5"]):
+            raise ValueError(f"Checksum mismatch for {rel}")
+        return meta["size"]
 
-def download_vector_db_from_gcs():
+    with ThreadPoolExecutor(max_workers=GCS_SYNC_WORKERS, thread_name_prefix="gcs-sync") as executor:
+        sizes = [size for size in executor.map(fetch, files.items()) if size is not None]
+    return len(sizes), sum(sizes)
+
+
+def _legacy_files(bucket: storage.Bucket) -> Dict[str, Dict]:
+    """Manifest entries for the legacy chroma_db_v2/ prefix, from the object listing"""
+    files = {}
+    for blob in bucket.list_blobs(prefix=f"{GCS_DB_PATH}/"):
+        relative_path = blob.name[len(GCS_DB_PATH) + 1:]
+        if not relative_path or blob.name.endswith("/"):
+            continue
+        # Composite objects have no md5; they are verified by size only
+        md5 = base64.b64decode(blob.md5_hash).hex() if blob.md5_hash else ""
+        files[relative_path] = {"size": blob.size, "md5": md5}
+    return files
+
+
+def download_vector_db_from_gcs(root: Path = INDEX_ROOT):
     """
-    Download the vector database from Google Cloud Storage to local filesystem.
+    Bring the local index up to date with the live version in GCS.
     Returns True if successful, False otherwise.
     """
     try:
-        # Check if DB already exists locally
-        if os.path.exists(LOCAL_DB_PATH) and os.listdir(LOCAL_DB_PATH):
-            print(f"Vector DB already exists at {LOCAL_DB_PATH}")
+        with _sync_lock:
+            storage_client = storage.Client()
+            bucket = storage_client.bucket(GCS_BUCKET_NAME)
+
+            pointer = bucket.blob(f"{GCS_INDEX_PREFIX}/CURRENT")
+            if pointer.exists():
+                version = pointer.download_as_text().strip()
+                if version == current_version(root):
+                    print(f"Vector index {version} is up to date")
+                    return True
+                manifest = json.loads(bucket.blob(f"{GCS_INDEX_PREFIX}/{version}/manifest.json").download_as_text())
+                if manifest.get("source_version") and manifest["source_version"] == current_version(root):
+                    # Uploaded from this index root (e.g. by an ingestion job here)
+                    print(f"Vector index {version} is up to date")
+                    return True
+                files = manifest["files"]
+                if current_index_path(root) is None and manifest.get("snapshot") and zstandard is not None:
+                    try:
+                        snapshot = manifest["snapshot"]
+                        print(f"Fetching vector index {version} snapshot ({snapshot['size'] / 1e6:.1f} MB)")
+                        with UPSTREAM_LATENCY.time(service="gcs", operation="download"):
+                            with bucket.blob(snapshot["object"]).open("rb", chunk_size=8 * 1024 * 1024) as stream:
+                                _install(version, lambda staging: extract_snapshot(stream, staging), root)
+                        print(f"✓ Vector index {version} installed from snapshot")
+                        return True
+                    except Exception as e:
+                        print(f"Snapshot install failed ({e}); syncing files instead")
+                        ERRORS.inc(component="gcs")
+                blob_for = lambda rel, meta: bucket.blob(f"{GCS_INDEX_PREFIX}/objects/{meta['md5']}")
+            else:
+                files = _legacy_files(bucket)
+                if not files:
+                    print(f"✗ No vector index found in GCS bucket: {GCS_BUCKET_NAME}")
+                    return False
+                version = f"gcs-{_manifest_digest(files)}"
+                if version == current_version(root):
+                    print(f"Vector index {version} is up to date")
+                    return True
+                blob_for = lambda rel, meta: bucket.blob(f"{GCS_DB_PATH}/{rel}")
+
+            print(f"Syncing vector index {version} from GCS bucket: {GCS_BUCKET_NAME}")
+            base = current_index_path(root)
+            downloaded, size = _install(version, lambda staging: _sync_files(staging, files, blob_for, base), root)
+            print(f"✓ Vector index {version} installed: {downloaded} of {len(files)} files "
+                  f"downloaded ({size / 1e6:.1f} MB)")
             return True
-        
-        print(f"Downloading vector DB from GCS bucket: {GCS_BUCKET_NAME}")
-        
-        # Initialize GCS client
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(GCS_BUCKET_NAME)
-        
-        # Create local directory
-        os.makedirs(LOCAL_DB_PATH, exist_ok=True)
-        
-        # List all blobs in the chroma_db_v2 folder
-        blobs = bucket.list_blobs(prefix=f"{GCS_DB_PATH}/")
-        
-        downloaded_count = 0
-        for blob in blobs:
-            # Skip directory markers
-            if blob.name.endswith('/'):
-                continue
-            
-            # Get relative path within chroma_db_v2
-            relative_path = blob.name[len(GCS_DB_PATH)+1:]  # Remove prefix
-            if not relative_path:
-                continue
-            
-            # Full local path
-            local_file_path = os.path.join(LOCAL_DB_PATH, relative_path)
-            
-            # Create parent directories if needed
-            os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-            
-            # Download the file
-            blob.download_to_filename(local_file_path)
-            downloaded_count += 1
-            print(f"  Downloaded: {relative_path}")
-        
-        print(f"✓ Successfully downloaded {downloaded_count} files from GCS")
-        return True
-        
+
     except Exception as e:
         print(f"✗ Error downloading vector DB from GCS: {e}")
+        ERRORS.inc(component="gcs")
         return False
 
 def upload_vector_db_to_gcs(local_db_path=None):
     """
-    Upload the local vector database to Google Cloud Storage.
-    
+    Upload a local index directory to Google Cloud Storage and make it the live version.
+
     Args:
-        local_db_path: Path to the local chroma_db_v2 directory. 
-                      Defaults to LOCAL_DB_PATH.
-    
+        local_db_path: Path to the local index directory.
+                      Defaults to the live local version.
+
     Returns:
         True if successful, False otherwise.
     """
     if local_db_path is None:
-        local_db_path = LOCAL_DB_PATH
-    
+        local_db_path = current_index_path()
+
     try:
-        if not os.path.exists(local_db_path):
+        if not local_db_path or not os.path.exists(local_db_path):
             print(f"✗ Local vector DB not found at {local_db_path}")
             return False
-        
+
         print(f"Uploading vector DB to GCS bucket: {GCS_BUCKET_NAME}")
-        
+
         # Initialize GCS client
         storage_client = storage.Client()
         bucket = storage_client.bucket(GCS_BUCKET_NAME)
-        
-        # Walk through all files in the directory
-        uploaded_count = 0
-        for root, dirs, files in os.walk(local_db_path):
-            for file in files:
-                local_file = os.path.join(root, file)
-                
-                # Get relative path from local_db_path
-                relative_path = os.path.relpath(local_file, local_db_path)
-                
-                # GCS blob path
-                blob_path = f"{GCS_DB_PATH}/{relative_path.replace(os.sep, '/')}"
-                
-                # Upload
-                blob = bucket.blob(blob_path)
-                blob.upload_from_filename(local_file)
-                uploaded_count += 1
-                print(f"  Uploaded: {relative_path}")
-        
-        print(f"✓ Successfully uploaded {uploaded_count} files to GCS")
+
+        # Remote versions are named by content, since a local version can be appended to in place
+        name = os.path.basename(os.path.normpath(local_db_path))
+        manifest = build_manifest(local_db_path, name)
+        version = manifest["version"] = f"{name}-{_manifest_digest(manifest['files'])}"
+        manifest["source_version"] = name
+
+        stored = {blob.name.rsplit("/", 1)[-1] for blob in bucket.list_blobs(prefix=f"{GCS_INDEX_PREFIX}/objects/")}
+        missing = {meta["md5"]: rel for rel, meta in manifest["files"].items() if meta["md5"] not in stored}
+
+        def upload(item):
+            md5, rel = item
+            blob = bucket.blob(f"{GCS_INDEX_PREFIX}/objects/{md5}")
+            # GCS rejects the upload if the received bytes do not match
+            blob.md5_hash = base64.b64encode(bytes.fromhex(md5)).decode()
+            with UPSTREAM_LATENCY.time(service="gcs", operation="upload"):
+                blob.upload_from_filename(os.path.join(local_db_path, rel))
+            return manifest["files"][rel]["size"]
+
+        with ThreadPoolExecutor(max_workers=GCS_SYNC_WORKERS, thread_name_prefix="gcs-sync") as executor:
+            uploaded_bytes = sum(executor.map(upload, missing.items()))
+
+        if zstandard is not None:
+            with tempfile.TemporaryDirectory() as tmp:
+                snapshot_path = os.path.join(tmp, SNAPSHOT_NAME)
+                snapshot = write_snapshot(local_db_path, manifest["files"], snapshot_path)
+                snapshot["object"] = f"{GCS_INDEX_PREFIX}/{version}/{SNAPSHOT_NAME}"
+                with UPSTREAM_LATENCY.time(service="gcs", operation="upload"):
+                    bucket.blob(snapshot["object"]).upload_from_filename(snapshot_path)
+            manifest["snapshot"] = snapshot
+            index_size = sum(meta["size"] for meta in manifest["files"].values())
+            print(f"  Snapshot: {snapshot['size'] / 1e6:.1f} MB ({index_size / max(snapshot['size'], 1):.1f}x compression)")
+        else:
+            print("  zstandard not installed; snapshot skipped")
+
+        # The manifest before the pointer, so CURRENT never names an incomplete version
+        bucket.blob(f"{GCS_INDEX_PREFIX}/{version}/manifest.json").upload_from_string(
+            json.dumps(manifest, indent=2), content_type="application/json")
+        bucket.blob(f"{GCS_INDEX_PREFIX}/CURRENT").upload_from_string(version)
+
+        print(f"✓ Uploaded vector index {version}: {len(missing)} of {len(manifest['files'])} files "
+              f"({uploaded_bytes / 1e6:.1f} MB) were new")
         return True
-        
+
     except Exception as e:
         print(f"✗ Error uploading vector DB to GCS: {e}")
+        ERRORS.inc(component="gcs")
         return False
+
+
+class GCSIndexPoller:
+    """
+    Index watcher hook (see IndexManager.watch_forever): reads the metadata of
+    the CURRENT pointer object and runs the sync only when it has changed, so
+    versions uploaded to GCS reach running instances.
+    """
+
+    def __init__(self, root: Path = INDEX_ROOT):
+        self.root = root
+        self.generation = None
+        self._bucket = None
+
+    def __call__(self) -> bool:
+        """
+        Returns:
+            Whether the pointer changed (and a sync ran)
+        """
+        if self._bucket is None:
+            self._bucket = storage.Client().bucket(GCS_BUCKET_NAME)
+        with UPSTREAM_LATENCY.time(service="gcs", operation="poll"):
+            pointer = self._bucket.get_blob(f"{GCS_INDEX_PREFIX}/CURRENT")
+        if pointer is None or pointer.generation == self.generation:
+            return False
+        if download_vector_db_from_gcs(self.root):
+            self.generation = pointer.generation
+        return True
+
+
+class GCSKnowledgeBase:
+    """
+    Shared state for knowledge base ingestion jobs on Cloud Run, where each
+    instance has its own disk: the live index version and the uploaded files.
+    """
+
+    def pull(self, root: Path = INDEX_ROOT) -> bool:
+        """Bring the local index up to date with the live version in GCS"""
+        return download_vector_db_from_gcs(root)
+
+    def push(self, index_path: str) -> bool:
+        """Upload a published local version and make it live in GCS"""
+        return upload_vector_db_to_gcs(index_path)
+
+    def save_file(self, local_path: str, name: str) -> str:
+        """Store an uploaded file; returns its gs:// URL"""
+        blob = storage.Client().bucket(GCS_BUCKET_NAME).blob(f"{GCS_KB_UPLOAD_PREFIX}/{name}")
+        with UPSTREAM_LATENCY.time(service="gcs", operation="upload"):
+            blob.upload_from_filename(local_path)
+        return f"gs://{GCS_BUCKET_NAME}/{blob.name}"
+
+    def load_file(self, url: str, local_path: str):
+        """Download a file stored by save_file"""
+        bucket_name, _, name = url[len("gs://"):].partition("/")
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with UPSTREAM_LATENCY.time(service="gcs", operation="download"):
+            storage.Client().bucket(bucket_name).blob(name).download_to_filename(local_path + ".partial")
+        os.replace(local_path + ".partial", local_path)
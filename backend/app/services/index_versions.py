@@ -0,0 +1,261 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Vector Index Versions
+Blue/green management of the Chroma index. Each build is written to its own
+directory under VECTOR_INDEX_ROOT; the CURRENT file names the live version and
+is replaced atomically on publish. Serving processes watch CURRENT, open and
+warm the new version off the request path, then swap it in; requests already
+running finish on the version they started with. Superseded versions are
+deleted once they have been retired for INDEX_GC_GRACE_S.
+
+At startup the index is fetched and opened in the background
+(start_index_loader), so the API serves before it is ready.
+
+Before the first publish, the legacy single-directory index (chroma_db_v2)
+is served as is.
+
+Rebuilds start from a copy of the current version, so they stay incremental.
+Upload jobs do the same for each document (see ingestion_jobs), and queue
+their documents again if a version published without them goes live.
+"""
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain_chroma import Chroma
+from .telemetry import ERRORS
+
+BACKEND_DIR = Path(__file__).parent.parent.parent
+INDEX_ROOT = Path(os.getenv("VECTOR_INDEX_ROOT", str(BACKEND_DIR / "vector_indexes")))
+LEGACY_INDEX_PATH = BACKEND_DIR / "chroma_db_v2"
+
+CURRENT_POINTER = "CURRENT"
+# Written into a version when it is superseded; its mtime starts the grace period
+RETIRED_MARKER = ".retired"
+
+INDEX_POLL_INTERVAL_S = float(os.getenv("INDEX_POLL_INTERVAL_S", "10"))
+INDEX_GC_GRACE_S = int(os.getenv("INDEX_GC_GRACE_S", "900"))
+
+_publish_lock = threading.Lock()
+
+
+def current_version(root: Path = INDEX_ROOT) -> Optional[str]:
+    try:
+        return (root / CURRENT_POINTER).read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_index_path(root: Path = INDEX_ROOT) -> Optional[str]:
+    """Directory of the live index (the legacy directory until a version is published)"""
+    version = current_version(root)
+    if version and (root / version).is_dir():
+        return str(root / version)
+    if root == INDEX_ROOT and LEGACY_INDEX_PATH.is_dir() and any(LEGACY_INDEX_PATH.iterdir()):
+        return str(LEGACY_INDEX_PATH)
+    return None
+
+
+def new_version(root: Path = INDEX_ROOT, base: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Create an unpublished version directory, seeded with a copy of `base`
+    (an index directory) when given.
+
+    Returns:
+        (version, path)
+    """
+    version = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    path = root / version
+    if base:
+        shutil.copytree(base, path, ignore=shutil.ignore_patterns(RETIRED_MARKER))
+    else:
+        path.mkdir(parents=True)
+    return version, str(path)
+
+
+def publish(version: str, root: Path = INDEX_ROOT):
+    """Atomically make `version` the live index and retire the previous one"""
+    if not (root / version).is_dir():
+        raise ValueError(f"Unknown index version: {version}")
+    with _publish_lock:
+        previous = current_version(root)
+        tmp = root / f"{CURRENT_POINTER}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(version + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, root / CURRENT_POINTER)
+        if previous and previous != version and (root / previous).is_dir():
+            (root / previous / RETIRED_MARKER).write_text(datetime.now().isoformat(), encoding="utf-8")
+    print(f"Published vector index {version} (previous: {previous or 'none'})")
+
+
+def collect_garbage(root: Path = INDEX_ROOT, grace_s: float = INDEX_GC_GRACE_S, keep: Iterable[str] = ()) -> List[str]:
+    """Delete versions retired for longer than grace_s (never the current one or `keep` paths)"""
+    if not root.is_dir():
+        return []
+    current = current_version(root)
+    keep = {os.path.realpath(path) for path in keep}
+    removed = []
+    for entry in root.iterdir():
+        marker = entry / RETIRED_MARKER
+        if (not entry.is_dir() or entry.name == current or os.path.realpath(entry) in keep
+                or not marker.exists() or time.time() - marker.stat().st_mtime < grace_s):
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        removed.append(entry.name)
+        print(f"Removed retired vector index {entry.name}")
+    return removed
+
+
+def warm(db: Chroma) -> int:
+    """
+    Load a collection's vector index into memory with one search, so the
+    first request after a swap does not pay for it.
+
+    Returns:
+        Number of chunks in the collection
+    """
+    count = db._collection.count()
+    if count:
+        sample = db._collection.get(limit=1, include=["embeddings"])["embeddings"]
+        db.similarity_search_by_vector(list(sample[0]), k=1)
+    return count
+
+
+class IndexManager:
+    """Holds the serving process's open index and hot-swaps it to new versions"""
+
+    def __init__(self, root: Path = INDEX_ROOT):
+        self.root = root
+        self._active: Optional[Tuple[str, Chroma]] = None
+        self._lock = threading.Lock()
+        # Startup phase, set by load(): fetching, loading, ready or unavailable
+        self.phase: Optional[str] = None
+
+    @property
+    def active_path(self) -> Optional[str]:
+        active = self._active
+        return active[0] if active else None
+
+    @property
+    def loading(self) -> bool:
+        return self.phase in ("fetching", "loading")
+
+    def get(self) -> Optional[Chroma]:
+        """The live index (opened on first use), or None if none exists or it is still loading"""
+        active = self._active
+        if active is None and not self.loading:
+            self.refresh()
+            active = self._active
+        return active[1] if active else None
+
+    def refresh(self) -> bool:
+        """
+        Open, validate and warm the current version if it changed, then swap
+        it in. Queries search by vector, so no embedding function is attached.
+
+        Returns:
+            Whether the index was swapped
+        """
+        path = current_index_path(self.root)
+        if path is None or path == self.active_path:
+            return False
+        with self._lock:
+            if path == self.active_path:
+                return False
+            started = time.monotonic()
+            db = Chroma(persist_directory=path)
+            count = warm(db)
+            if count == 0 and self._active is not None:
+                print(f"Not swapping to empty vector index {path}")
+                return False
+            self._active = (path, db)
+            if self.phase is not None:
+                self.phase = "ready"
+        print(f"✓ Vector index {os.path.basename(path)} live ({count} chunks, warmed in {time.monotonic() - started:.2f}s)")
+        return True
+
+    def load(self, fetch: Optional[Callable[[], bool]] = None) -> Dict[str, float]:
+        """
+        Startup: run fetch (e.g. the GCS sync), then open and warm the live
+        index. Logs and returns the seconds spent in each phase.
+        """
+        timings = {}
+        if fetch is not None:
+            self.phase = "fetching"
+            started = time.monotonic()
+            fetch()
+            timings["fetch"] = time.monotonic() - started
+        self.phase = "loading"
+        started = time.monotonic()
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"✗ Error loading vector index: {e}")
+            ERRORS.inc(component="index")
+        timings["open"] = time.monotonic() - started
+        self.phase = "ready" if self._active is not None else "unavailable"
+        print(f"Vector index {self.phase}: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
+        return timings
+
+    def watch_forever(self, poll: Optional[Callable[[], bool]] = None):
+        """
+        Watcher loop for the background thread
+
+        Args:
+            poll: Called first on every pass to bring in versions published elsewhere (e.g. GCSIndexPoller)
+        """
+        while True:
+            try:
+                if poll is not None:
+                    poll()
+                self.refresh()
+                collect_garbage(self.root, keep=[self.active_path] if self.active_path else [])
+            except Exception as e:
+                print(f"Vector index watcher error: {e}")
+                ERRORS.inc(component="index")
+            time.sleep(INDEX_POLL_INTERVAL_S)
+
+
+# Global instance
+_index_manager = None
+_manager_lock = threading.Lock()
+
+def get_index_manager() -> IndexManager:
+    """Get or create the global index manager"""
+    global _index_manager
+    with _manager_lock:
+        if _index_manager is None:
+            _index_manager = IndexManager()
+    return _index_manager
+
+
+def start_index_loader(
+    fetch: Optional[Callable[[], bool]] = None,
+    watch: bool = True,
+    poll: Optional[Callable[[], bool]] = None
+) -> threading.Thread:
+    """
+    Fetch and open the index in a daemon thread, then keep watching for newly
+    published versions (local ones, and those `poll` brings in)
+    """
+    manager = get_index_manager()
+    # Set before the thread starts, so early requests see the index as loading
+    manager.phase = "fetching" if fetch is not None else "loading"
+
+    def run():
+        manager.load(fetch)
+        if watch:
+            manager.watch_forever(poll)
+
+    thread = threading.Thread(target=run, name="index-loader", daemon=True)
+    thread.start()
+    return thread
@@ -1,60 +1,416 @@
+import hashlib
+import json
+import multiprocessing
 import os
-from typing import List
-from langchain_community.document_loaders import PyPDFLoader
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from pypdf import PdfReader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 from dotenv import load_dotenv
+from .embedding_cache import cached_embeddings
+from .embedding_pipeline import EmbeddingStage, token_batches
+from .kb_splitter import ENABLE_QA_CHUNKER, QASplitter
+from .text_extraction import extract_task
 
 load_dotenv()
 
 # Define persistence directory
 CHROMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "chroma_db_v2")
 
-def ingest_documents(pdf_directory: str):
+# Per-source content hashes and chunk ids, stored alongside the vector DB
+MANIFEST_FILENAME = "ingest_manifest.json"
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt")
+
+# Text extraction processes (see text_extraction), and PDF pages parsed per task
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = 8
+
+# Chunk ids checked against the collection per lookup
+PRESENCE_CHECK_SIZE = 256
+
+# Manifest sources of uploaded documents ("uploads/<org>/<filename>"), synced by ingestion jobs
+UPLOAD_SOURCE_PREFIX = "uploads/"
+
+# org_id metadata of the shared knowledge base; uploaded chunks carry their tenant's org_id
+# and retrieval only searches the asking tenant's chunks and these
+SHARED_ORG_ID = "shared"
+
+_manifest_lock = threading.Lock()
+# Chroma's per-path client cache is not safe to populate from concurrent jobs
+_index_lock = threading.Lock()
+
+
+def content_hash(data: bytes) -> str:
+    """SHA-256 of a source file (the same value as KBDocument.content_hash)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(file_path: str) -> str:
+    """content_hash of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_ids(source: str, chunks: Iterable[Document]) -> Iterator[Tuple[str, Document]]:
     """
-    Ingest all PDFs from the directory, split them, and store embeddings in ChromaDB.
+    Pair chunks with content-derived ids: an edit only changes the ids of the
+    chunks it touches. Repeated identical chunks within a source get an
+    occurrence suffix.
     """
-    if not os.path.exists(pdf_directory):
-        print(f"Directory {pdf_directory} does not exist.")
-        return
+    seen: Dict[str, int] = {}
+    for chunk in chunks:
+        digest = hashlib.sha256(f"{source}\0{chunk.page_content}".encode("utf-8")).hexdigest()[:32]
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        yield (digest if occurrence == 0 else f"{digest}-{occurrence}"), chunk
+
+
+def load_manifest(persist_directory: str = CHROMA_PATH) -> Dict[str, Dict]:
+    path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("documents", {})
 
-    documents = []
-    for filename in os.listdir(pdf_directory):
-        if filename.endswith(".pdf"):
-            file_path = os.path.join(pdf_directory, filename)
-            loader = PyPDFLoader(file_path)
-            documents.extend(loader.load())
-        elif filename.endswith(".txt"):
-            from langchain_community.document_loaders import TextLoader
-            file_path = os.path.join(pdf_directory, filename)
-            loader = TextLoader(file_path)
-            documents.extend(loader.load())
-
-    if not documents:
-        print("No documents found to ingest.")
+
+def save_manifest(documents: Dict[str, Dict], persist_directory: str = CHROMA_PATH):
+    """Write the manifest atomically"""
+    os.makedirs(persist_directory, exist_ok=True)
+    path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "documents": documents}, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def update_manifest(entries: Dict[str, Dict], removed: Iterable[str] = (), persist_directory: str = CHROMA_PATH):
+    """Merge entries into the manifest, leaving other sources as they are (safe across ingestion threads)"""
+    with _manifest_lock:
+        documents = load_manifest(persist_directory)
+        for source in removed:
+            documents.pop(source, None)
+        documents.update(entries)
+        save_manifest(documents, persist_directory)
+
+
+def _page_tasks(files: Iterable[Tuple[str, str]]) -> Iterator[Tuple[str, str, int, int]]:
+    """(source, path, start, stop) extraction tasks; at least one per file"""
+    for source, file_path in files:
+        pages = len(PdfReader(file_path).pages) if file_path.endswith(".pdf") else 1
+        for start in range(0, max(pages, 1), PAGES_PER_TASK):
+            yield source, file_path, start, start + PAGES_PER_TASK
+
+
+def _bounded_map(fn: Callable, tasks: Iterable, executor: Optional[ProcessPoolExecutor], window: int) -> Iterator:
+    """Ordered map that keeps at most `window` results in flight (serial when executor is None)"""
+    if executor is None:
+        yield from map(fn, tasks)
         return
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
+
+def split_pages(source: str, page_groups: Iterable[Tuple[str, List[Tuple[Optional[int], str]]]],
+                metadata: Optional[Dict] = None) -> Iterator[Document]:
+    """
+    Chunk extracted pages as they arrive (chunks never span pages, as with
+    PyPDFLoader). Q/A formatted text is split one pair per chunk.
+    """
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        add_start_index=True,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
     )
-    chunks = text_splitter.split_documents(documents)
-    print(f"Split {len(documents)} documents into {len(chunks)} chunks.")
+    qa_splitter = QASplitter() if ENABLE_QA_CHUNKER else None
+    for _source, pages in page_groups:
+        for number, text in pages:
+            # Sources are recorded relative to the data directory so ids are stable across machines
+            page_metadata = {**(metadata or {}), "source": source}
+            if number is not None:
+                page_metadata["page"] = number
+            splitter = qa_splitter if qa_splitter and qa_splitter.is_structured(text) else text_splitter
+            yield from splitter.split_documents([Document(page_content=text, metadata=page_metadata)])
+
 
-    # Initialize Embeddings
+def _open_index(persist_directory: str):
+    """Cached embedding model and the Chroma collection at persist_directory"""
     # Note: This requires OPENAI_API_KEY to be set in environment
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+    # Cached: a rebuild re-reads vectors for unchanged text instead of paying for them again
+    embeddings = cached_embeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL))
+    with _index_lock:
+        return embeddings, Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+
+
+def _sync_sources(
+    db,
+    stage: EmbeddingStage,
+    changed: Dict[str, Tuple[str, str]],
+    previous_entries: Dict[str, Dict],
+    stats: Dict,
+    persist_directory: str,
+    workers: int = INGEST_WORKERS,
+    low_priority: bool = False,
+    metadata: Optional[Dict] = None,
+    on_progress: Optional[Callable[[int, int], None]] = None
+) -> Dict[str, Dict]:
+    """
+    Extract, chunk, embed and write changed sources ({source: (path, hash)}),
+    recording each in the manifest as soon as it is complete.
+
+    Returns:
+        New manifest entries of the synced sources
+    """
+    updated: Dict[str, Dict] = {}
+    if not changed:
+        return updated
+
+    executor = None
+    if workers > 1 and any(file_path.endswith(".pdf") for file_path, _ in changed.values()):
+        # Spawned, not forked: this process already runs Chroma and embedding threads.
+        # low_priority renices the extraction processes so a serving process keeps its CPU.
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=os.nice if low_priority else None,
+            initargs=(10,) if low_priority else (),
+        )
+    try:
+        tasks = _page_tasks((source, file_path) for source, (file_path, _) in changed.items())
+        extracted = _bounded_map(extract_task, tasks, executor, window=2 * workers)
+        for source, page_groups in groupby(extracted, key=lambda group: group[0]):
+            ids: List[str] = []
+            progress = {"embedded": 0}
+
+            def new_chunks():
+                chunks = chunk_ids(source, split_pages(source, page_groups, metadata))
+                while True:
+                    group = list(islice(chunks, PRESENCE_CHECK_SIZE))
+                    if not group:
+                        return
+                    group_ids = [chunk_id for chunk_id, _ in group]
+                    ids.extend(group_ids)
+                    # Chunks already in the collection (unchanged text, or added before an interrupted run) are kept
+                    present = set(db.get(ids=group_ids, include=[])["ids"])
+                    for chunk_id, chunk in group:
+                        if chunk_id not in present:
+                            yield (chunk_id, chunk), chunk.page_content
+
+            def write_batch(batch, vectors):
+                # Precomputed vectors go straight to the collection (add_documents would embed again)
+                db._collection.upsert(
+                    ids=[chunk_id for (chunk_id, _), _, _ in batch],
+                    embeddings=vectors,
+                    documents=[text for _, text, _ in batch],
+                    metadatas=[chunk.metadata for (_, chunk), _, _ in batch],
+                )
+                progress["embedded"] += len(batch)
+                if on_progress:
+                    on_progress(len(ids), progress["embedded"])
+
+            embedded = stage.run(token_batches(new_chunks()), write_batch)
+
+            previous = previous_entries.get(source)
+            stale = set(previous["chunk_ids"]) - set(ids) if previous else set()
+            if stale:
+                db.delete(ids=sorted(stale))
+
+            updated[source] = {"content_hash": changed[source][1], "chunk_ids": ids}
+            # Checkpoint per file, so a failure later in the run does not re-split this one
+            update_manifest({source: updated[source]}, persist_directory=persist_directory)
+            if on_progress:
+                on_progress(len(ids), embedded["chunks"])
+            stats["added"] += embedded["chunks"]
+            stats["deleted"] += len(stale)
+            stats["tokens"] += embedded["tokens"]
+            stats["embed_seconds"] += embedded["seconds"]
+            print(f"{source}: {len(ids)} chunks, {embedded['chunks']} embedded, {len(stale)} removed "
+                  f"({embedded['chunks_per_s']} chunks/s, {embedded['tokens_per_s']} tokens/s, {embedded['retries']} retries)")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return updated
+
+
+def _tag_shared(db, chunk_ids: List[str]) -> int:
+    """
+    Mark chunks written before tenant tagging as shared. Only metadata is
+    updated; nothing is re-embedded.
+
+    Returns:
+        Number of chunks tagged
+    """
+    tagged = 0
+    for start in range(0, len(chunk_ids), PRESENCE_CHECK_SIZE):
+        found = db._collection.get(ids=chunk_ids[start:start + PRESENCE_CHECK_SIZE], include=["metadatas"])
+        untagged = [(chunk_id, metadata or {}) for chunk_id, metadata in zip(found["ids"], found["metadatas"])
+                    if not (metadata or {}).get("org_id")]
+        if untagged:
+            db._collection.update(
+                ids=[chunk_id for chunk_id, _ in untagged],
+                metadatas=[{**metadata, "org_id": SHARED_ORG_ID} for _, metadata in untagged],
+            )
+            tagged += len(untagged)
+    return tagged
+
+
+def _new_stats() -> Dict:
+    return {"added": 0, "deleted": 0, "unchanged_files": 0, "tokens": 0, "embed_seconds": 0.0}
+
+
+def ingest_documents(pdf_directory: str, persist_directory: str = CHROMA_PATH, rebuild: bool = False) -> Optional[Dict[str, int]]:
+    """
+    Incrementally sync PDFs and text files in a directory into ChromaDB.
+
+    Unchanged files (same content hash) are skipped without being parsed;
+    changed files are re-split and only chunks whose content is new are
+    embedded. Chunks that no longer exist, including those of deleted
+    files, are removed by id. Uploaded documents (see ingest_file) are left
+    alone. Chunks are tagged org_id=SHARED_ORG_ID, so every tenant sees them.
+
+    Runs as a streaming pipeline: PDF pages are extracted in a process pool
+    (INGEST_WORKERS), chunked as they arrive, checked against the collection,
+    embedded concurrently in token-bounded batches (see EmbeddingStage) and
+    written as each batch returns. Only a bounded window of pages and batches
+    is held at once, so memory does not grow with the corpus, and a run
+    interrupted by rate limits resumes without re-embedding what it wrote.
+
+    Args:
+        rebuild: Ignore the manifest and re-embed everything
+
+    Returns:
+        Counts of added / deleted chunks and unchanged files, plus embedding throughput
+    """
+    if not os.path.exists(pdf_directory):
+        print(f"Directory {pdf_directory} does not exist.")
+        return None
+
+    manifest = load_manifest(persist_directory)
+    # Uploaded documents are synced by their ingestion jobs, not from this directory
+    uploaded = {chunk_id for source, entry in manifest.items()
+                if source.startswith(UPLOAD_SOURCE_PREFIX) for chunk_id in entry["chunk_ids"]}
+    previous_entries = {} if rebuild else {
+        source: entry for source, entry in manifest.items() if not source.startswith(UPLOAD_SOURCE_PREFIX)
+    }
+
+    embeddings, db = _open_index(persist_directory)
+    stage = EmbeddingStage(embeddings)
+    if rebuild:
+        existing = [chunk_id for chunk_id in db.get(include=[])["ids"] if chunk_id not in uploaded]
+        if existing:
+            db.delete(ids=existing)
+        update_manifest({}, removed=[source for source in manifest if not source.startswith(UPLOAD_SOURCE_PREFIX)],
+                        persist_directory=persist_directory)
+
+    stats = _new_stats()
+    unchanged = set()
+    changed: Dict[str, Tuple[str, str]] = {}
+    for filename in sorted(os.listdir(pdf_directory)):
+        if not filename.endswith(SUPPORTED_EXTENSIONS):
+            continue
+        file_path = os.path.join(pdf_directory, filename)
+        digest = file_hash(file_path)
+
+        previous = previous_entries.get(filename)
+        if previous and previous["content_hash"] == digest:
+            unchanged.add(filename)
+            stats["unchanged_files"] += 1
+        else:
+            changed[filename] = (file_path, digest)
+
+    updated = _sync_sources(db, stage, changed, previous_entries, stats, persist_directory,
+                            metadata={"org_id": SHARED_ORG_ID})
+
+    # Files that disappeared from the directory
+    removed = set(previous_entries) - unchanged - set(updated)
+    for filename in removed:
+        if previous_entries[filename]["chunk_ids"]:
+            db.delete(ids=previous_entries[filename]["chunk_ids"])
+        stats["deleted"] += len(previous_entries[filename]["chunk_ids"])
+        print(f"{filename}: removed ({len(previous_entries[filename]['chunk_ids'])} chunks)")
+    if removed:
+        update_manifest({}, removed=removed, persist_directory=persist_directory)
+
+    if not previous_entries:
+        # First sync of a collection built without a manifest: drop chunks it does not track
+        tracked = {chunk_id for entry in load_manifest(persist_directory).values() for chunk_id in entry["chunk_ids"]}
+        untracked = [chunk_id for chunk_id in db.get(include=[])["ids"] if chunk_id not in tracked]
+        if untracked:
+            db.delete(ids=untracked)
+            stats["deleted"] += len(untracked)
+
+    shared = [chunk_id for source, entry in load_manifest(persist_directory).items()
+              if not source.startswith(UPLOAD_SOURCE_PREFIX) for chunk_id in entry["chunk_ids"]]
+    tagged = _tag_shared(db, shared)
+    if tagged:
+        print(f"Tagged {tagged} knowledge base chunks as shared")
+
+    seconds = max(stats["embed_seconds"], 1e-9)
+    stats["chunks_per_s"] = round(stats["added"] / seconds, 1)
+    stats["tokens_per_s"] = round(stats["tokens"] / seconds, 1)
+    stats["embed_seconds"] = round(stats["embed_seconds"], 2)
+    print(f"Ingestion complete: {stats['added']} chunks embedded, {stats['deleted']} removed, "
+          f"{stats['unchanged_files']} files unchanged ({persist_directory}).")
+    print(f"Embedding throughput: {stats['chunks_per_s']} chunks/s, {stats['tokens_per_s']} tokens/s")
+    if hasattr(embeddings, "hits"):
+        stats["cache_hits"] = embeddings.hits
+        print(f"Embedding cache: {embeddings.hits} hits, {embeddings.misses} embedded")
+    return stats
+
+
+def ingest_file(
+    file_path: str,
+    source: str,
+    persist_directory: str = CHROMA_PATH,
+    metadata: Optional[Dict] = None,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    workers: int = INGEST_WORKERS,
+    low_priority: bool = False
+) -> Dict:
+    """
+    Incrementally sync one file into ChromaDB under a source name (uploads
+    use UPLOAD_SOURCE_PREFIX). Re-ingesting a changed file under the same
+    source only embeds the chunks that changed.
+
+    Args:
+        metadata: Extra metadata stored on every chunk
+        on_progress: Called with (chunks seen, chunks embedded) as batches are written
+        low_priority: Run text extraction at reduced CPU priority (for in-process jobs)
+
+    Returns:
+        Counts of added / deleted chunks, plus embedding totals
+    """
+    previous = load_manifest(persist_directory).get(source)
+    digest = file_hash(file_path)
+    stats = _new_stats()
+    if previous and previous["content_hash"] == digest:
+        stats["unchanged_files"] = 1
+        stats["chunks"] = len(previous["chunk_ids"])
+        return stats
 
-    # Create/Update Vector DB
-    db = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=CHROMA_PATH
+    embeddings, db = _open_index(persist_directory)
+    updated = _sync_sources(
+        db, EmbeddingStage(embeddings), {source: (file_path, digest)}, {source: previous} if previous else {},
+        stats, persist_directory, workers=workers, low_priority=low_priority, metadata=metadata, on_progress=on_progress,
     )
-    print(f"Saved {len(chunks)} chunks to {CHROMA_PATH}.")
+    stats["chunks"] = len(updated[source]["chunk_ids"])
+    return stats
 
 if __name__ == "__main__":
     # Test run
@@ -0,0 +1,470 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Ingestion Jobs
+Background processing of uploaded knowledge base documents. Each
+`kb_documents` row is its own job: uploads are queued there, a dispatcher
+claims queued rows under per-tenant concurrency limits, and a small worker
+pool embeds each document with ingest_file into a new index version (a copy
+of the live one) and publishes it. Status moves
+queued -> processing -> active | failed, with chunk progress and errors
+persisted on the row.
+
+The index versions are a cache of the active documents: when a version that
+lacks some of them goes live (a rebuild, or a version installed from GCS),
+those documents are queued again. With shared storage (GCSKnowledgeBase on
+Cloud Run) uploaded files live in GCS and every version a job publishes is
+pushed there, so all instances serve it.
+
+Claims are leases renewed by a heartbeat timer: a processing row whose
+updated_at is older than KB_JOB_LEASE_S (its instance died) is claimed again,
+so jobs survive restarts and are safe across instances. Text extraction runs
+in reniced processes and embedding is network-bound, so the chat path keeps
+its CPU.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from .analytics_store import get_analytics_store, DEFAULT_ORG_ID
+from .index_versions import INDEX_ROOT, current_index_path, current_version, get_index_manager, new_version, publish
+from .ingestion import SUPPORTED_EXTENSIONS, UPLOAD_SOURCE_PREFIX, ingest_file, load_manifest
+from .telemetry import ERRORS
+
+KB_UPLOAD_DIR = Path(os.getenv("KB_UPLOAD_DIR", str(Path(__file__).parent.parent.parent / "kb_uploads")))
+KB_MAX_UPLOAD_BYTES = int(os.getenv("KB_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+# Documents embedded at once, overall and per tenant (the latter across instances)
+KB_JOB_WORKERS = int(os.getenv("KB_JOB_WORKERS", "2"))
+KB_JOBS_PER_TENANT = int(os.getenv("KB_JOBS_PER_TENANT", "1"))
+
+# Text extraction processes per job: half the cores, leaving the rest to request handling
+KB_JOB_EXTRACT_WORKERS = int(os.getenv("KB_JOB_EXTRACT_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+# A processing row not heartbeated for this long is reclaimed
+KB_JOB_LEASE_S = 300
+KB_JOB_POLL_INTERVAL_S = 5
+
+# Leases of running jobs are renewed this often, whether or not they make progress
+# (text extraction or a rate-limit wait can take minutes)
+KB_HEARTBEAT_INTERVAL_S = 30
+
+# Progress is written at most this often per job
+KB_PROGRESS_INTERVAL_S = 2.0
+
+DOCUMENT_COLUMNS = (
+    "doc_id", "org_id", "filename", "content_hash", "status", "chunks_total",
+    "chunks_embedded", "error_message", "uploaded_at", "updated_at",
+)
+
+_UNSAFE_FILENAME = re.compile(r"[^A-Za-z0-9._ -]+")
+
+
+def safe_filename(filename: str) -> str:
+    """Basename with path separators and unusual characters removed"""
+    name = _UNSAFE_FILENAME.sub("_", os.path.basename(filename or "")).strip(" .")
+    return name[:200] or "document"
+
+
+class IngestionJobQueue:
+    """Upload intake, persisted job state and the worker pool that drains it"""
+
+    def __init__(self, workers: int = KB_JOB_WORKERS, per_tenant: int = KB_JOBS_PER_TENANT,
+                 root: Path = INDEX_ROOT, shared=None):
+        """
+        Args:
+            root: Index root the jobs publish versions to (see index_versions)
+            shared: Index and file storage shared by instances (GCSKnowledgeBase), if any
+        """
+        self.store = get_analytics_store()
+        self.store.create_schema()
+        self.workers = workers
+        self.per_tenant = per_tenant
+        self.root = root
+        self.shared = shared
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kb-ingest")
+        self._running: Dict[str, Tuple[str, str]] = {}  # doc_id -> (org key, content hash)
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_heartbeat = 0.0
+        # Index version whose documents were last checked by reconcile()
+        self._reconciled: Optional[str] = None
+
+    def _sql(self, query: str) -> str:
+        return self.store.sql(query)
+
+    def _row(self, row) -> Dict[str, Any]:
+        document = dict(zip(DOCUMENT_COLUMNS, row))
+        # UUID columns on PostgreSQL
+        document["doc_id"], document["org_id"] = str(document["doc_id"]), str(document["org_id"])
+        for column in ("uploaded_at", "updated_at"):
+            if isinstance(document[column], datetime):
+                document[column] = document[column].isoformat()
+        return document
+
+    def submit(self, org_id: str, filename: str, stream: BinaryIO, uploaded_by: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Store an upload and queue it for ingestion.
+
+        Uploads whose content hash the tenant already has are not queued
+        again; a new version of an existing filename re-queues that document
+        (only its changed chunks are embedded).
+
+        Returns:
+            The document and whether it was a duplicate
+        """
+        filename = safe_filename(filename)
+        if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+            raise ValueError(f"Unsupported file type: {filename} (expected {', '.join(SUPPORTED_EXTENSIONS)})")
+        org_key = self.store.tenant_key(org_id)
+
+        # Stream to disk while hashing, so large files are never held in memory
+        KB_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=KB_UPLOAD_DIR, delete=False) as tmp:
+            try:
+                for block in iter(lambda: stream.read(1 << 20), b""):
+                    size += len(block)
+                    if size > KB_MAX_UPLOAD_BYTES:
+                        raise ValueError(f"File exceeds {KB_MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+                    digest.update(block)
+                    tmp.write(block)
+            except Exception:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        content_hash = digest.hexdigest()
+
+        now = datetime.now()
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(self._sql(f"""
+                SELECT {", ".join(DOCUMENT_COLUMNS)} FROM kb_documents
+                WHERE org_id = ? AND (content_hash = ? OR filename = ?)
+                ORDER BY CASE WHEN content_hash = ? THEN 0 ELSE 1 END
+            """), (org_key, content_hash, filename, content_hash))
+            existing = cursor.fetchone()
+            if existing is not None:
+                existing = self._row(existing)
+                if existing["content_hash"] == content_hash and existing["status"] != "failed":
+                    os.unlink(tmp.name)
+                    return existing, True
+
+            path = KB_UPLOAD_DIR / str(org_key) / f"{content_hash}{Path(filename).suffix.lower()}"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(tmp.name, path)
+            file_url = str(path)
+            if self.shared is not None:
+                # Any instance may run the job, or resume it if this one dies
+                file_url = self.shared.save_file(file_url, f"{org_key}/{path.name}")
+
+            if existing is not None:
+                # New version of the file, or a retry of a failed one
+                doc_id = existing["doc_id"]
+                cursor.execute(self._sql("""
+                    UPDATE kb_documents
+                    SET content_hash = ?, file_url = ?, status = 'queued', error_message = NULL,
+                        chunks_embedded = 0, uploaded_by = ?, uploaded_at = ?, updated_at = ?
+                    WHERE doc_id = ?
+                """), (content_hash, file_url, uploaded_by, now, now, doc_id))
+            else:
+                doc_id = str(uuid.uuid4())
+                cursor.execute(self._sql("""
+                    INSERT INTO kb_documents
+                        (doc_id, org_id, filename, file_url, content_hash, uploaded_by, uploaded_at, status, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?)
+                """), (doc_id, org_key, filename, file_url, content_hash, uploaded_by, now, now))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._wake.set()
+        return self.get_document(doc_id), False
+
+    def get_document(self, doc_id: str, org_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        query = f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM kb_documents WHERE doc_id = ?"
+        params: List[Any] = [doc_id]
+        if org_id is not None:
+            query += " AND org_id = ?"
+            params.append(self.store.tenant_key(org_id))
+        cursor.execute(self._sql(query), params)
+        row = cursor.fetchone()
+        conn.close()
+        return self._row(row) if row else None
+
+    def list_documents(self, org_id: str = DEFAULT_ORG_ID, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        query = f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM kb_documents WHERE org_id = ?"
+        params: List[Any] = [self.store.tenant_key(org_id)]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        cursor.execute(self._sql(query + " ORDER BY uploaded_at DESC"), params)
+        rows = cursor.fetchall()
+        conn.close()
+        return [self._row(row) for row in rows]
+
+    def _claim_next(self) -> List[Tuple[str, str, str, str, str]]:
+        """Claim runnable jobs up to the free worker slots and per-tenant limits"""
+        with self._lock:
+            free = self.workers - len(self._running)
+        if free <= 0:
+            return []
+
+        lease_expired = datetime.now() - timedelta(seconds=KB_JOB_LEASE_S)
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        claimed = []
+        try:
+            # Live jobs per tenant, counting other instances
+            cursor.execute(self._sql("""
+                SELECT org_id, COUNT(*) FROM kb_documents
+                WHERE status = 'processing' AND updated_at >= ?
+                GROUP BY org_id
+            """), (lease_expired,))
+            running = {str(org): count for org, count in cursor.fetchall()}
+
+            cursor.execute(self._sql("""
+                SELECT doc_id, org_id, filename, file_url, content_hash FROM kb_documents
+                WHERE status = 'queued' OR (status = 'processing' AND updated_at < ?)
+                ORDER BY uploaded_at
+                LIMIT 100
+            """), (lease_expired,))
+            for doc_id, org_key, filename, file_url, content_hash in cursor.fetchall():
+                if len(claimed) >= free:
+                    break
+                if running.get(str(org_key), 0) >= self.per_tenant:
+                    continue
+                with self._lock:
+                    # Re-uploaded while its previous version is still being ingested here
+                    if str(doc_id) in self._running:
+                        continue
+                cursor.execute(self._sql("""
+                    UPDATE kb_documents SET status = 'processing', error_message = NULL, updated_at = ?
+                    WHERE doc_id = ? AND content_hash = ?
+                      AND (status = 'queued' OR (status = 'processing' AND updated_at < ?))
+                """), (datetime.now(), doc_id, content_hash, lease_expired))
+                conn.commit()
+                if cursor.rowcount == 1:
+                    running[str(org_key)] = running.get(str(org_key), 0) + 1
+                    claimed.append((str(doc_id), str(org_key), filename, file_url, content_hash))
+        finally:
+            conn.close()
+        return claimed
+
+    def _update(self, doc_id: str, content_hash: str, **columns):
+        """Write job columns, unless a newer upload replaced this version meanwhile"""
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        cursor.execute(self._sql(f"""
+            UPDATE kb_documents SET {assignments}, updated_at = ?
+            WHERE doc_id = ? AND content_hash = ? AND status = 'processing'
+        """), (*columns.values(), datetime.now(), doc_id, content_hash))
+        conn.commit()
+        conn.close()
+
+    def _heartbeat(self):
+        """Renew the leases of the jobs running here"""
+        with self._lock:
+            running = [(doc_id, content_hash) for doc_id, (_org, content_hash) in self._running.items()]
+        if not running:
+            return
+        now = datetime.now()
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        cursor.executemany(self._sql("""
+            UPDATE kb_documents SET updated_at = ?
+            WHERE doc_id = ? AND content_hash = ? AND status = 'processing'
+        """), [(now, doc_id, content_hash) for doc_id, content_hash in running])
+        conn.commit()
+        conn.close()
+
+    def reconcile(self) -> int:
+        """
+        Queue again the active documents that the live index version lacks
+        (it was published by a rebuild or installed from GCS without them).
+        Checked once per version.
+
+        Returns:
+            Number of documents queued
+        """
+        version = current_version(self.root)
+        if version is None or version == self._reconciled:
+            return 0
+        path = current_index_path(self.root)
+        manifest = load_manifest(path) if path else {}
+
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(self._sql("""
+                SELECT doc_id, org_id, filename, content_hash FROM kb_documents WHERE status = 'active'
+            """))
+            missing = [
+                (doc_id, content_hash) for doc_id, org_key, filename, content_hash in cursor.fetchall()
+                if manifest.get(f"{UPLOAD_SOURCE_PREFIX}{org_key}/{filename}", {}).get("content_hash") != content_hash
+            ]
+            now = datetime.now()
+            for doc_id, content_hash in missing:
+                cursor.execute(self._sql("""
+                    UPDATE kb_documents SET status = 'queued', updated_at = ?
+                    WHERE doc_id = ? AND content_hash = ? AND status = 'active'
+                """), (now, doc_id, content_hash))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._reconciled = version
+        if missing:
+            print(f"Vector index {version} lacks {len(missing)} uploaded documents; queued them again")
+            self._wake.set()
+        return len(missing)
+
+    def _local_file(self, file_url: str) -> str:
+        """Local path of an uploaded file, downloaded from shared storage if needed"""
+        if not file_url.startswith("gs://"):
+            return file_url
+        # Same layout as the copy submit() keeps locally
+        path = KB_UPLOAD_DIR / Path(file_url).parent.name / Path(file_url).name
+        if not path.exists():
+            self.shared.load_file(file_url, str(path))
+        return str(path)
+
+    def _ingest(self, file_path: str, source: str, metadata: Dict[str, str], on_progress) -> Dict:
+        """
+        Ingest a file into a new index version and publish it. Embedding runs
+        on a private copy of the live version, concurrently with other jobs;
+        publishing is serialized, and if another version went live meanwhile
+        the file is applied again on top of it (its vectors now come from the
+        embedding cache).
+        """
+        def build() -> Tuple[str, str, Dict]:
+            version, path = new_version(self.root, base=current_index_path(self.root))
+            try:
+                stats = ingest_file(
+                    file_path, source, persist_directory=path, metadata=metadata, on_progress=on_progress,
+                    workers=KB_JOB_EXTRACT_WORKERS, low_priority=True,
+                )
+            except Exception:
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+            return version, path, stats
+
+        if self.shared is not None:
+            self.shared.pull(self.root)
+        base = current_version(self.root)
+        version, path, stats = build()
+        with self._publish_lock:
+            if self.shared is not None:
+                self.shared.pull(self.root)
+            if current_version(self.root) != base:
+                shutil.rmtree(path, ignore_errors=True)
+                version, path, stats = build()
+            if stats["unchanged_files"]:
+                # Already in the live version
+                shutil.rmtree(path, ignore_errors=True)
+                return stats
+            publish(version, self.root)
+            if self.shared is not None and not self.shared.push(path):
+                raise RuntimeError(f"Index version {version} was published locally but not to shared storage")
+        return stats
+
+    def _process(self, doc_id: str, org_key: str, filename: str, file_url: str, content_hash: str):
+        started = time.monotonic()
+        last_write = [0.0]
+
+        def on_progress(chunks_total: int, chunks_embedded: int):
+            if time.monotonic() - last_write[0] >= KB_PROGRESS_INTERVAL_S:
+                last_write[0] = time.monotonic()
+                self._update(doc_id, content_hash, chunks_total=chunks_total, chunks_embedded=chunks_embedded)
+
+        try:
+            stats = self._ingest(
+                self._local_file(file_url),
+                f"{UPLOAD_SOURCE_PREFIX}{org_key}/{filename}",
+                {"org_id": org_key, "doc_id": doc_id},
+                on_progress,
+            )
+            self._update(doc_id, content_hash, status="active", chunks_total=stats["chunks"],
+                         chunks_embedded=stats["added"])
+            print(f"KB document {filename} ({doc_id}) active: {stats['chunks']} chunks, "
+                  f"{stats['added']} embedded in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            print(f"KB document {filename} ({doc_id}) failed: {e}")
+            ERRORS.inc(component="ingestion")
+            self._update(doc_id, content_hash, status="failed", error_message=str(e)[:1000])
+        finally:
+            with self._lock:
+                self._running.pop(doc_id, None)
+            self._wake.set()
+
+    def dispatch_once(self) -> int:
+        """Start claimed jobs on the worker pool; returns how many were started"""
+        if get_index_manager().loading:
+            # Cold start: jobs build on the live version, so wait until it is fetched
+            return 0
+        self.reconcile()
+        claimed = self._claim_next()
+        for job in claimed:
+            with self._lock:
+                self._running[job[0]] = (job[1], job[4])
+            self._executor.submit(self._process, *job)
+        return len(claimed)
+
+    def run_forever(self):
+        """Dispatcher loop for the background thread (woken early by uploads and finished jobs)"""
+        while True:
+            try:
+                if time.monotonic() - self._last_heartbeat >= KB_HEARTBEAT_INTERVAL_S:
+                    self._last_heartbeat = time.monotonic()
+                    self._heartbeat()
+                self.dispatch_once()
+            except Exception as e:
+                print(f"Ingestion dispatcher error: {e}")
+                ERRORS.inc(component="ingestion")
+            self._wake.wait(KB_JOB_POLL_INTERVAL_S)
+            self._wake.clear()
+
+
+# Global instance
+_ingestion_queue = None
+_queue_lock = threading.Lock()
+
+def get_ingestion_queue() -> IngestionJobQueue:
+    """Get or create the global ingestion job queue"""
+    global _ingestion_queue
+    with _queue_lock:
+        if _ingestion_queue is None:
+            _ingestion_queue = IngestionJobQueue()
+    return _ingestion_queue
+
+
+def start_ingestion_workers(shared=None) -> threading.Thread:
+    """
+    Run the ingestion dispatcher in a daemon thread
+
+    Args:
+        shared: Index and file storage shared by instances (GCSKnowledgeBase), if any
+    """
+    queue = get_ingestion_queue()
+    queue.shared = shared
+    thread = threading.Thread(target=queue.run_forever, name="kb-ingestion", daemon=True)
+    thread.start()
+    return thread
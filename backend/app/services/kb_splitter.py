@@ -0,0 +1,92 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Knowledge Base Splitter
+Structure-aware chunking for the knowledge base format:
+
+    CATEGORY E: FOOD & BEVERAGE
+    **Q: What time is breakfast served?**
+    • 7:00 AM - 10:30 AM at Mutiara main restaurant
+
+Each Q/A pair becomes one chunk with its category attached as metadata, so
+answers are never cut in half and no overlap is needed. Text outside Q/A
+blocks, and the rare answer longer than QA_MAX_CHARS, fall back to the
+character splitter.
+"""
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+ENABLE_QA_CHUNKER = os.getenv("ENABLE_QA_CHUNKER", "true").lower() == "true"
+
+# Longest Q/A pair kept as a single chunk
+QA_MAX_CHARS = int(os.getenv("QA_MAX_CHARS", "2500"))
+
+CATEGORY_PATTERN = re.compile(r"^CATEGORY\s+([A-Z0-9]+):\s*(.+?)\s*$")
+QUESTION_PATTERN = re.compile(r"^\*\*Q:\s*(.+?)\*\*\s*$")
+RULE_PATTERN = re.compile(r"^[=\-_*#]{3,}\s*$")
+
+
+class QASplitter:
+    """Splits Q/A formatted text into one chunk per question"""
+
+    def __init__(self, max_chars: int = QA_MAX_CHARS):
+        self.max_chars = max_chars
+        self.fallback = RecursiveCharacterTextSplitter(chunk_size=max_chars, chunk_overlap=0)
+
+    @staticmethod
+    def is_structured(text: str) -> bool:
+        """True when the text contains at least one **Q:** block"""
+        return any(QUESTION_PATTERN.match(line.strip()) for line in text.splitlines())
+
+    def _blocks(self, text: str) -> Iterator[Tuple[Optional[str], List[str], Dict[str, str]]]:
+        """(question, body lines, category metadata) per block; question is None outside Q/A pairs"""
+        category: Dict[str, str] = {}
+        question: Optional[str] = None
+        lines: List[str] = []
+        for line in text.splitlines():
+            stripped = line.strip()
+            category_match = CATEGORY_PATTERN.match(stripped)
+            question_match = QUESTION_PATTERN.match(stripped)
+            if category_match or question_match:
+                yield question, lines, category
+                lines = []
+                if category_match:
+                    category = {"category_code": category_match.group(1), "category": category_match.group(2)}
+                    question = None
+                else:
+                    question = question_match.group(1)
+            elif not RULE_PATTERN.match(stripped):
+                lines.append(line.rstrip())
+        yield question, lines, category
+
+    def split_text_with_metadata(self, text: str) -> Iterator[Tuple[str, Dict[str, str]]]:
+        for question, lines, category in self._blocks(text):
+            body = "\n".join(lines).strip()
+            if question is None:
+                # Titles and notes outside Q/A pairs
+                for piece in self.fallback.split_text(body) if body else []:
+                    yield piece, dict(category)
+                continue
+
+            header = f"**Q: {question}**"
+            metadata = {**category, "question": question}
+            chunk = f"{header}\n{body}" if body else header
+            if len(chunk) <= self.max_chars:
+                yield chunk, metadata
+                continue
+            # Oversized answer: split it, repeating the question on every part
+            splitter = RecursiveCharacterTextSplitter(chunk_size=self.max_chars - len(header) - 1, chunk_overlap=0)
+            for part, piece in enumerate(splitter.split_text(body)):
+                yield f"{header}\n{piece}", {**metadata, "part": part}
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        return [
+            Document(page_content=text, metadata={**document.metadata, **metadata})
+            for document in documents
+            for text, metadata in self.split_text_with_metadata(document.page_content)
+        ]
@@ -11,6 +11,8 @@ import math
 import requests
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
+from .tracing import span
+from .telemetry import ERRORS
 
 load_dotenv()
 
@@ -81,7 +83,8 @@ def search_nearby_places(
     }
     
     try:
-        response = requests.get(PLACES_API_URL, params=params, timeout=10)
+        with span("places"):
+            response = requests.get(PLACES_API_URL, params=params, timeout=10)
         response.raise_for_status()
         data = response.json()
         
@@ -119,6 +122,7 @@ def search_nearby_places(
         return results
     
     except requests.exceptions.RequestException as e:
+        ERRORS.inc(component="places")
         return [{
             "error": "API request failed",
             "message": str(e)
@@ -0,0 +1,268 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+In-Memory Metrics Buffer
+Columnar ring buffer holding the most recent query events so dashboard
+aggregations run as vectorized NumPy reductions instead of database reads.
+The database stays the source of truth; the buffer is warmed from it on
+startup and fed by the metrics writer afterwards.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Widest dashboard window (hours); matches the API's `hours` limit
+METRICS_BUFFER_WINDOW_HOURS = 168
+
+# Events retained (~45 bytes each). Windows reaching past evicted events fall back to SQL.
+METRICS_BUFFER_CAPACITY = int(os.getenv("METRICS_BUFFER_CAPACITY", "500000"))
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Row layout accepted by extend()
+BUFFER_FIELDS = (
+    "timestamp", "response_time_ms", "category", "source", "agent_id", "success",
+    "tokens_used", "cost_estimate", "accuracy_score", "aht_saved_s", "org_id",
+)
+
+
+def to_seconds(value) -> float:
+    """Naive local datetime (or ISO string / aware datetime) to epoch-relative seconds"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return (value - _EPOCH).total_seconds()
+
+
+def from_seconds(seconds: float) -> datetime:
+    """Inverse of to_seconds"""
+    return _EPOCH + timedelta(seconds=round(float(seconds), 6))
+
+
+class _Dictionary:
+    """Interns strings to dense integer ids so group-bys can use bincount"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def encode(self, value: str) -> int:
+        code = self.ids.get(value)
+        if code is None:
+            code = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+def grouped_quantiles(keys: np.ndarray, values: np.ndarray, n_groups: int, quantiles: Sequence[float]) -> Dict[str, np.ndarray]:
+    """
+    Per-group quantiles in one sort: order by (key, value), then index into
+    each group's contiguous run. Returns {"p50": array[n_groups], ...}.
+    """
+    counts = np.bincount(keys, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ordered = values[np.lexsort((values, keys))]
+
+    result = {}
+    for q in quantiles:
+        label = f"p{q * 100:g}"
+        if ordered.size == 0:
+            result[label] = np.zeros(n_groups)
+            continue
+        offsets = np.floor(q * np.maximum(counts - 1, 0)).astype(np.int64)
+        picked = ordered[np.minimum(starts + offsets, ordered.size - 1)]
+        result[label] = np.where(counts > 0, picked, 0.0)
+    return result
+
+
+class MetricsRingBuffer:
+    """Fixed-capacity columnar store of recent query events (thread-safe)"""
+
+    def __init__(self, capacity: int = METRICS_BUFFER_CAPACITY):
+        self.capacity = capacity
+        self.timestamp = np.zeros(capacity, dtype=np.float64)
+        self.response_time_ms = np.zeros(capacity, dtype=np.float32)
+        self.category = np.zeros(capacity, dtype=np.int32)
+        self.source = np.zeros(capacity, dtype=np.int32)
+        self.agent = np.zeros(capacity, dtype=np.int32)
+        self.success = np.zeros(capacity, dtype=np.bool_)
+        self.tokens = np.zeros(capacity, dtype=np.int32)
+        self.cost = np.zeros(capacity, dtype=np.float32)
+        self.accuracy = np.zeros(capacity, dtype=np.float32)
+        self.aht_saved_s = np.zeros(capacity, dtype=np.int32)
+        self.org = np.zeros(capacity, dtype=np.int32)
+
+        self.categories = _Dictionary()
+        self.sources = _Dictionary()
+        self.agents = _Dictionary()
+        self.orgs = _Dictionary()
+
+        self._next = 0
+        self._size = 0
+        # Newest timestamp no longer held (evicted, or older than the warm-up window)
+        self._evicted_until = -np.inf
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def mark_loaded_since(self, since: datetime):
+        """Declare that every event after `since` has been loaded"""
+        with self._lock:
+            self._evicted_until = max(self._evicted_until, to_seconds(since))
+
+    def covers(self, cutoff: datetime) -> bool:
+        """Whether every event after `cutoff` is still in the buffer"""
+        return self._evicted_until <= to_seconds(cutoff)
+
+    def extend(self, rows: Iterable[Tuple]):
+        """Append rows laid out as BUFFER_FIELDS, overwriting the oldest when full"""
+        rows = list(rows)
+        if not rows:
+            return
+
+        with self._lock:
+            # Dictionary encoding happens under the lock so ids stay dense and stable
+            columns = list(zip(*rows))
+            encoded = {
+                "timestamp": np.fromiter((to_seconds(ts) for ts in columns[0]), dtype=np.float64, count=len(rows)),
+                "response_time_ms": np.asarray(columns[1], dtype=np.float32),
+                "category": np.fromiter((self.categories.encode(v) for v in columns[2]), dtype=np.int32, count=len(rows)),
+                "source": np.fromiter((self.sources.encode(v) for v in columns[3]), dtype=np.int32, count=len(rows)),
+                "agent": np.fromiter((self.agents.encode(str(v)) for v in columns[4]), dtype=np.int32, count=len(rows)),
+                "success": np.asarray(columns[5], dtype=np.bool_),
+                "tokens": np.asarray([v or 0 for v in columns[6]], dtype=np.int32),
+                "cost": np.asarray([float(v or 0.0) for v in columns[7]], dtype=np.float32),
+                # NaN marks answers whose accuracy has not been scored yet
+                "accuracy": np.asarray([float(v) if v is not None else np.nan for v in columns[8]], dtype=np.float32),
+                "aht_saved_s": np.asarray([v or 0 for v in columns[9]], dtype=np.int32),
+                "org": np.fromiter((self.orgs.encode(str(v)) for v in columns[10]), dtype=np.int32, count=len(rows)),
+            }
+
+            count = len(rows)
+            if count > self.capacity:
+                self._evicted_until = max(self._evicted_until, float(encoded["timestamp"][:count - self.capacity].max()))
+                encoded = {name: values[-self.capacity:] for name, values in encoded.items()}
+                count = self.capacity
+
+            positions = (self._next + np.arange(count)) % self.capacity
+            overwritten = count - (self.capacity - self._size) if self._size + count > self.capacity else 0
+            if overwritten > 0:
+                # Positions past the free space hold the oldest events
+                evicted = self.timestamp[positions[count - overwritten:]]
+                self._evicted_until = max(self._evicted_until, float(evicted.max()))
+
+            for name, values in encoded.items():
+                getattr(self, name)[positions] = values
+
+            self._next = (self._next + count) % self.capacity
+            self._size = min(self.capacity, self._size + count)
+
+    def set_accuracy(self, scores: Iterable[Tuple[Any, str, float]]):
+        """
+        Fill in late accuracy scores given as (timestamp, tenant, score).
+        Events are matched on their exact timestamp within the tenant.
+        """
+        scores = list(scores)
+        if not scores:
+            return
+
+        with self._lock:
+            keys = np.fromiter((to_seconds(ts) for ts, _, _ in scores), dtype=np.float64, count=len(scores))
+            orgs = np.fromiter((self.orgs.ids.get(str(t), -1) for _, t, _ in scores), dtype=np.int32, count=len(scores))
+            values = np.fromiter((score for _, _, score in scores), dtype=np.float32, count=len(scores))
+            order = np.argsort(keys)
+            keys, orgs, values = keys[order], orgs[order], values[order]
+
+            size = self._size
+            positions = np.minimum(np.searchsorted(keys, self.timestamp[:size]), keys.size - 1)
+            matched = (
+                (keys[positions] == self.timestamp[:size])
+                & (orgs[positions] == self.org[:size])
+                & np.isnan(self.accuracy[:size])
+            )
+            self.accuracy[:size][matched] = values[positions[matched]]
+
+    def _window(self, cutoff: datetime, tenant: str) -> Optional[Dict[str, np.ndarray]]:
+        """Copy out the columns of one tenant's events newer than cutoff"""
+        with self._lock:
+            org = self.orgs.ids.get(tenant)
+            if org is None:
+                return None
+            size = self._size
+            mask = (self.timestamp[:size] > to_seconds(cutoff)) & (self.org[:size] == org)
+            return {
+                "timestamp": self.timestamp[:size][mask],
+                "response_time_ms": self.response_time_ms[:size][mask],
+                "category": self.category[:size][mask],
+                "source": self.source[:size][mask],
+                "agent": self.agent[:size][mask],
+                "success": self.success[:size][mask],
+                "tokens": self.tokens[:size][mask],
+                "cost": self.cost[:size][mask],
+                "accuracy": self.accuracy[:size][mask],
+                "aht_saved_s": self.aht_saved_s[:size][mask],
+            }
+
+    def group_stats(self, cutoff: datetime, tenant: str, by: str, quantiles: Sequence[float] = ()) -> List[Dict[str, Any]]:
+        """
+        Per-group statistics for one tenant, grouped by "category", "source",
+        "agent" (largest first) or "hour" (chronological).
+        """
+        window = self._window(cutoff, tenant)
+        if window is None or window["timestamp"].size == 0:
+            return []
+
+        if by == "hour":
+            hours, keys = np.unique((window["timestamp"] // 3600).astype(np.int64), return_inverse=True)
+            labels = [from_seconds(hour * 3600).strftime('%Y-%m-%d %H:00:00') for hour in hours]
+        else:
+            keys = window[by]
+            labels = {"category": self.categories, "source": self.sources, "agent": self.agents}[by].values
+        keys = keys.astype(np.int64)
+        n_groups = len(labels)
+
+        counts = np.bincount(keys, minlength=n_groups)
+        latency_totals = np.bincount(keys, weights=window["response_time_ms"], minlength=n_groups)
+        scored = ~np.isnan(window["accuracy"])
+        accuracy_totals = np.bincount(keys, weights=np.where(scored, window["accuracy"], 0.0), minlength=n_groups)
+        accuracy_counts = np.bincount(keys, weights=scored, minlength=n_groups)
+        success_counts = np.bincount(keys, weights=window["success"], minlength=n_groups)
+        last_seen = np.full(n_groups, -np.inf)
+        np.maximum.at(last_seen, keys, window["timestamp"])
+        percentiles = grouped_quantiles(keys, window["response_time_ms"], n_groups, quantiles)
+
+        present = np.flatnonzero(counts)
+        if by != "hour":
+            present = present[np.argsort(-counts[present], kind="stable")]
+
+        return [
+            {
+                "key": labels[group],
+                "count": int(counts[group]),
+                "avg_response_time": float(latency_totals[group] / counts[group]),
+                "avg_accuracy": float(accuracy_totals[group] / accuracy_counts[group]) * 100 if accuracy_counts[group] else 0.0,
+                "success_rate": float(success_counts[group] * 100.0 / counts[group]),
+                "last_timestamp": from_seconds(last_seen[group]),
+                "percentiles": {label: round(float(values[group]), 2) for label, values in percentiles.items()},
+            }
+            for group in present
+        ]
+
+
+# Global instance
+_metrics_buffer = None
+
+def get_metrics_buffer() -> MetricsRingBuffer:
+    """Get or create the global metrics ring buffer"""
+    global _metrics_buffer
+    if _metrics_buffer is None:
+        _metrics_buffer = MetricsRingBuffer()
+    return _metrics_buffer
@@ -5,107 +5,573 @@ All Rights Reserved.
 Metrics Collection Service for Performance Dashboard
 Tracks query metrics, response times, question categories, and agent performance.
 """
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List, Any
-import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Iterator, List, Any, Tuple
+import atexit
 import json
 import os
-from pathlib import Path
+import re
+import threading
+import time
 import random # For simulation of new metrics until fully implemented
+from app.services.analytics_store import get_analytics_store, ANALYTICS_BACKEND, DEFAULT_ORG_ID, QueryId
+from app.services.event_log import get_event_log, read_segment
+from app.services.metrics_buffer import get_metrics_buffer, METRICS_BUFFER_WINDOW_HOURS, to_seconds, from_seconds
+from app.services.metrics_stream import get_metrics_broadcaster
+from app.services.sketches import LatencySketch, SpaceSaving
+from app.services.telemetry import ERRORS, METRICS_QUEUE_DEPTH
+from app.services.tracing import STAGES, current_trace
+
+# Dimensions maintained in hourly_rollups ("all" is the tenant-wide total)
+ROLLUP_DIMENSIONS = ("all", "category", "agent", "source")
+
+# Quantiles exposed on the dashboard
+LATENCY_QUANTILES = (0.5, 0.9, 0.99)
+
+# Named comparison windows: offset (hours) back to the window compared against.
+# "previous" is the window immediately before the current one (offset = its length).
+COMPARISON_OFFSETS = {"previous": None, "day": 24, "week": 168}
+
+# Trend tiers: resolution -> (bucket width in seconds, retention in hours or None to keep).
+# The hourly tier is served from hourly_rollups; the others live in trend_rollups.
+TREND_TIERS = {
+    "1m": (60, 12),
+    "5m": (300, 72),
+    "1h": (3600, None),
+    "1d": (86400, None),
+}
+TREND_TABLE_TIERS = ("1m", "5m", "1d")
+
+# Upper bound on points returned by a trend query (granularity is coarsened to fit)
+MAX_TREND_POINTS = 500
+
+# Minimum seconds between sweeps of expired fine-tier buckets
+TREND_EXPIRY_INTERVAL_S = 60
+
+# Answers still unscored after this many hours leave the evaluation queue
+# (scored ones are removed as they are scored), so it stays bounded while the
+# evaluation worker is disabled or behind
+EVALUATION_QUEUE_RETENTION_HOURS = int(os.getenv("EVALUATION_QUEUE_RETENTION_HOURS", "24"))
+EVALUATION_EXPIRY_INTERVAL_S = 60
+
+_GRANULARITY_PATTERN = re.compile(r"^(\d+)([mhd])$")
+_GRANULARITY_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+# Raw export: columns in output order and rows fetched per keyset page
+EXPORT_COLUMNS = (
+    "id", "timestamp", "org_id", "query_text", "response_time_ms", "question_category",
+    "source_type", "agent_id", "success", "error_message", "tokens_used", "cost_estimate",
+    "accuracy_score", "aht_saved_s",
+)
+EXPORT_PAGE_SIZE = 1000
+
+# Rollup counters summed per period when comparing windows
+_COMPARISON_MEASURES = (
+    "query_count", "success_count", "total_response_time_ms", "tokens_used",
+    "cost_estimate", "accuracy_total", "accuracy_count", "aht_saved_s",
+)
+
+# Buffered writes (remote analytics stores): flush when either limit is reached
+METRICS_BATCH_SIZE = int(os.getenv("METRICS_BATCH_SIZE", "500"))
+METRICS_FLUSH_INTERVAL_S = float(os.getenv("METRICS_FLUSH_INTERVAL_S", "1.0"))
+
+# Events kept in memory if the database is unreachable, before dropping the oldest
+METRICS_MAX_PENDING = 50000
+
+# Append events to the segmented event log and load them with a background
+# compactor instead of writing to the database from the request path
+ENABLE_METRICS_EVENT_LOG = os.getenv("ENABLE_METRICS_EVENT_LOG", "false").lower() == "true"
+METRICS_COMPACT_INTERVAL_S = float(os.getenv("METRICS_COMPACT_INTERVAL_S", "2"))
+
+# Loaded-batch markers only need to outlive the segment they came from
+EVENT_LOG_BATCH_RETENTION_HOURS = 24
+
+# Serve dashboard windows from the in-process ring buffer. The buffer only sees
+# this process's writes, so it is off by default with the shared PostgreSQL store.
+_SHARED_STORE = ANALYTICS_BACKEND in ("postgres", "postgresql")
+ENABLE_METRICS_BUFFER = os.getenv("ENABLE_METRICS_BUFFER", "false" if _SHARED_STORE else "true").lower() == "true"
+
+
+class _BufferedWriter:
+    """Accumulates events and writes them in bulk from a background thread"""
+
+    def __init__(self, flush, batch_size: int, interval_s: float):
+        self._flush = flush
+        self._batch_size = batch_size
+        self._interval_s = interval_s
+        self._events: List[Dict[str, Any]] = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush_now)
+
+    def submit(self, event: Dict[str, Any]):
+        with self._cond:
+            self._events.append(event)
+            if len(self._events) >= self._batch_size:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        return len(self._events)
+
+    def _take(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            batch, self._events = self._events, []
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            self._flush(batch)
+        except Exception as e:
+            print(f"Metrics flush error ({len(batch)} events): {e}")
+            ERRORS.inc(component="metrics")
+            with self._cond:
+                # Keep the batch for the next attempt, bounded so memory cannot grow forever
+                self._events = (batch + self._events)[-METRICS_MAX_PENDING:]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._events) >= self._batch_size, timeout=self._interval_s)
+            batch = self._take()
+            if batch:
+                self._write(batch)
+
+    def flush_now(self):
+        batch = self._take()
+        if batch:
+            self._write(batch)
 
-# Database path - stored alongside backend
-DB_PATH = Path(__file__).parent.parent.parent / "analytics.db"
 
 class MetricsService:
     """Service for collecting and querying performance metrics"""
-    
+
     def __init__(self):
+        self.store = get_analytics_store()
         self._init_database()
         self._migrate_database()
-    
+
+        self._trend_expiry_at = 0.0
+        self._evaluation_expiry_at = 0.0
+
+        self._writer = None
+        self._event_log = None
+        if ENABLE_METRICS_EVENT_LOG:
+            self._event_log = get_event_log()
+            METRICS_QUEUE_DEPTH.set_function(self._event_log.pending, queue="event_log")
+        elif self.store.buffered_writes:
+            self._writer = _BufferedWriter(self._write_events, METRICS_BATCH_SIZE, METRICS_FLUSH_INTERVAL_S)
+            METRICS_QUEUE_DEPTH.set_function(self._writer.pending, queue="write_buffer")
+
+        self._buffer = None
+        if ENABLE_METRICS_BUFFER:
+            self._buffer = get_metrics_buffer()
+            self._warm_buffer()
+
+        if self._event_log is not None:
+            # Started after warm-up so no compacted event is both loaded and replayed into the buffer
+            threading.Thread(target=self._run_compactor, name="metrics-compactor", daemon=True).start()
+
+    def _sql(self, query: str) -> str:
+        """Adapt portable SQL to the configured store's dialect"""
+        return self.store.sql(query)
+
+    def _tenant(self, org_id: str) -> str:
+        """Resolve a tenant identifier to the key stored in org_id columns"""
+        return self.store.tenant_key(org_id)
+
     def _init_database(self):
-        """Initialize SQLite database with required tables"""
-        conn = sqlite3.connect(DB_PATH)
+        """Initialize the analytics database with required tables"""
+        self.store.create_schema()
+
+    def _migrate_database(self):
+        """Backfill derived tables for databases created before they existed"""
+        conn = self.store.connect()
         cursor = conn.cursor()
-        
-        # Queries table - tracks every query
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS queries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                query_text TEXT NOT NULL,
-                response_time_ms INTEGER NOT NULL,
-                question_category TEXT,
-                source_type TEXT,
-                agent_id TEXT,
-                success BOOLEAN DEFAULT TRUE,
-                error_message TEXT,
-                tokens_used INTEGER DEFAULT 0,
-                cost_estimate REAL DEFAULT 0.0,
-                accuracy_score REAL DEFAULT 0.0,
-                aht_saved_s INTEGER DEFAULT 0
-            )
-        """)
-        
-        # Conversions table - tracks booking conversions
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS conversions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                query_id INTEGER,
-                conversion_type TEXT,
-                value REAL,
-                FOREIGN KEY (query_id) REFERENCES queries(id)
-            )
-        """)
-        
-        # Performance snapshots - hourly aggregated data
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS performance_snapshots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                snapshot_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-                total_queries INTEGER,
-                avg_response_time_ms REAL,
-                success_rate REAL,
-                unique_agents INTEGER
-            )
-        """)
-        
-        # Agents table - track agent usage
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS agents (
-                agent_id TEXT PRIMARY KEY,
-                first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
-                last_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
-                total_queries INTEGER DEFAULT 0
-            )
-        """)
-        
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM hourly_rollups)")
+        has_rollups = cursor.fetchone()[0]
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM queries)")
+        has_queries = cursor.fetchone()[0]
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM trend_rollups)")
+        has_trends = cursor.fetchone()[0]
+        conn.close()
+
+        if has_queries and not (has_rollups and has_trends):
+            print("Migrating database: Building rollups from raw queries...")
+            self.rebuild_rollups()
+
+    def _warm_buffer(self, batch_size: int = 10000):
+        """Load the widest dashboard window from the database into the ring buffer"""
+        since = datetime.now() - timedelta(hours=METRICS_BUFFER_WINDOW_HOURS)
+        conn = self.store.connect()
+        read_cursor = self.store.streaming_cursor(conn)
+        read_cursor.execute(self._sql("""
+            SELECT timestamp, response_time_ms, COALESCE(question_category, 'Uncategorized'),
+                   COALESCE(source_type, 'Unknown'), agent_id, success, tokens_used,
+                   cost_estimate, accuracy_score, aht_saved_s, org_id
+            FROM queries
+            WHERE timestamp > ?
+            ORDER BY timestamp
+        """), (since,))
+        while True:
+            rows = read_cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            self._buffer.extend(rows)
+        read_cursor.close()
+        conn.close()
+        self._buffer.mark_loaded_since(since)
+
+    def _buffered_window(self, cutoff_time: datetime):
+        """The ring buffer, if it holds every event newer than cutoff_time"""
+        if self._buffer is not None and self._buffer.covers(cutoff_time):
+            return self._buffer
+        return None
+
+    @staticmethod
+    def _rollup_keys(event: Dict[str, Any]) -> List[tuple]:
+        """(dimension, key) pairs an event contributes to"""
+        return [
+            ("all", "all"),
+            ("category", event["category"]),
+            ("agent", event["agent_id"]),
+            ("source", event["source"]),
+        ]
+
+    def _apply_rollups(self, cursor, events: List[Dict[str, Any]]):
+        """
+        Fold events into hourly_rollups.
+        Events are pre-aggregated in memory so each rollup row is written once per batch.
+        """
+        pending: Dict[tuple, Dict[str, Any]] = {}
+        for event in events:
+            tenant = self._tenant(event["org_id"])
+            for dimension, key in self._rollup_keys(event):
+                row_key = (event["hour"], tenant, dimension, key)
+                acc = pending.get(row_key)
+                if acc is None:
+                    acc = pending[row_key] = {
+                        "query_count": 0, "success_count": 0, "total_response_time_ms": 0,
+                        "tokens_used": 0, "cost_estimate": 0.0, "accuracy_total": 0.0,
+                        "accuracy_count": 0, "aht_saved_s": 0, "sketch": LatencySketch(),
+                        # Question heavy hitters are tracked on the tenant-wide row only
+                        "top_queries": SpaceSaving() if dimension == "all" else None,
+                    }
+                acc["query_count"] += 1
+                acc["success_count"] += 1 if event["success"] else 0
+                acc["total_response_time_ms"] += event["response_time_ms"]
+                acc["tokens_used"] += event["tokens_used"]
+                acc["cost_estimate"] += event["cost_estimate"]
+                if event["accuracy_score"] is not None:
+                    # Unscored answers are counted once the evaluation worker scores them
+                    acc["accuracy_total"] += event["accuracy_score"]
+                    acc["accuracy_count"] += 1
+                acc["aht_saved_s"] += event["aht_saved_s"]
+                acc["sketch"].add(event["response_time_ms"])
+                if acc["top_queries"] is not None and event.get("query_text_id") is not None:
+                    acc["top_queries"].add(event["query_text_id"])
+
+        # Sketches are merged in Python: each row is locked from the read to the write, so
+        # concurrent writers (other instances) do not overwrite each other's merge.
+        # Rows are locked in key order, the same in every writer, so they cannot deadlock.
+        for (hour, org_id, dimension, key), acc in sorted(pending.items(), key=lambda item: tuple(map(str, item[0]))):
+            self.store.lock_row(cursor, "hourly_rollups", hour, org_id, dimension, key)
+            cursor.execute(self._sql("""
+                SELECT latency_sketch, top_queries FROM hourly_rollups
+                WHERE hour = ? AND org_id = ? AND dimension = ? AND dim_key = ?
+            """), (hour, org_id, dimension, key))
+            existing = cursor.fetchone()
+            if existing:
+                acc["sketch"].merge(LatencySketch.from_bytes(bytes(existing[0]) if existing[0] else None))
+                if acc["top_queries"] is not None:
+                    acc["top_queries"].merge(SpaceSaving.from_bytes(bytes(existing[1]) if existing[1] else None))
+
+            cursor.execute(self._sql("""
+                INSERT INTO hourly_rollups
+                (hour, org_id, dimension, dim_key, query_count, success_count, total_response_time_ms,
+                 tokens_used, cost_estimate, accuracy_total, accuracy_count, aht_saved_s, latency_sketch, top_queries)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(hour, org_id, dimension, dim_key) DO UPDATE SET
+                    query_count = hourly_rollups.query_count + excluded.query_count,
+                    success_count = hourly_rollups.success_count + excluded.success_count,
+                    total_response_time_ms = hourly_rollups.total_response_time_ms + excluded.total_response_time_ms,
+                    tokens_used = hourly_rollups.tokens_used + excluded.tokens_used,
+                    cost_estimate = hourly_rollups.cost_estimate + excluded.cost_estimate,
+                    accuracy_total = hourly_rollups.accuracy_total + excluded.accuracy_total,
+                    accuracy_count = hourly_rollups.accuracy_count + excluded.accuracy_count,
+                    aht_saved_s = hourly_rollups.aht_saved_s + excluded.aht_saved_s,
+                    latency_sketch = excluded.latency_sketch,
+                    top_queries = excluded.top_queries
+            """), (hour, org_id, dimension, key, acc["query_count"], acc["success_count"],
+                  acc["total_response_time_ms"], acc["tokens_used"], acc["cost_estimate"],
+                  acc["accuracy_total"], acc["accuracy_count"], acc["aht_saved_s"], acc["sketch"].to_bytes(),
+                  acc["top_queries"].to_bytes() if acc["top_queries"] is not None else None))
+
+    @staticmethod
+    def _trend_bucket(seconds: float, width: int) -> str:
+        """Label of the bucket of the given width containing a timestamp"""
+        return from_seconds(seconds - seconds % width).strftime('%Y-%m-%d %H:%M:00')
+
+    def _apply_trend_rollups(self, cursor, events: List[Dict[str, Any]]):
+        """Fold events into the 1m / 5m / 1d trend tiers (skipping already-expired buckets)"""
+        now = to_seconds(datetime.now())
+        pending: Dict[tuple, Dict[str, Any]] = {}
+        for event in events:
+            seconds = to_seconds(event["timestamp"])
+            tenant = self._tenant(event["org_id"])
+            for resolution in TREND_TABLE_TIERS:
+                width, retention_hours = TREND_TIERS[resolution]
+                if retention_hours is not None and seconds < now - retention_hours * 3600:
+                    continue
+                row_key = (resolution, tenant, self._trend_bucket(seconds, width))
+                acc = pending.get(row_key)
+                if acc is None:
+                    acc = pending[row_key] = {"query_count": 0, "success_count": 0,
+                                              "total_response_time_ms": 0, "sketch": LatencySketch()}
+                acc["query_count"] += 1
+                acc["success_count"] += 1 if event["success"] else 0
+                acc["total_response_time_ms"] += event["response_time_ms"]
+                acc["sketch"].add(event["response_time_ms"])
+
+        # Locked from read to write like hourly rows (see _apply_rollups)
+        for (resolution, org_id, bucket), acc in sorted(pending.items()):
+            self.store.lock_row(cursor, "trend_rollups", resolution, org_id, bucket)
+            cursor.execute(self._sql("""
+                SELECT latency_sketch FROM trend_rollups
+                WHERE resolution = ? AND org_id = ? AND bucket = ?
+            """), (resolution, org_id, bucket))
+            existing = cursor.fetchone()
+            if existing:
+                acc["sketch"].merge(LatencySketch.from_bytes(bytes(existing[0]) if existing[0] else None))
+
+            cursor.execute(self._sql("""
+                INSERT INTO trend_rollups
+                (resolution, org_id, bucket, query_count, success_count, total_response_time_ms, latency_sketch)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(resolution, org_id, bucket) DO UPDATE SET
+                    query_count = trend_rollups.query_count + excluded.query_count,
+                    success_count = trend_rollups.success_count + excluded.success_count,
+                    total_response_time_ms = trend_rollups.total_response_time_ms + excluded.total_response_time_ms,
+                    latency_sketch = excluded.latency_sketch
+            """), (resolution, org_id, bucket, acc["query_count"], acc["success_count"],
+                  acc["total_response_time_ms"], acc["sketch"].to_bytes()))
+
+    def _expire_trend_rollups(self, cursor):
+        """Drop fine-tier buckets past their retention (throttled)"""
+        if time.monotonic() < self._trend_expiry_at:
+            return
+        self._trend_expiry_at = time.monotonic() + TREND_EXPIRY_INTERVAL_S
+
+        now = datetime.now()
+        for resolution in TREND_TABLE_TIERS:
+            retention_hours = TREND_TIERS[resolution][1]
+            if retention_hours is not None:
+                cursor.execute(self._sql("DELETE FROM trend_rollups WHERE resolution = ? AND bucket < ?"), (
+                    resolution, (now - timedelta(hours=retention_hours)).strftime('%Y-%m-%d %H:%M:00')))
+
+    def _expire_evaluations(self, cursor):
+        """Drop queued answers past EVALUATION_QUEUE_RETENTION_HOURS (throttled)"""
+        if time.monotonic() < self._evaluation_expiry_at:
+            return
+        self._evaluation_expiry_at = time.monotonic() + EVALUATION_EXPIRY_INTERVAL_S
+
+        cursor.execute(self._sql("DELETE FROM query_evaluations WHERE timestamp < ?"), (
+            datetime.now() - timedelta(hours=EVALUATION_QUEUE_RETENTION_HOURS),))
+
+    def rebuild_rollups(
+        self,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        org_ids: Optional[List[str]] = None,
+        batch_size: int = 10000
+    ):
+        """
+        Recompute hourly and trend rollups from raw queries, from `since` (or
+        all history) to the end of the day containing `until`, optionally for
+        some tenants only (org_id keys). Used for backfills and after bulk
+        imports that bypass log_query.
+
+        Only the range still covered by hot rows is replaced: days archived to
+        Parquet have no raw rows left, so their rollups are kept.
+        """
+        conn = self.store.connect()
+        cursor = conn.cursor()
+
+        tenant_filter = ""
+        tenant_params: tuple = ()
+        if org_ids:
+            tenant_filter = f" AND org_id IN ({', '.join('?' for _ in org_ids)})"
+            tenant_params = tuple(org_ids)
+
+        cursor.execute(self._sql("SELECT MIN(timestamp) FROM queries WHERE 1 = 1" + tenant_filter), tenant_params)
+        oldest = cursor.fetchone()[0]
+        if oldest is None:
+            conn.close()
+            return
+        # Archiving removes whole days, so the oldest hot day is complete
+        oldest_day = str(oldest).replace("T", " ")[:10] + " 00:00:00"
+
+        since_hour = max(since.strftime('%Y-%m-%d %H:00:00'), oldest_day) if since else oldest_day
+        # Daily buckets are only complete when rebuilt from midnight to midnight
+        since_day = since_hour[:10] + " 00:00:00"
+        until_day = (until + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00') if until else "9999-12-31 00:00:00"
+
+        cursor.execute(self._sql("DELETE FROM hourly_rollups WHERE hour >= ? AND hour < ?" + tenant_filter),
+                       (since_hour, until_day, *tenant_params))
+        cursor.execute(self._sql("DELETE FROM trend_rollups WHERE bucket >= ? AND bucket < ?" + tenant_filter),
+                       (since_day, until_day, *tenant_params))
+
+        read_cursor = self.store.streaming_cursor(conn)
+        read_cursor.execute(self._sql("""
+            SELECT timestamp, response_time_ms, COALESCE(question_category, 'Uncategorized'),
+                   COALESCE(source_type, 'Unknown'), agent_id, success, tokens_used,
+                   cost_estimate, accuracy_score, aht_saved_s, org_id, query_text_id
+            FROM queries
+            WHERE timestamp >= ? AND timestamp < ?""" + tenant_filter), (since_day, until_day, *tenant_params))
+
+        while True:
+            rows = read_cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            events = [
+                {
+                    "timestamp": row[0],
+                    "hour": str(row[0]).replace("T", " ")[:13] + ":00:00",
+                    "response_time_ms": row[1],
+                    "category": row[2],
+                    "source": row[3],
+                    "agent_id": row[4],
+                    "success": bool(row[5]),
+                    "tokens_used": row[6] or 0,
+                    "cost_estimate": float(row[7] or 0.0),
+                    "accuracy_score": float(row[8]) if row[8] is not None else None,
+                    "aht_saved_s": row[9] or 0,
+                    "org_id": str(row[10] or DEFAULT_ORG_ID),
+                    "query_text_id": row[11],
+                }
+                for row in rows
+            ]
+            # Rows before since_hour only belong to the daily tier being rebuilt
+            self._apply_rollups(cursor, [event for event in events if event["hour"] >= since_hour])
+            self._apply_trend_rollups(cursor, events)
+
+        read_cursor.close()
         conn.commit()
         conn.close()
 
-    def _migrate_database(self):
-        """Simple migration to add new columns if they don't exist"""
-        conn = sqlite3.connect(DB_PATH)
+    def _rollup_sketches(self, cursor, cutoff_time: datetime, dimension: str, tenant: str, by_hour: bool = False) -> Dict[str, LatencySketch]:
+        """
+        Merge persisted latency sketches for a window, keyed by dim_key (or by hour).
+        A 168-hour window merges at most 168 small blobs per key.
+        """
+        group_column = "hour" if by_hour else "dim_key"
+        cursor.execute(self._sql(f"""
+            SELECT {group_column}, latency_sketch
+            FROM hourly_rollups
+            WHERE hour >= ? AND dimension = ? AND org_id = ?
+        """), (cutoff_time.strftime('%Y-%m-%d %H:00:00'), dimension, tenant))
+
+        sketches: Dict[str, LatencySketch] = {}
+        for key, blob in cursor.fetchall():
+            sketches.setdefault(key, LatencySketch()).merge(LatencySketch.from_bytes(bytes(blob) if blob else None))
+        return sketches
+
+    def _write_events(
+        self,
+        events: List[Dict[str, Any]],
+        write_start: Optional[float] = None,
+        batch_key: Optional[str] = None
+    ) -> List[QueryId]:
+        """
+        Persist a batch of events in one transaction: raw rows (bulk insert),
+        agent counters, hourly rollups and per-request stage rows.
+        Query and error text are stored once in text_dictionary and referenced by id.
+
+        Args:
+            batch_key: Identifies a replayable batch; a batch already loaded is skipped
+        """
+        conn = self.store.connect()
         cursor = conn.cursor()
-        
-        try:
-            # Check if new columns exist
-            cursor.execute("SELECT tokens_used FROM queries LIMIT 1")
-        except sqlite3.OperationalError:
-            # Add missing columns
-            print("Migrating database: Adding new metric columns...")
-            try:
-                cursor.execute("ALTER TABLE queries ADD COLUMN tokens_used INTEGER DEFAULT 0")
-                cursor.execute("ALTER TABLE queries ADD COLUMN cost_estimate REAL DEFAULT 0.0")
-                cursor.execute("ALTER TABLE queries ADD COLUMN accuracy_score REAL DEFAULT 0.0")
-                cursor.execute("ALTER TABLE queries ADD COLUMN aht_saved_s INTEGER DEFAULT 0")
-                conn.commit()
-            except Exception as e:
-                print(f"Migration warning: {e}")
-        
+
+        query_text_ids = self.store.intern_texts(cursor, [event["query_text"] for event in events])
+        error_message_ids = self.store.intern_texts(cursor, [event["error_message"] for event in events])
+        conn.commit()
+
+        if batch_key is not None:
+            cursor.execute(self._sql("""
+                INSERT INTO event_log_batches (batch_key) VALUES (?)
+                ON CONFLICT (batch_key) DO NOTHING
+            """), (batch_key,))
+            if cursor.rowcount == 0:
+                # Loaded before a crash between commit and segment deletion
+                conn.rollback()
+                conn.close()
+                return []
+
+        rows = []
+        for event, query_text_id, error_message_id in zip(events, query_text_ids, error_message_ids):
+            event["query_text_id"] = query_text_id
+            rows.append({
+                "query_id": event.get("query_id"),
+                "timestamp": datetime.fromisoformat(event["timestamp"]),
+                "query_text_id": query_text_id,
+                "response_time_ms": event["response_time_ms"],
+                "question_category": event["question_category"],
+                "source_type": event["source_type"],
+                "agent_id": event["agent_id"],
+                "success": event["success"],
+                "error_message_id": error_message_id,
+                "tokens_used": event["tokens_used"],
+                "cost_estimate": event["cost_estimate"],
+                "accuracy_score": event["accuracy_score"],
+                "aht_saved_s": event["aht_saved_s"],
+                "org_id": self._tenant(event["org_id"]),
+            })
+        query_ids = self.store.insert_queries(cursor, rows)
+
+        # Update agent stats
+        agent_counts: Dict[str, int] = {}
+        for event in events:
+            agent_counts[event["agent_id"]] = agent_counts.get(event["agent_id"], 0) + 1
+        for agent_id, count in agent_counts.items():
+            cursor.execute(self._sql("""
+                INSERT INTO agents (agent_id, total_queries)
+                VALUES (?, ?)
+                ON CONFLICT(agent_id) DO UPDATE SET
+                    last_seen = CURRENT_TIMESTAMP,
+                    total_queries = agents.total_queries + excluded.total_queries
+            """), (agent_id, count))
+
+        self._apply_rollups(cursor, events)
+        self._apply_trend_rollups(cursor, events)
+        self._expire_trend_rollups(cursor)
+        self._expire_evaluations(cursor)
+
+        for query_id, row, event in zip(query_ids, rows, events):
+            stages = event.get("stages")
+            if stages is None:
+                continue
+            if write_start is not None and "metrics_write" not in stages:
+                # The stage row itself is written in the same transaction, so the
+                # metrics write cost is measured up to this point
+                stages["metrics_write"] = (time.perf_counter() - write_start) * 1000
+            cursor.execute(self._sql(f"""
+                INSERT INTO query_stages (query_id, timestamp, org_id, {", ".join(f"{stage}_ms" for stage in STAGES)})
+                VALUES (?, ?, ?, {", ".join("?" for _ in STAGES)})
+            """), (query_id, row["timestamp"], row["org_id"], *(stages.get(stage) for stage in STAGES)))
+
+        for query_id, row, event in zip(query_ids, rows, events):
+            if event.get("answer") is None or event["accuracy_score"] is not None:
+                continue
+            cursor.execute(self._sql("""
+                INSERT INTO query_evaluations (query_id, timestamp, org_id, answer, context)
+                VALUES (?, ?, ?, ?, ?)
+            """), (query_id, row["timestamp"], row["org_id"], event["answer"], json.dumps(event.get("context") or [])))
+
+        conn.commit()
         conn.close()
-    
+        return query_ids
+
     def log_query(
         self,
         query_text: str,
@@ -116,302 +582,834 @@ class MetricsService:
         success: bool = True,
         error_message: Optional[str] = None,
         tokens_used: int = 0,
-        cost_estimate: float = 0.0
-    ) -> int:
+        cost_estimate: float = 0.0,
+        org_id: str = DEFAULT_ORG_ID,
+        stages: Optional[Dict[str, float]] = None,
+        answer: Optional[str] = None,
+        context: Optional[List[str]] = None
+    ) -> QueryId:
         """
-        Log a query to the metrics database
-        
+        Log a query to the metrics database and push the delta to live dashboards
+
+        Args:
+            stages: Optional per-stage durations (ms) from the request trace
+            answer: Answer returned to the guest; queued with `context` for accuracy scoring
+            context: Retrieved passages the answer was generated from
+
         Returns:
-            query_id: ID of the logged query
+            query_id: ID of the logged query (None when it is assigned at compaction)
         """
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Simulate accuracy score (0.85 - 1.0 for successful queries)
-        accuracy_score = 0.0
-        if success:
-            accuracy_score = round(random.uniform(0.85, 1.0), 2)
-            
+        write_start = time.perf_counter()
+        now = datetime.now()
+
+        # Successful answers are scored later by the evaluation worker (None until then)
+        accuracy_score = None if success else 0.0
+
         # Simulate AHT saved (manual search takes ~300s, AI takes ~3s)
         aht_saved_s = 0
         if success:
             aht_saved_s = max(0, 300 - (response_time_ms / 1000))
-            
+
         # Simulate tokens and cost if not provided (for demo)
         if tokens_used == 0 and success:
             tokens_used = random.randint(150, 500)
             cost_estimate = (tokens_used / 1000) * 0.03 # Approx GPT-4o cost
-        
-        cursor.execute("""
-            INSERT INTO queries 
-            (query_text, response_time_ms, question_category, source_type, agent_id, success, error_message, 
-             tokens_used, cost_estimate, accuracy_score, aht_saved_s)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (query_text, response_time_ms, question_category, source_type, agent_id, success, error_message,
-              tokens_used, cost_estimate, accuracy_score, int(aht_saved_s)))
-        
-        query_id = cursor.lastrowid
-        
-        # Update agent stats
-        cursor.execute("""
-            INSERT INTO agents (agent_id, total_queries)
-            VALUES (?, 1)
-            ON CONFLICT(agent_id) DO UPDATE SET
-                last_seen = CURRENT_TIMESTAMP,
-                total_queries = total_queries + 1
-        """, (agent_id,))
-        
+
+        event = {
+            "timestamp": now.isoformat(),
+            "hour": now.strftime('%Y-%m-%d %H:00:00'),
+            "org_id": org_id,
+            "query_text": query_text,
+            "question_category": question_category,
+            "source_type": source_type,
+            "error_message": error_message,
+            "response_time_ms": response_time_ms,
+            "category": question_category or "Uncategorized",
+            "source": source_type or "Unknown",
+            "agent_id": agent_id,
+            "success": success,
+            "tokens_used": tokens_used,
+            "cost_estimate": cost_estimate,
+            "accuracy_score": accuracy_score,
+            "aht_saved_s": int(aht_saved_s),
+            "stages": dict(stages) if stages is not None else None,
+            "answer": answer,
+            "context": list(context) if context is not None else None,
+        }
+
+        if self._event_log is not None:
+            # Sequential append; the compactor loads the segment in bulk once it closes
+            query_id = event["query_id"] = self.store.new_query_id()
+            if event["stages"] is not None:
+                event["stages"]["metrics_write"] = (time.perf_counter() - write_start) * 1000
+            self._event_log.append(event)
+        elif self._writer is not None:
+            # Remote store: enqueue and let the writer flush multi-row batches
+            query_id = event["query_id"] = self.store.new_query_id()
+            if event["stages"] is not None:
+                event["stages"]["metrics_write"] = (time.perf_counter() - write_start) * 1000
+            self._writer.submit(event)
+        else:
+            query_id = self._write_events([event], write_start)[0]
+
+        if self._buffer is not None:
+            self._buffer.extend([(
+                now, response_time_ms, event["category"], event["source"], agent_id, success,
+                tokens_used, cost_estimate, accuracy_score, event["aht_saved_s"], self._tenant(org_id),
+            )])
+
+        trace = current_trace()
+        if trace is not None and event["stages"] is not None:
+            trace.record("metrics_write", event["stages"]["metrics_write"])
+
+        # Push the increment to live dashboards (no database reads per viewer)
+        get_metrics_broadcaster().publish(org_id, event)
+
+        return query_id
+
+    def get_checkpoint(self, worker: str) -> int:
+        """Last position a background worker committed (0 if it never ran)"""
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        cursor.execute(self._sql("SELECT position FROM worker_checkpoints WHERE worker = ?"), (worker,))
+        row = cursor.fetchone()
+        conn.close()
+        return int(row[0]) if row else 0
+
+    def pending_evaluations(self, after_seq: int, limit: int, settle_s: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Queued answers after a high-water mark, oldest first.
+        Rows younger than settle_s are left for the next pass so that
+        concurrently committing writers cannot slip in below the mark.
+        """
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        cursor.execute(self._sql("""
+            SELECT e.seq, e.query_id, e.timestamp, e.org_id, e.answer, e.context,
+                   COALESCE(q.question_category, 'Uncategorized'), q.agent_id, COALESCE(q.source_type, 'Unknown')
+            FROM query_evaluations e
+            JOIN queries q ON q.id = e.query_id AND q.timestamp = e.timestamp
+            WHERE e.seq > ? AND e.created_at < ?
+            ORDER BY e.seq
+            LIMIT ?
+        """), (after_seq, datetime.now(timezone.utc) - timedelta(seconds=settle_s), limit))
+        rows = cursor.fetchall()
+        conn.close()
+
+        return [
+            {
+                "seq": row[0],
+                "query_id": row[1],
+                "timestamp": row[2],
+                "hour": str(row[2]).replace("T", " ")[:13] + ":00:00",
+                "org_id": str(row[3] or DEFAULT_ORG_ID),
+                "answer": row[4] or "",
+                "context": json.loads(row[5]) if row[5] else [],
+                "category": row[6],
+                "agent_id": row[7],
+                "source": row[8],
+            }
+            for row in rows
+        ]
+
+    def record_accuracy_scores(self, evaluations: List[Dict[str, Any]], worker: str, previous_position: int) -> bool:
+        """
+        Write scores back in one transaction: raw rows, hourly rollup
+        accuracy counters and the worker's high-water mark. Queued answers up
+        to the mark are deleted; the score is all that is kept.
+
+        Args:
+            evaluations: Rows from pending_evaluations with a "score" added
+            previous_position: Mark the batch was read after
+
+        Returns:
+            False if another worker moved the mark first (nothing is written)
+        """
+        conn = self.store.connect()
+        cursor = conn.cursor()
+
+        # Advancing the mark first serializes workers on the checkpoint row
+        cursor.execute(self._sql("""
+            INSERT INTO worker_checkpoints (worker, position) VALUES (?, ?)
+            ON CONFLICT (worker) DO UPDATE SET position = excluded.position, updated_at = CURRENT_TIMESTAMP
+            WHERE worker_checkpoints.position = ?
+        """), (worker, evaluations[-1]["seq"], previous_position))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            conn.close()
+            return False
+
+        cursor.executemany(self._sql("""
+            UPDATE queries SET accuracy_score = ?
+            WHERE id = ? AND timestamp = ?
+        """), [(evaluation["score"], evaluation["query_id"], evaluation["timestamp"]) for evaluation in evaluations])
+
+        pending: Dict[tuple, List[float]] = {}
+        for evaluation in evaluations:
+            for dimension, key in self._rollup_keys(evaluation):
+                acc = pending.setdefault((evaluation["hour"], evaluation["org_id"], dimension, key), [0.0, 0])
+                acc[0] += evaluation["score"]
+                acc[1] += 1
+        cursor.executemany(self._sql("""
+            UPDATE hourly_rollups
+            SET accuracy_total = accuracy_total + ?, accuracy_count = accuracy_count + ?
+            WHERE hour = ? AND org_id = ? AND dimension = ? AND dim_key = ?
+        """), [(total, count, *row_key) for row_key, (total, count) in pending.items()])
+        cursor.execute(self._sql("DELETE FROM query_evaluations WHERE seq <= ?"), (evaluations[-1]["seq"],))
         conn.commit()
         conn.close()
-        
-        return query_id
-    
+
+        if self._buffer is not None:
+            self._buffer.set_accuracy(
+                (evaluation["timestamp"], evaluation["org_id"], evaluation["score"]) for evaluation in evaluations
+            )
+        return True
+
+    def compact_event_log(self, batch_size: int = METRICS_BATCH_SIZE) -> int:
+        """
+        Load closed event log segments into the analytics store in bulk, then
+        delete them. Each batch is recorded with its rows, so a segment
+        replayed after a crash is never double-counted.
+
+        Returns:
+            Number of events loaded
+        """
+        loaded = 0
+        for path in self._event_log.closed_segments():
+            with self._event_log.claim(path) as claimed:
+                if not claimed:
+                    continue
+                # This process buffered its own events at append time; others' are added here
+                feed_buffer = self._buffer is not None and not path.name.startswith(self._event_log.prefix)
+                batch: List[Dict[str, Any]] = []
+                batch_key = None
+                for offset, event in read_segment(path):
+                    if not batch:
+                        batch_key = f"{path.name}:{offset}"
+                    batch.append(event)
+                    if len(batch) >= batch_size:
+                        loaded += self._load_batch(batch, batch_key, feed_buffer)
+                        batch = []
+                if batch:
+                    loaded += self._load_batch(batch, batch_key, feed_buffer)
+                path.unlink()
+
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        cursor.execute(self._sql("DELETE FROM event_log_batches WHERE loaded_at < ?"), (
+            datetime.now(timezone.utc) - timedelta(hours=EVENT_LOG_BATCH_RETENTION_HOURS),))
+        conn.commit()
+        conn.close()
+        return loaded
+
+    def _load_batch(self, events: List[Dict[str, Any]], batch_key: str, feed_buffer: bool) -> int:
+        written = self._write_events(events, batch_key=batch_key)
+        if written and feed_buffer:
+            self._buffer.extend(
+                (
+                    event["timestamp"], event["response_time_ms"], event["category"], event["source"],
+                    event["agent_id"], event["success"], event["tokens_used"], event["cost_estimate"],
+                    event["accuracy_score"], event["aht_saved_s"], self._tenant(event["org_id"]),
+                )
+                for event in events
+            )
+        return len(written)
+
+    def _run_compactor(self):
+        """Compaction loop for the background thread"""
+        while True:
+            try:
+                self.compact_event_log()
+            except Exception as e:
+                print(f"Metrics event log compaction error: {e}")
+                ERRORS.inc(component="event_log")
+            time.sleep(METRICS_COMPACT_INTERVAL_S)
+
     def log_conversion(
         self,
-        query_id: int,
+        query_id: QueryId,
         conversion_type: str = "booking",
         value: float = 0.0
     ):
         """Log a conversion event"""
-        conn = sqlite3.connect(DB_PATH)
+        conn = self.store.connect()
         cursor = conn.cursor()
-        
-        cursor.execute("""
+
+        cursor.execute(self._sql("""
             INSERT INTO conversions (query_id, conversion_type, value)
             VALUES (?, ?, ?)
-        """, (query_id, conversion_type, value))
-        
+        """), (query_id, conversion_type, value))
+
         conn.commit()
         conn.close()
-    
-    def get_summary_metrics(self, hours: int = 24) -> Dict[str, Any]:
+
+    def _group_stats(self, cutoff_time: datetime, tenant: str, by: str) -> List[Dict[str, Any]]:
         """
-        Get summary metrics for the dashboard
+        Per-group statistics (same shape as MetricsRingBuffer.group_stats),
+        from the ring buffer when it covers the window, otherwise from the database.
         """
-        conn = sqlite3.connect(DB_PATH)
+        buffer = self._buffered_window(cutoff_time)
+        if buffer is not None:
+            return buffer.group_stats(cutoff_time, tenant, by, LATENCY_QUANTILES)
+
+        group_column, order, dimension = {
+            "category": ("COALESCE(question_category, 'Uncategorized')", "count DESC", None),
+            "source": ("COALESCE(source_type, 'Unknown')", "count DESC", None),
+            "agent": ("agent_id", "count DESC", "agent"),
+            "hour": ("{hour}", "group_key ASC", "all"),
+        }[by]
+
+        conn = self.store.connect()
         cursor = conn.cursor()
-        
-        cutoff_time = datetime.now() - timedelta(hours=hours)
-        
-        # Basic stats
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total,
+        cursor.execute(self._sql(f"""
+            SELECT
+                {group_column} as group_key,
+                COUNT(*) as count,
                 AVG(response_time_ms) as avg_time,
-                AVG(accuracy_score) * 100 as avg_accuracy,
-                SUM(aht_saved_s) as total_saved_s,
-                SUM(tokens_used) as total_tokens,
-                SUM(cost_estimate) as total_cost
-            FROM queries
-            WHERE timestamp > ?
-        """, (cutoff_time,))
-        
-        row = cursor.fetchone()
-        total_queries = row[0] or 0
-        avg_response_time = row[1] or 0
-        avg_accuracy = row[2] or 0
-        total_saved_s = row[3] or 0
-        total_tokens = row[4] or 0
-        total_cost = row[5] or 0.0
-        
-        # Success rate
-        cursor.execute("""
-            SELECT 
-                COUNT(CASE WHEN success = TRUE THEN 1 END) * 100.0 / COUNT(*) as success_rate
-            FROM queries
-            WHERE timestamp > ?
-        """, (cutoff_time,))
-        success_rate = cursor.fetchone()[0] or 100.0
-        
-        # Unique agents
-        cursor.execute("""
-            SELECT COUNT(DISTINCT agent_id) FROM queries
-            WHERE timestamp > ?
-        """, (cutoff_time,))
-        unique_agents = cursor.fetchone()[0]
-        
-        # RAG vs Maps counts for breakdown
-        cursor.execute("""
-            SELECT 
-                COUNT(CASE WHEN source_type = 'RAG' THEN 1 END) as rag_count,
-                COUNT(CASE WHEN source_type = 'Maps' THEN 1 END) as maps_count
+                AVG(accuracy_score) * 100 as accuracy,
+                COUNT(CASE WHEN success = TRUE THEN 1 END) * 100.0 / COUNT(*) as success_rate,
+                MAX(timestamp) as last_active
             FROM queries
-            WHERE timestamp > ?
-        """, (cutoff_time,))
-        source_counts = cursor.fetchone()
-        rag_count = source_counts[0] or 0
-        maps_count = source_counts[1] or 0
-        
+            WHERE timestamp > ? AND org_id = ?
+            GROUP BY group_key
+            ORDER BY {order}
+        """), (cutoff_time, tenant))
+        results = cursor.fetchall()
+
+        sketches = {}
+        if dimension is not None:
+            sketches = self._rollup_sketches(cursor, cutoff_time, dimension, tenant, by_hour=(by == "hour"))
+        conn.close()
+
+        return [
+            {
+                "key": row[0],
+                "count": row[1],
+                "avg_response_time": float(row[2]),
+                "avg_accuracy": float(row[3] or 0),
+                "success_rate": float(row[4]),
+                "last_timestamp": row[5],
+                "percentiles": sketches.get(row[0], LatencySketch()).percentiles(*LATENCY_QUANTILES),
+            }
+            for row in results
+        ]
+
+    @staticmethod
+    def _period_metrics(totals: Dict[str, Any]) -> Dict[str, float]:
+        """Summary metrics derived from summed rollup counters"""
+        count = totals["query_count"]
+        avg_response_time = totals["total_response_time_ms"] / count if count else 0.0
+        return {
+            "total_queries": count,
+            "avg_response_time_ms": avg_response_time,
+            "success_rate": totals["success_count"] * 100.0 / count if count else 0.0,
+            "accuracy_percent": totals["accuracy_total"] * 100.0 / totals["accuracy_count"] if totals["accuracy_count"] else 0.0,
+            "aht_reduction_percent": (300 - avg_response_time / 1000) / 300 * 100 if count else 0.0,
+            "tokens_used": totals["tokens_used"],
+            "estimated_cost": totals["cost_estimate"],
+            "rag_percentage": totals["rag_count"] * 100.0 / count if count else 0.0,
+            "maps_percentage": totals["maps_count"] * 100.0 / count if count else 0.0,
+        }
+
+    def _compare_periods(
+        self,
+        hours: int,
+        tenant: str,
+        compare: str,
+        offset_hours: Optional[int]
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Sum the current window and an earlier one of the same length from
+        hourly rollups in a single pass. A row can fall in both windows when
+        they overlap (e.g. 7 days vs the same 7 days shifted by one day).
+        Windows are aligned to whole hours and include the current hour.
+
+        Returns:
+            (current period totals, comparison)
+        """
+        if offset_hours is None:
+            if compare not in COMPARISON_OFFSETS:
+                raise ValueError(f"Unknown comparison window: {compare}")
+            offset_hours = COMPARISON_OFFSETS[compare] or hours
+        else:
+            compare = "custom"
+
+        hour_format = '%Y-%m-%d %H:00:00'
+        current_end = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        current_start = current_end - timedelta(hours=hours)
+        previous_end = current_end - timedelta(hours=offset_hours)
+        previous_start = current_start - timedelta(hours=offset_hours)
+        windows = [moment.strftime(hour_format) for moment in (current_start, current_end, previous_start, previous_end)]
+
+        periods = {}
+        for period in ("current", "previous"):
+            periods[period] = {measure: 0.0 for measure in _COMPARISON_MEASURES}
+            periods[period].update(rag_count=0.0, maps_count=0.0, agents=set(), latency=LatencySketch())
+        bounds = {"current": windows[0:2], "previous": windows[2:4]}
+
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        cursor.execute(self._sql(f"""
+            SELECT hour, dimension, dim_key, {", ".join(_COMPARISON_MEASURES)}, latency_sketch
+            FROM hourly_rollups
+            WHERE org_id = ? AND dimension IN ('all', 'source', 'agent')
+              AND ((hour >= ? AND hour < ?) OR (hour >= ? AND hour < ?))
+        """), (tenant, *windows))
+        for row in cursor.fetchall():
+            hour, dimension, dim_key = str(row[0]), row[1], row[2]
+            measures = dict(zip(_COMPARISON_MEASURES, row[3:-1]))
+            for period, (start, end) in bounds.items():
+                if not start <= hour < end:
+                    continue
+                totals = periods[period]
+                if dimension == "all":
+                    for measure, value in measures.items():
+                        totals[measure] += float(value or 0)
+                    if period == "current":
+                        totals["latency"].merge(LatencySketch.from_bytes(bytes(row[-1]) if row[-1] else None))
+                elif dimension == "source" and dim_key in ("RAG", "Maps"):
+                    totals[f"{dim_key.lower()}_count"] += float(measures["query_count"] or 0)
+                elif dimension == "agent" and measures["query_count"]:
+                    totals["agents"].add(dim_key)
+        conn.close()
+
+        current = self._period_metrics(periods["current"])
+        previous = self._period_metrics(periods["previous"])
+        # Deltas against an empty period would just repeat the current values
+        has_previous = periods["previous"]["query_count"] > 0
+
+        metrics = {}
+        for name in current:
+            delta = current[name] - previous[name]
+            metrics[name] = {
+                "current": round(current[name], 4),
+                "previous": round(previous[name], 4),
+                "delta": round(delta, 4) if has_previous else None,
+                "delta_percent": round(delta / previous[name] * 100, 1) if has_previous and previous[name] else None,
+            }
+
+        comparison = {
+            "compare": compare,
+            "offset_hours": offset_hours,
+            "current_start": windows[0],
+            "previous_start": windows[2],
+            "metrics": metrics,
+        }
+        return periods["current"], comparison
+
+    def get_period_comparison(
+        self,
+        hours: int = 24,
+        org_id: str = DEFAULT_ORG_ID,
+        compare: str = "previous",
+        offset_hours: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Compare the current window with an earlier one of the same length.
+        Deltas are None when the earlier window has no queries.
+
+        Args:
+            compare: "previous", "day" or "week" (ignored if offset_hours is given)
+            offset_hours: Arbitrary shift of the comparison window
+        """
+        return self._compare_periods(hours, self._tenant(org_id), compare, offset_hours)[1]
+
+    def get_summary_metrics(
+        self,
+        hours: int = 24,
+        org_id: str = DEFAULT_ORG_ID,
+        compare: str = "previous",
+        compare_offset_hours: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Get summary metrics for the dashboard, with a comparison against an earlier window.
+        The summary is the comparison's current period, so both come from the same rollup pass.
+        """
+        totals, comparison = self._compare_periods(hours, self._tenant(org_id), compare, compare_offset_hours)
+        current = self._period_metrics(totals)
+
+        total_queries = int(totals["query_count"])
+        avg_accuracy = current["accuracy_percent"]
+        percentiles = totals["latency"].percentiles(*LATENCY_QUANTILES)
+
         # Internal vs External Accuracy (Simulated split for now)
         internal_accuracy = avg_accuracy  # Proxy
         external_accuracy = avg_accuracy * 0.95 # Proxy
-        
-        # AHT Reduction (Simulated baseline of 300s per query)
-        # Calculate % reduction: (Baseline - Actual) / Baseline
-        # Baseline total time = total_queries * 300s
-        # Actual total time = total_queries * (avg_response_time / 1000)
-        aht_reduction_percent = 0
-        if total_queries > 0:
-            baseline_time = total_queries * 300
-            actual_time = total_queries * (avg_response_time / 1000)
-            if baseline_time > 0:
-                aht_reduction_percent = ((baseline_time - actual_time) / baseline_time) * 100
 
-        conn.close()
-        
+        # AHT Reduction (Simulated baseline of 300s per query):
+        # (Baseline - Actual) / Baseline, see _period_metrics
+        aht_delta = comparison["metrics"]["aht_reduction_percent"]["delta"]
+
         return {
             "total_queries": total_queries,
-            "avg_response_time_ms": round(avg_response_time, 2),
-            "success_rate": round(success_rate, 2),
-            "unique_agents": unique_agents,
+            "avg_response_time_ms": round(current["avg_response_time_ms"], 2),
+            "p50_response_time_ms": percentiles["p50"],
+            "p90_response_time_ms": percentiles["p90"],
+            "p99_response_time_ms": percentiles["p99"],
+            "success_rate": round(current["success_rate"], 2) if total_queries else 100.0,
+            "unique_agents": len(totals["agents"]),
             "period_hours": hours,
-            
+
             # New fields for design.json
             "accuracy_percent": round(avg_accuracy, 1),
             "internal_accuracy_percent": round(internal_accuracy, 1),
             "external_accuracy_percent": round(external_accuracy, 1),
-            "aht_reduction_percent": round(aht_reduction_percent, 1),
-            "aht_delta_percent": 2.5, # Simulated DoD change
-            
-            "rag_count": rag_count,
-            "rag_percentage": round((rag_count / total_queries * 100) if total_queries else 0, 1),
-            "maps_count": maps_count,
-            "maps_percentage": round((maps_count / total_queries * 100) if total_queries else 0, 1),
-            
-            "tokens_used": total_tokens,
-            "estimated_cost": round(total_cost, 4),
+            "aht_reduction_percent": round(current["aht_reduction_percent"], 1),
+            "aht_delta_percent": round(aht_delta, 1) if aht_delta is not None else None,
+
+            "rag_count": int(totals["rag_count"]),
+            "rag_percentage": round(current["rag_percentage"], 1),
+            "maps_count": int(totals["maps_count"]),
+            "maps_percentage": round(current["maps_percentage"], 1),
+
+            "tokens_used": int(totals["tokens_used"]),
+            "estimated_cost": round(totals["cost_estimate"], 4),
             "rate_limit_status": "Healthy",
-            "cost_breakdown": "GPT-4o: 80%, Maps: 20%"
+            "cost_breakdown": "GPT-4o: 80%, Maps: 20%",
+            "comparison": comparison
         }
-    
-    def get_question_categories(self, hours: int = 24) -> List[Dict[str, Any]]:
+
+    def get_question_categories(self, hours: int = 24, org_id: str = DEFAULT_ORG_ID) -> List[Dict[str, Any]]:
         """Get breakdown of questions by category"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
         cutoff_time = datetime.now() - timedelta(hours=hours)
-        
-        cursor.execute("""
-            SELECT 
-                COALESCE(question_category, 'Uncategorized') as category,
-                COUNT(*) as count,
-                AVG(response_time_ms) as avg_time,
-                AVG(accuracy_score) * 100 as accuracy
-            FROM queries
-            WHERE timestamp > ?
-            GROUP BY question_category
-            ORDER BY count DESC
-        """, (cutoff_time,))
-        
-        results = cursor.fetchall()
-        conn.close()
-        
+
         return [
             {
-                "category": row[0],
-                "count": row[1],
-                "avg_ai_time": round(row[2], 2), # Renamed to match design.json
-                "accuracy": round(row[3] or 0, 1) # Added accuracy
+                "category": group["key"],
+                "count": group["count"],
+                "avg_ai_time": round(group["avg_response_time"], 2), # Renamed to match design.json
+                "accuracy": round(group["avg_accuracy"], 1) # Added accuracy
             }
-            for row in results
+            for group in self._group_stats(cutoff_time, self._tenant(org_id), "category")
         ]
-    
-    def get_hourly_trends(self, hours: int = 24) -> List[Dict[str, Any]]:
-        """Get hourly query trends"""
-        conn = sqlite3.connect(DB_PATH)
+
+    @staticmethod
+    def _resolve_granularity(hours: int, granularity: str) -> Tuple[str, int]:
+        """
+        Pick the bucket width (seconds) and the coarsest tier that can serve it.
+        The width is coarsened so a window never returns more than MAX_TREND_POINTS.
+        """
+        if granularity == "auto":
+            width = 0
+        else:
+            match = _GRANULARITY_PATTERN.match(granularity)
+            if not match or int(match.group(1)) == 0:
+                raise ValueError(f"Invalid granularity: {granularity} (use e.g. 1m, 15m, 1h, 1d or auto)")
+            width = int(match.group(1)) * _GRANULARITY_UNITS[match.group(2)]
+
+        min_width = hours * 3600 / MAX_TREND_POINTS
+        if width < min_width:
+            width = min(tier_width for tier_width, _ in TREND_TIERS.values() if tier_width >= min_width)
+
+        # Tiers that still hold the whole window, finest first
+        candidates = [resolution for resolution, (_, retention_hours) in TREND_TIERS.items()
+                      if retention_hours is None or retention_hours >= hours]
+        finest_width = TREND_TIERS[candidates[0]][0]
+        width = -(-width // finest_width) * finest_width
+
+        for resolution in reversed(candidates):
+            if width % TREND_TIERS[resolution][0] == 0:
+                return resolution, width
+        return candidates[0], width
+
+    def _tiered_trends(self, hours: int, tenant: str, granularity: str) -> List[Dict[str, Any]]:
+        """Trend points at the requested granularity, merged from the best-fitting tier"""
+        resolution, width = self._resolve_granularity(hours, granularity)
+
+        now = to_seconds(datetime.now())
+        start = self._trend_bucket(now - hours * 3600, width)
+
+        conn = self.store.connect()
         cursor = conn.cursor()
-        
-        cutoff_time = datetime.now() - timedelta(hours=hours)
-        
-        cursor.execute("""
-            SELECT 
-                strftime('%Y-%m-%d %H:00:00', timestamp) as hour,
-                COUNT(*) as query_count,
-                AVG(response_time_ms) as avg_response_time,
-                COUNT(CASE WHEN success = TRUE THEN 1 END) * 100.0 / COUNT(*) as success_rate
-            FROM queries
-            WHERE timestamp > ?
-            GROUP BY hour
-            ORDER BY hour ASC
-        """, (cutoff_time,))
-        
-        results = cursor.fetchall()
+        if resolution == "1h":
+            cursor.execute(self._sql("""
+                SELECT hour, query_count, success_count, total_response_time_ms, latency_sketch
+                FROM hourly_rollups
+                WHERE dimension = 'all' AND org_id = ? AND hour >= ?
+                ORDER BY hour
+            """), (tenant, start))
+        else:
+            cursor.execute(self._sql("""
+                SELECT bucket, query_count, success_count, total_response_time_ms, latency_sketch
+                FROM trend_rollups
+                WHERE resolution = ? AND org_id = ? AND bucket >= ?
+                ORDER BY bucket
+            """), (resolution, tenant, start))
+        rows = cursor.fetchall()
         conn.close()
-        
+
+        points: Dict[str, Dict[str, Any]] = {}
+        for bucket, query_count, success_count, total_response_time_ms, blob in rows:
+            label = self._trend_bucket(to_seconds(bucket), width)
+            point = points.setdefault(label, {"count": 0, "success": 0, "total_ms": 0, "sketch": LatencySketch()})
+            point["count"] += query_count
+            point["success"] += success_count
+            point["total_ms"] += total_response_time_ms
+            point["sketch"].merge(LatencySketch.from_bytes(bytes(blob) if blob else None))
+
+        trends = []
+        for label in sorted(points):
+            point = points[label]
+            percentiles = point["sketch"].percentiles(*LATENCY_QUANTILES)
+            trends.append({
+                "time": label,
+                "queryVolume": point["count"],
+                "avg_response_time_ms": round(point["total_ms"] / point["count"], 2),
+                "p50_response_time_ms": percentiles["p50"],
+                "p90_response_time_ms": percentiles["p90"],
+                "p99_response_time_ms": percentiles["p99"],
+                "success_rate": round(point["success"] * 100.0 / point["count"], 2)
+            })
+        return trends
+
+    def get_hourly_trends(self, hours: int = 24, org_id: str = DEFAULT_ORG_ID, granularity: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Get query trends, hourly by default
+
+        Args:
+            granularity: Bucket width such as "1m", "5m", "15m", "1h", "1d" or "auto";
+                served from pre-aggregated trend tiers instead of raw rows
+        """
+        if granularity is not None:
+            return self._tiered_trends(hours, self._tenant(org_id), granularity)
+
+        cutoff_time = datetime.now() - timedelta(hours=hours)
+
         return [
             {
-                "time": row[0], # Renamed to match design.json
-                "queryVolume": row[1], # Renamed to match design.json
-                "avg_response_time_ms": round(row[2], 2),
-                "success_rate": round(row[3], 2)
+                "time": group["key"], # Renamed to match design.json
+                "queryVolume": group["count"], # Renamed to match design.json
+                "avg_response_time_ms": round(group["avg_response_time"], 2),
+                "p50_response_time_ms": group["percentiles"]["p50"],
+                "p90_response_time_ms": group["percentiles"]["p90"],
+                "p99_response_time_ms": group["percentiles"]["p99"],
+                "success_rate": round(group["success_rate"], 2)
             }
-            for row in results
+            for group in self._group_stats(cutoff_time, self._tenant(org_id), "hour")
         ]
-    
-    def get_agent_performance(self, hours: int = 24) -> List[Dict[str, Any]]:
+
+    def get_agent_performance(self, hours: int = 24, org_id: str = DEFAULT_ORG_ID) -> List[Dict[str, Any]]:
         """Get performance metrics per agent"""
-        conn = sqlite3.connect(DB_PATH)
+        cutoff_time = datetime.now() - timedelta(hours=hours)
+
+        return [
+            {
+                "name": group["key"], # Renamed to match design.json
+                "queryCount": group["count"], # Renamed
+                "avgTimeMs": round(group["avg_response_time"], 2), # Renamed
+                "p50TimeMs": group["percentiles"]["p50"],
+                "p90TimeMs": group["percentiles"]["p90"],
+                "p99TimeMs": group["percentiles"]["p99"],
+                "accuracyPercent": round(group["avg_accuracy"], 1), # Added
+                "lastActive": str(group["last_timestamp"]) # Renamed
+            }
+            for group in self._group_stats(cutoff_time, self._tenant(org_id), "agent")
+        ]
+
+    def get_source_distribution(self, hours: int = 24, org_id: str = DEFAULT_ORG_ID) -> List[Dict[str, Any]]:
+        """Get distribution of query sources (RAG vs Maps vs Other)"""
+        cutoff_time = datetime.now() - timedelta(hours=hours)
+
+        groups = self._group_stats(cutoff_time, self._tenant(org_id), "source")
+        total = sum(group["count"] for group in groups)
+        return [
+            {
+                "source": group["key"],
+                "count": group["count"],
+                "percentage": round(group["count"] * 100.0 / total, 2)
+            }
+            for group in groups
+        ]
+
+    def _lookup_texts(self, cursor, text_ids: List[int]) -> Dict[int, str]:
+        """Resolve text_dictionary ids to their display text"""
+        if not text_ids:
+            return {}
+        cursor.execute(self._sql(f"""
+            SELECT id, text FROM text_dictionary
+            WHERE id IN ({", ".join("?" for _ in text_ids)})
+        """), list(text_ids))
+        return dict(cursor.fetchall())
+
+    def get_top_queries(self, hours: int = 24, org_id: str = DEFAULT_ORG_ID, k: int = 10) -> List[Dict[str, Any]]:
+        """
+        Most frequent questions from merged hourly heavy-hitter sketches.
+        Counts are estimates that overcount by at most max_error; no raw rows are read.
+        """
+        conn = self.store.connect()
         cursor = conn.cursor()
-        
+
         cutoff_time = datetime.now() - timedelta(hours=hours)
-        
-        cursor.execute("""
-            SELECT 
-                agent_id,
-                COUNT(*) as query_count,
-                AVG(response_time_ms) as avg_response_time,
-                AVG(accuracy_score) * 100 as accuracy,
-                MAX(timestamp) as last_active
-            FROM queries
-            WHERE timestamp > ?
-            GROUP BY agent_id
-            ORDER BY query_count DESC
-        """, (cutoff_time,))
-        
-        results = cursor.fetchall()
+
+        cursor.execute(self._sql("""
+            SELECT top_queries FROM hourly_rollups
+            WHERE hour >= ? AND dimension = 'all' AND org_id = ?
+        """), (cutoff_time.strftime('%Y-%m-%d %H:00:00'), self._tenant(org_id)))
+
+        merged = SpaceSaving()
+        for (blob,) in cursor.fetchall():
+            merged.merge(SpaceSaving.from_bytes(bytes(blob) if blob else None))
+
+        top = merged.top(k)
+        texts = self._lookup_texts(cursor, [item for item, _, _ in top])
         conn.close()
-        
+
         return [
             {
-                "name": row[0], # Renamed to match design.json
-                "queryCount": row[1], # Renamed
-                "avgTimeMs": round(row[2], 2), # Renamed
-                "accuracyPercent": round(row[3] or 0, 1), # Added
-                "lastActive": row[4] # Renamed
+                "question": texts.get(item, ""),
+                "count": count,
+                "max_error": error
             }
-            for row in results
+            for item, count, error in top
         ]
-    
-    def get_source_distribution(self, hours: int = 24) -> List[Dict[str, Any]]:
-        """Get distribution of query sources (RAG vs Maps vs Other)"""
-        conn = sqlite3.connect(DB_PATH)
+
+    def get_top_questions(self, hours: int = 24, org_id: str = DEFAULT_ORG_ID, limit: int = 10) -> List[Dict[str, Any]]:
+        """Most frequent questions, grouped on dictionary ids rather than text"""
+        conn = self.store.connect()
         cursor = conn.cursor()
-        
+
         cutoff_time = datetime.now() - timedelta(hours=hours)
-        
-        cursor.execute("""
-            SELECT 
-                COALESCE(source_type, 'Unknown') as source,
+
+        cursor.execute(self._sql("""
+            SELECT
+                query_text_id,
                 COUNT(*) as count,
-                COUNT(*) * 100.0 / (SELECT COUNT(*) FROM queries WHERE timestamp > ?) as percentage
+                AVG(response_time_ms) as avg_time,
+                COUNT(CASE WHEN success = TRUE THEN 1 END) * 100.0 / COUNT(*) as success_rate
             FROM queries
-            WHERE timestamp > ?
-            GROUP BY source_type
+            WHERE timestamp > ? AND org_id = ? AND query_text_id IS NOT NULL
+            GROUP BY query_text_id
             ORDER BY count DESC
-        """, (cutoff_time, cutoff_time))
-        
+            LIMIT ?
+        """), (cutoff_time, self._tenant(org_id), limit))
         results = cursor.fetchall()
+        texts = self._lookup_texts(cursor, [row[0] for row in results])
         conn.close()
-        
+
         return [
             {
-                "source": row[0],
+                "question": texts.get(row[0], ""),
                 "count": row[1],
-                "percentage": round(row[2], 2)
+                "avg_response_time_ms": round(float(row[2]), 2),
+                "success_rate": round(float(row[3]), 2)
             }
             for row in results
         ]
 
+    def iter_queries(
+        self,
+        org_id: str = DEFAULT_ORG_ID,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        category: Optional[str] = None,
+        agent_id: Optional[str] = None,
+        source: Optional[str] = None,
+        page_size: int = EXPORT_PAGE_SIZE
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Yield pages of raw query rows (oldest first) for export.
+
+        Pages are fetched with keyset pagination on (timestamp, id), so each
+        page is an index range scan and memory stays constant for any range.
+        Only rows still in the analytics database are included (not the archive).
+        """
+        filters = ["q.org_id = ?"]
+        params: List[Any] = [self._tenant(org_id)]
+        for clause, value in (
+            ("q.timestamp >= ?", start),
+            ("q.timestamp < ?", end),
+            ("q.question_category = ?", category),
+            ("q.agent_id = ?", agent_id),
+            ("q.source_type = ?", source),
+        ):
+            if value is not None:
+                filters.append(clause)
+                params.append(value)
+
+        conn = self.store.connect()
+        cursor = conn.cursor()
+        last_key = None
+        try:
+            while True:
+                page_filters, page_params = list(filters), list(params)
+                if last_key is not None:
+                    page_filters.append("(q.timestamp > ? OR (q.timestamp = ? AND q.id > ?))")
+                    page_params += [last_key[0], last_key[0], last_key[1]]
+
+                cursor.execute(self._sql(f"""
+                    SELECT q.id, q.timestamp, q.org_id, COALESCE(q.query_text, qt.text), q.response_time_ms,
+                           q.question_category, q.source_type, q.agent_id, q.success,
+                           COALESCE(q.error_message, et.text), q.tokens_used, q.cost_estimate,
+                           q.accuracy_score, q.aht_saved_s
+                    FROM queries q
+                    LEFT JOIN text_dictionary qt ON qt.id = q.query_text_id
+                    LEFT JOIN text_dictionary et ON et.id = q.error_message_id
+                    WHERE {" AND ".join(page_filters)}
+                    ORDER BY q.timestamp, q.id
+                    LIMIT ?
+                """), (*page_params, page_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                yield [
+                    {
+                        **dict(zip(EXPORT_COLUMNS, row)),
+                        "id": str(row[0]),
+                        "timestamp": str(row[1]),
+                        "org_id": str(row[2]),
+                        "success": bool(row[8]),
+                        "cost_estimate": float(row[11] or 0.0),
+                        "accuracy_score": float(row[12]) if row[12] is not None else None,
+                    }
+                    for row in rows
+                ]
+
+                # The raw values are reused so the comparison matches the stored representation
+                last_key = (rows[-1][1], rows[-1][0])
+                if len(rows) < page_size:
+                    break
+        finally:
+            conn.close()
+
+    def get_stage_breakdown(self, hours: int = 24, org_id: str = DEFAULT_ORG_ID) -> List[Dict[str, Any]]:
+        """Get latency breakdown per pipeline stage (routing, embedding, LLM, ...)"""
+        conn = self.store.connect()
+        cursor = conn.cursor()
+
+        cutoff_time = datetime.now() - timedelta(hours=hours)
+
+        cursor.execute(self._sql(f"""
+            SELECT {", ".join(f"{stage}_ms" for stage in STAGES)}
+            FROM query_stages
+            WHERE timestamp > ? AND org_id = ?
+        """), (cutoff_time, self._tenant(org_id)))
+
+        sketches = {stage: LatencySketch() for stage in STAGES}
+        totals = {stage: 0.0 for stage in STAGES}
+        for row in cursor:
+            for stage, duration in zip(STAGES, row):
+                if duration is not None:
+                    sketches[stage].add(duration)
+                    totals[stage] += duration
+        conn.close()
+
+        grand_total = sum(totals.values())
+        breakdown = []
+        for stage in STAGES:
+            sketch = sketches[stage]
+            percentiles = sketch.percentiles(*LATENCY_QUANTILES)
+            breakdown.append({
+                "stage": stage,
+                "count": sketch.count,
+                "avg_ms": round(totals[stage] / sketch.count, 2) if sketch.count else 0.0,
+                "p50_ms": percentiles["p50"],
+                "p90_ms": percentiles["p90"],
+                "p99_ms": percentiles["p99"],
+                "time_share_percent": round(totals[stage] / grand_total * 100, 1) if grand_total else 0.0
+            })
+        return breakdown
+
 # Global instance
 _metrics_service = None
 
@@ -421,4 +1419,3 @@ def get_metrics_service() -> MetricsService:
     if _metrics_service is None:
         _metrics_service = MetricsService()
     return _metrics_service
-
@@ -0,0 +1,174 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Live Metrics Streaming
+In-process fan-out of metric deltas from the metrics writer to subscribed dashboards.
+"""
+import asyncio
+import threading
+from typing import Dict, List, Any, Optional
+from .telemetry import METRICS_QUEUE_DEPTH
+
+# Upper bounds (ms) of the latency buckets sent to dashboards
+LATENCY_BUCKETS_MS = [500, 1000, 2000, 5000, 10000]
+
+# Events buffered per subscriber before the oldest are dropped (slow viewers)
+SUBSCRIBER_QUEUE_SIZE = 1024
+
+
+def latency_bucket(response_time_ms: int) -> str:
+    """Map a response time onto its dashboard latency bucket label"""
+    for upper in LATENCY_BUCKETS_MS:
+        if response_time_ms <= upper:
+            return f"<={upper}"
+    return f">{LATENCY_BUCKETS_MS[-1]}"
+
+
+def empty_delta() -> Dict[str, Any]:
+    """Create an empty incremental delta"""
+    return {
+        "query_count": 0,
+        "success_count": 0,
+        "total_response_time_ms": 0,
+        "tokens_used": 0,
+        "estimated_cost": 0.0,
+        "aht_saved_s": 0,
+        "latency_buckets": {},
+        "categories": {},
+        "sources": {},
+        "agents": {},
+        "hours": {},
+    }
+
+
+def merge_event(delta: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Fold a single logged query event into an incremental delta"""
+    response_time_ms = event["response_time_ms"]
+
+    delta["query_count"] += 1
+    delta["success_count"] += 1 if event["success"] else 0
+    delta["total_response_time_ms"] += response_time_ms
+    delta["tokens_used"] += event["tokens_used"]
+    delta["estimated_cost"] += event["cost_estimate"]
+    delta["aht_saved_s"] += event["aht_saved_s"]
+
+    bucket = latency_bucket(response_time_ms)
+    delta["latency_buckets"][bucket] = delta["latency_buckets"].get(bucket, 0) + 1
+
+    # Per-group counters carry enough to recompute averages client-side
+    for group, key in (
+        ("categories", event["category"]),
+        ("sources", event["source"]),
+        ("agents", event["agent_id"]),
+        ("hours", event["hour"]),
+    ):
+        stats = delta[group].setdefault(key, {"count": 0, "success_count": 0, "total_response_time_ms": 0})
+        stats["count"] += 1
+        stats["success_count"] += 1 if event["success"] else 0
+        stats["total_response_time_ms"] += response_time_ms
+
+    delta["last_timestamp"] = event["timestamp"]
+    return delta
+
+
+class _Subscription:
+    """A single dashboard connection bound to its event loop"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def offer(self, event: Dict[str, Any]):
+        """Enqueue an event, dropping the oldest one if the viewer is lagging"""
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(event)
+
+
+class MetricsBroadcaster:
+    """Fans out logged query events to every dashboard subscribed to a tenant"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[_Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, org_id: str) -> _Subscription:
+        """Register a subscriber for a tenant (must be called from the event loop)"""
+        subscription = _Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(org_id, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, org_id: str, subscription: _Subscription):
+        """Remove a subscriber"""
+        with self._lock:
+            subscribers = self._subscribers.get(org_id, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+            if not subscribers:
+                self._subscribers.pop(org_id, None)
+
+    def publish(self, org_id: str, event: Dict[str, Any]):
+        """
+        Publish an event to all subscribers of a tenant.
+        Safe to call from any thread; delivery happens on each subscriber's loop.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(org_id, []))
+
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # Loop already closed; the stream's cleanup will unsubscribe it
+                pass
+
+    def queued_events(self) -> int:
+        """Events waiting in subscriber queues across all tenants"""
+        with self._lock:
+            return sum(sub.queue.qsize() for subs in self._subscribers.values() for sub in subs)
+
+    def subscriber_count(self, org_id: Optional[str] = None) -> int:
+        """Number of connected dashboards (for one tenant or overall)"""
+        with self._lock:
+            if org_id is not None:
+                return len(self._subscribers.get(org_id, []))
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+async def next_delta(subscription: _Subscription, flush_interval: float, timeout: float) -> Optional[Dict[str, Any]]:
+    """
+    Wait for the next batch of events and fold them into a single delta.
+    Events arriving within flush_interval of the first one are coalesced.
+
+    Returns:
+        The merged delta, or None if nothing arrived before the timeout
+    """
+    try:
+        event = await asyncio.wait_for(subscription.queue.get(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return None
+
+    delta = merge_event(empty_delta(), event)
+    await asyncio.sleep(flush_interval)
+    while not subscription.queue.empty():
+        merge_event(delta, subscription.queue.get_nowait())
+
+    delta["estimated_cost"] = round(delta["estimated_cost"], 6)
+    return delta
+
+
+# Global instance
+_metrics_broadcaster = None
+
+def get_metrics_broadcaster() -> MetricsBroadcaster:
+    """Get or create the global metrics broadcaster instance"""
+    global _metrics_broadcaster
+    if _metrics_broadcaster is None:
+        _metrics_broadcaster = MetricsBroadcaster()
+        METRICS_QUEUE_DEPTH.set_function(_metrics_broadcaster.queued_events, queue="live_stream")
+    return _metrics_broadcaster
@@ -3,27 +3,34 @@ Copyright (c) 2025 Sheers Software Sdn. Bhd.
 All Rights Reserved.
 """
 import os
+import threading
+from typing import Optional
 
-from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
+from .analytics_store import get_analytics_store
+from .answer_cache import get_answer_cache
+from .embedding_cache import cached_embeddings
+from .index_versions import get_index_manager
+from .ingestion import SHARED_ORG_ID
 from .location import search_nearby_places, format_nearby_results, get_place_type
+from .tracing import span
+from .telemetry import ERRORS
 
-# Only import GCS utilities in cloud environment
-try:
-    from .gcs_utils import download_vector_db_from_gcs
-    GCS_AVAILABLE = True
-except ImportError:
-    GCS_AVAILABLE = False
-    print("GCS utilities not available (running in local mode)")
+# Passages per answer: Q/A chunks hold a whole answer each (see kb_splitter, benchmark_chunking.py)
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "2"))
 
-CHROMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "chroma_db_v2")
+# Global instance, shared by all requests
+_embedding_function = None
+_embedding_lock = threading.Lock()
 
-# Download vector DB from GCS if in cloud environment
-# (GCS credentials are automatically available in Cloud Run)
-if GCS_AVAILABLE and (os.getenv("GOOGLE_CLOUD_PROJECT") or os.getenv("K_SERVICE")):
-    print("Cloud environment detected. Attempting to download vector DB from GCS...")
-    download_vector_db_from_gcs()
+def get_embedding_function():
+    """Get or create the query embedding client; repeated questions are answered from the embedding cache"""
+    global _embedding_function
+    with _embedding_lock:
+        if _embedding_function is None:
+            _embedding_function = cached_embeddings(OpenAIEmbeddings(model="text-embedding-3-small"))
+    return _embedding_function
 
 
 PROMPT_TEMPLATE = """
@@ -168,62 +175,112 @@ def is_resort_facility(query_text: str) -> bool:
     
     return False
 
-def query_rag(query_text: str):
+def tenant_filter(org_id: Optional[str]) -> dict:
+    """
+    Chroma metadata filter for the chunks a tenant may be answered from:
+    the shared knowledge base and the tenant's own uploads (only the shared
+    knowledge base without a tenant).
+    """
+    if org_id is None:
+        return {"org_id": SHARED_ORG_ID}
+    try:
+        # Uploads are tagged with the same key (see IngestionJobQueue.submit)
+        tenant = get_analytics_store().tenant_key(org_id)
+    except ValueError:
+        # Unknown organization: it has no uploads
+        return {"org_id": SHARED_ORG_ID}
+    return {"org_id": {"$in": [str(tenant), SHARED_ORG_ID]}}
+
+def query_rag(query_text: str, org_id: Optional[str] = None):
     """
     Query the RAG system and return the answer and sources.
     If the query is about nearby locations, use Google Maps API instead.
+    Only the shared knowledge base and org_id's own uploads are searched
+    (org_id comes from the caller's verified token; None for anonymous callers).
+    While the index is loading, recent answers to the same question are served
+    from the answer cache.
+
+    Fallback messages (knowledge base loading or unavailable, RAG errors) carry
+    an "error" key, so they are not counted or scored as answers.
     """
     # Check if this is a location-based query
-    if detect_location_query(query_text):
-        # IMPORTANT: Check if it's asking about a resort facility first
-        if is_resort_facility(query_text):
-            # This is about an on-property facility - use RAG, not Maps
-            pass  # Fall through to RAG query below
-        else:
-            # This is about an external amenity - check if we can find it on Maps
-            place_type = get_place_type(query_text)
-            
-            if place_type:
-                # Use Google Maps to find nearby places
-                places = search_nearby_places(place_type, radius=10000, max_results=5)
-                answer = format_nearby_results(places, place_type)
-                
-                return {
-                    "answer": answer,
-                    "sources": ["Google Maps Places API"]
-                }
+    with span("routing"):
+        place_type = None
+        if detect_location_query(query_text):
+            # IMPORTANT: Check if it's asking about a resort facility first
+            if not is_resort_facility(query_text):
+                # This is about an external amenity - check if we can find it on Maps
+                # (on-property facilities fall through to the RAG query below)
+                place_type = get_place_type(query_text)
+    
+    if place_type:
+        # Use Google Maps to find nearby places
+        places = search_nearby_places(place_type, radius=10000, max_results=5)
+        answer = format_nearby_results(places, place_type)
+        
+        # No "context": the answer is rendered directly from the Places results,
+        # so there is nothing to score its groundedness against
+        return {
+            "answer": answer,
+            "sources": ["Google Maps Places API"]
+        }
     
     # Fallback to standard RAG for non-location queries or resort facility queries
     try:
-        embedding_function = OpenAIEmbeddings(model="text-embedding-3-small")
-        
-        if not os.path.exists(CHROMA_PATH):
+        # Live index version; a request keeps the one it started with across a hot swap
+        index_manager = get_index_manager()
+        db = index_manager.get()
+        answer_cache = get_answer_cache()
+        if db is None and index_manager.loading:
+            # Cold start: location questions are still answered from Maps above,
+            # and questions answered recently (here or, with Redis, elsewhere) from the cache
+            cached = answer_cache.get(org_id, query_text) if answer_cache is not None else None
+            if cached is not None:
+                return cached
+            return {
+                "answer": "I'm still loading the resort knowledge base. Please ask again in a moment.",
+                "sources": ["System: Knowledge base loading"],
+                "error": "Knowledge base loading"
+            }
+        if db is None:
             return {
                 "answer": "I apologize, but I cannot access my knowledge base at the moment. The system administrator needs to rebuild the vector database.",
-                "sources": ["System Error: Vector DB missing"]
+                "sources": ["System Error: Vector DB missing"],
+                "error": "Vector DB missing"
             }
             
-        db = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding_function)
-
-        # Search the DB
-        results = db.similarity_search_with_score(query_text, k=3)
+        # Embed once, then search by vector so each stage is timed separately
+        with span("embedding"):
+            query_embedding = get_embedding_function().embed_query(query_text)
+        
+        with span("vector_search"):
+            results = db.similarity_search_by_vector_with_relevance_scores(
+                query_embedding, k=RETRIEVAL_K, filter=tenant_filter(org_id)
+            )
 
         context_text = "\n\n---\n\n".join([doc.page_content for doc, _score in results])
         prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
         prompt = prompt_template.format(context=context_text, question=query_text)
 
         model = ChatOpenAI(model="gpt-4o")
-        response_text = model.invoke(prompt)
+        with span("llm"):
+            response_text = model.invoke(prompt)
 
         sources = [doc.metadata.get("source", None) for doc, _score in results]
         
-        return {
+        result = {
             "answer": response_text.content,
-            "sources": sources
+            "sources": sources,
+            "context": [doc.page_content for doc, _score in results]
         }
+        if answer_cache is not None:
+            answer_cache.put(org_id, query_text, result)
+        return result
     except Exception as e:
         print(f"RAG Error: {str(e)}")
+        ERRORS.inc(component="rag")
         return {
             "answer": "I'm having trouble connecting to my knowledge base. Please check your API keys and network connection.",
-            "sources": [f"System Error: {str(e)}"]
+            "sources": [f"System Error: {str(e)}"],
+            "error": str(e)
         }
@@ -0,0 +1,200 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Streaming Sketches for Metrics
+Compact, mergeable summaries maintained at log time so dashboards never scan raw rows.
+"""
+import math
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Relative accuracy of latency quantiles (1% => p99 of 2000ms is within +/-20ms)
+LATENCY_RELATIVE_ACCURACY = 0.01
+
+# Values at or below this (ms) are counted in the zero bucket
+LATENCY_MIN_TRACKED = 0.01
+
+_SKETCH_VERSION = 1
+_HEADER = struct.Struct("<BII")   # version, zero_count, bucket_count
+_BUCKET = struct.Struct("<iI")    # bucket index, count
+
+# Counters kept per heavy-hitter sketch; items with frequency > N/capacity are always tracked
+HEAVY_HITTER_CAPACITY = 100
+
+_HH_VERSION = 1
+_HH_HEADER = struct.Struct("<BII")  # version, capacity, counter_count
+_HH_COUNTER = struct.Struct("<qQQ") # item, count, error
+
+
+class LatencySketch:
+    """
+    Log-bucketed quantile sketch (DDSketch / HDR-histogram style).
+
+    Values are mapped to buckets whose width grows geometrically, so every
+    quantile is answered within LATENCY_RELATIVE_ACCURACY of the true value.
+    Two sketches merge exactly by adding bucket counts, which lets hourly
+    sketches be combined into any window without touching raw rows.
+    """
+
+    _gamma = (1 + LATENCY_RELATIVE_ACCURACY) / (1 - LATENCY_RELATIVE_ACCURACY)
+    _log_gamma = math.log(_gamma)
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float, count: int = 1):
+        """Record a value (e.g. a response time in ms)"""
+        if value <= LATENCY_MIN_TRACKED:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+
+    def merge(self, other: "LatencySketch") -> "LatencySketch":
+        """Merge another sketch into this one (in place)"""
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the q-quantile (0 <= q <= 1); None if the sketch is empty"""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket keeps the error symmetric
+                return 2 * self._gamma ** index / (self._gamma + 1)
+
+        return 2 * self._gamma ** max(self.buckets) / (self._gamma + 1)
+
+    def percentiles(self, *quantiles: float) -> Dict[str, float]:
+        """Convenience accessor returning {"p50": ..., "p90": ...} rounded to 2dp"""
+        result = {}
+        for q in quantiles:
+            value = self.quantile(q)
+            result[f"p{round(q * 100)}"] = round(value, 2) if value is not None else 0.0
+        return result
+
+    def to_bytes(self) -> bytes:
+        """Serialize to a compact binary blob for persistence"""
+        parts = [_HEADER.pack(_SKETCH_VERSION, self.zero_count, len(self.buckets))]
+        parts.extend(_BUCKET.pack(index, count) for index, count in sorted(self.buckets.items()))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "LatencySketch":
+        """Deserialize a blob produced by to_bytes (None yields an empty sketch)"""
+        sketch = cls()
+        if not data:
+            return sketch
+
+        version, sketch.zero_count, bucket_count = _HEADER.unpack_from(data, 0)
+        if version != _SKETCH_VERSION:
+            raise ValueError(f"Unsupported latency sketch version: {version}")
+
+        offset = _HEADER.size
+        for _ in range(bucket_count):
+            index, count = _BUCKET.unpack_from(data, offset)
+            sketch.buckets[index] = count
+            offset += _BUCKET.size
+
+        sketch.count = sketch.zero_count + sum(sketch.buckets.values())
+        return sketch
+
+    @classmethod
+    def merged(cls, blobs: Iterable[Optional[bytes]]) -> "LatencySketch":
+        """Merge a sequence of serialized sketches"""
+        sketch = cls()
+        for blob in blobs:
+            sketch.merge(cls.from_bytes(blob))
+        return sketch
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitter sketch over integer items (e.g. text ids).
+
+    Keeps at most `capacity` counters; an unseen item replaces the smallest
+    counter and inherits its count as error, so every estimate overcounts by
+    at most `error`. Sketches merge (Agarwal et al.'s mergeable summaries),
+    which lets hourly sketches be combined into any window.
+    """
+
+    def __init__(self, capacity: int = HEAVY_HITTER_CAPACITY):
+        self.capacity = capacity
+        self.counters: Dict[int, List[int]] = {}  # item -> [count, error]
+
+    def add(self, item: int, count: int = 1):
+        """Record occurrences of an item"""
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+        else:
+            evicted = min(self.counters, key=lambda key: self.counters[key][0])
+            floor = self.counters.pop(evicted)[0]
+            self.counters[item] = [floor + count, floor]
+
+    def _floor(self) -> int:
+        """Largest count an untracked item could have"""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(counter[0] for counter in self.counters.values())
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """Merge another sketch into this one (in place)"""
+        own_floor, other_floor = self._floor(), other._floor()
+        merged: Dict[int, List[int]] = {}
+        for item in set(self.counters) | set(other.counters):
+            count, error = self.counters.get(item, [own_floor, own_floor])
+            other_count, other_error = other.counters.get(item, [other_floor, other_floor])
+            merged[item] = [count + other_count, error + other_error]
+
+        if len(merged) > self.capacity:
+            kept = sorted(merged.items(), key=lambda entry: entry[1][0], reverse=True)[:self.capacity]
+            merged = dict(kept)
+        self.counters = merged
+        return self
+
+    def top(self, k: int) -> List[Tuple[int, int, int]]:
+        """The k most frequent items as (item, estimated_count, max_overcount)"""
+        ranked = sorted(self.counters.items(), key=lambda entry: entry[1][0], reverse=True)[:k]
+        return [(item, counter[0], counter[1]) for item, counter in ranked]
+
+    def to_bytes(self) -> bytes:
+        """Serialize to a compact binary blob for persistence"""
+        parts = [_HH_HEADER.pack(_HH_VERSION, self.capacity, len(self.counters))]
+        parts.extend(_HH_COUNTER.pack(item, count, error) for item, (count, error) in self.counters.items())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "SpaceSaving":
+        """Deserialize a blob produced by to_bytes (None yields an empty sketch)"""
+        if not data:
+            return cls()
+
+        version, capacity, counter_count = _HH_HEADER.unpack_from(data, 0)
+        if version != _HH_VERSION:
+            raise ValueError(f"Unsupported heavy-hitter sketch version: {version}")
+
+        sketch = cls(capacity)
+        offset = _HH_HEADER.size
+        for _ in range(counter_count):
+            item, count, error = _HH_COUNTER.unpack_from(data, offset)
+            sketch.counters[item] = [count, error]
+            offset += _HH_COUNTER.size
+        return sketch
@@ -0,0 +1,236 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Operational Telemetry
+In-process counters, gauges and histograms exposed at /metrics in the
+OpenMetrics text format for scrape-based monitoring (Prometheus et al.).
+
+Recording is lock-free: every thread increments its own shard and shards
+are only summed when the endpoint is scraped. Values are per process, so
+each uvicorn worker is scraped (or relabelled) as its own target.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+METRIC_PREFIX = "resort_genius_"
+
+# Latency buckets (seconds) sized for LLM/API calls rather than in-process work
+DEFAULT_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class holding one value shard per recording thread"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "values", None)
+        if shard is None:
+            # Taken once per thread, never on the steady-state hot path
+            shard = self._local.values = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _snapshot(self) -> List[dict]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        # dict.copy() is atomic under the GIL, so writers never block scrapes
+        return [shard.copy() for shard in shards]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        shard = self._shard()
+        key = self._label_values(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def values(self) -> Dict[Tuple, float]:
+        totals: Dict[Tuple, float] = {}
+        for shard in self._snapshot():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self.values().items())
+        ]
+
+
+class Gauge(_Metric):
+    """Point-in-time value, read from a callback at scrape time"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._callbacks: List[Tuple[Tuple, Callable[[], float]]] = []
+
+    def set_function(self, callback: Callable[[], float], **labels):
+        """Register a callback evaluated on every scrape"""
+        self._callbacks.append((self._label_values(labels), callback))
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, callback in self._callbacks:
+            try:
+                value = callback()
+            except Exception:
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        shard = self._shard()
+        key = self._label_values(labels)
+        state = shard.get(key)
+        if state is None:
+            # [per-bucket counts..., sum]
+            state = shard[key] = [0] * len(self.buckets) + [0.0]
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                state[i] += 1
+                break
+        state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        merged: Dict[Tuple, list] = {}
+        for shard in self._snapshot():
+            for key, state in shard.items():
+                total = merged.setdefault(key, [0] * len(state))
+                for i, value in enumerate(list(state)):
+                    total[i] += value
+
+        lines = []
+        for key, state in sorted(merged.items()):
+            cumulative = 0
+            for upper, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{_format_value(upper)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-1])}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Render all metrics in the OpenMetrics text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CHAT_REQUESTS = REGISTRY.register(Counter(
+    "chat_requests", "Chat requests served, by outcome.", ("status",)))
+CHAT_LATENCY = REGISTRY.register(Histogram(
+    "chat_request_duration_seconds", "End-to-end chat request latency.", ("route",)))
+CHAT_ROUTES = REGISTRY.register(Counter(
+    "chat_routes", "Chat requests by answering route (rag or maps).", ("route",)))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "cache_requests", "Cache lookups, by cache and result (hit or miss).", ("cache", "result")))
+UPSTREAM_LATENCY = REGISTRY.register(Histogram(
+    "upstream_request_duration_seconds", "Latency of calls to external services.", ("service", "operation")))
+ERRORS = REGISTRY.register(Counter(
+    "errors", "Errors caught and handled, by component.", ("component",)))
+METRICS_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "metrics_queue_depth", "Metric events buffered in-process and not yet delivered.", ("queue",)))
+
+# Trace stages that are calls to external services: stage -> (service, operation)
+UPSTREAM_STAGES = {
+    "embedding": ("openai", "embedding"),
+    "llm": ("openai", "chat_completion"),
+    "places": ("places", "nearby_search"),
+}
+
+
+def observe_stage(stage: str, duration_s: float):
+    """Feed a timed trace stage into the upstream latency histogram"""
+    upstream = UPSTREAM_STAGES.get(stage)
+    if upstream is not None:
+        UPSTREAM_LATENCY.observe(duration_s, service=upstream[0], operation=upstream[1])
+
+
+def render_metrics() -> str:
+    """Render the process-wide registry"""
+    return REGISTRY.render()
@@ -0,0 +1,31 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Text Extraction
+Page-level text extraction for knowledge base files, run in the ingestion
+process pool. Kept free of LangChain and Chroma imports so worker processes
+start quickly.
+"""
+from typing import List, Optional, Tuple
+from pypdf import PdfReader
+
+
+def extract_pages(file_path: str, start: int, stop: int) -> List[Tuple[Optional[int], str]]:
+    """
+    Extract text from pages [start, stop) of a PDF, or the whole of a text
+    file (page None).
+    """
+    if not file_path.endswith(".pdf"):
+        with open(file_path, "r", encoding="utf-8") as f:
+            return [(None, f.read())]
+    reader = PdfReader(file_path)
+    # Same extraction as PyPDFLoader, so chunk ids match collections it built
+    return [(number, reader.pages[number].extract_text(extraction_mode="plain").strip())
+            for number in range(start, min(stop, len(reader.pages)))]
+
+
+def extract_task(task: Tuple[str, str, int, int]) -> Tuple[str, List[Tuple[Optional[int], str]]]:
+    """Process pool entry point: (source, path, start, stop) -> (source, pages)"""
+    source, file_path, start, stop = task
+    return source, extract_pages(file_path, start, stop)
@@ -0,0 +1,74 @@
+"""
+Copyright (c) 2025 Sheers Software Sdn. Bhd.
+All Rights Reserved.
+
+Lightweight Request Tracing
+Records per-stage durations (routing, embedding, vector search, LLM, Places,
+metrics write) for the chat request currently being served.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from .telemetry import observe_stage
+
+# Stages persisted per request, in pipeline order
+STAGES = ("routing", "embedding", "vector_search", "llm", "places", "metrics_write")
+
+
+class RequestTrace:
+    """Accumulated stage durations (ms) for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def record(self, stage: str, duration_ms: float):
+        """Add a duration to a stage (a stage may run more than once)"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + duration_ms
+
+    def elapsed_ms(self) -> float:
+        """Wall-clock time since the trace started"""
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """Render the stages as a Server-Timing header value"""
+        metrics = [f"{stage};dur={self.stages[stage]:.1f}" for stage in STAGES if stage in self.stages]
+        metrics.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(metrics)
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """The trace of the request being served, if any"""
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_request():
+    """Start a trace for the current request context"""
+    trace = RequestTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Time a block and add it to the current trace.
+    Stages that call external services also feed the upstream latency histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_s = time.perf_counter() - start
+        observe_stage(stage, duration_s)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.record(stage, duration_s * 1000)
@@ -0,0 +1,142 @@
+"""
+Script to compare the Q/A chunker with the character splitter on the knowledge base.
+
+Every **Q:** block in the knowledge base is used as a query (its question,
+without markup). For each splitter and k, reports the context tokens sent to
+the LLM and answer recall: the share of the gold answer's lines found in the
+retrieved chunks, and the share of questions whose whole answer was retrieved.
+Index size is reported as chunk count and total chunk tokens.
+
+Retrieval uses TF-IDF vectors by default so the benchmark runs offline;
+--embeddings openai uses the production embedding model (and the embedding cache).
+
+Usage:
+    python benchmark_chunking.py
+    python benchmark_chunking.py --embeddings openai --k 1 2 3
+"""
+import argparse
+import math
+import os
+import re
+import sys
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.services.embedding_pipeline import count_tokens
+from app.services.ingestion import CHUNK_OVERLAP, CHUNK_SIZE, EMBEDDING_MODEL
+from app.services.kb_splitter import QASplitter
+
+KB_PATH = os.path.join(os.path.dirname(__file__), "data", "comprehensive_knowledge.txt")
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class TfidfIndex:
+    """Offline stand-in for embeddings: L2-normalized TF-IDF over lowercase words"""
+
+    def __init__(self, chunks: List[str]):
+        documents = [Counter(_WORD_PATTERN.findall(chunk.lower())) for chunk in chunks]
+        frequency = Counter(word for document in documents for word in document)
+        self.vocabulary = {word: i for i, word in enumerate(frequency)}
+        self.idf = np.array([math.log((1 + len(chunks)) / (1 + frequency[word])) + 1 for word in frequency])
+        self.matrix = np.vstack([self._vector(document) for document in documents])
+
+    def _vector(self, counts: Counter) -> np.ndarray:
+        vector = np.zeros(len(self.vocabulary))
+        for word, count in counts.items():
+            if word in self.vocabulary:
+                vector[self.vocabulary[word]] = count
+        vector *= self.idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def search(self, query: str, k: int) -> List[int]:
+        scores = self.matrix @ self._vector(Counter(_WORD_PATTERN.findall(query.lower())))
+        return np.argsort(-scores, kind="stable")[:k].tolist()
+
+
+class EmbeddingIndex:
+    """Cosine search over OpenAI embeddings"""
+
+    def __init__(self, chunks: List[str]):
+        from langchain_openai import OpenAIEmbeddings
+        from app.services.embedding_cache import cached_embeddings
+        self.embeddings = cached_embeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL))
+        self.matrix = self._normalize(np.array(self.embeddings.embed_documents(chunks)))
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)
+
+    def search(self, query: str, k: int) -> List[int]:
+        scores = self.matrix @ self._normalize(np.array(self.embeddings.embed_query(query)))
+        return np.argsort(-scores, kind="stable")[:k].tolist()
+
+
+def gold_answers(text: str) -> List[Dict]:
+    """Questions and the lines of their answers, from the Q/A structure"""
+    answers: Dict[str, List[str]] = {}
+    for chunk, metadata in QASplitter(max_chars=10 ** 9).split_text_with_metadata(text):
+        if "question" in metadata:
+            lines = [line.strip() for line in chunk.splitlines()[1:] if line.strip()]
+            answers.setdefault(metadata["question"], lines)
+    return [{"question": question, "lines": lines} for question, lines in answers.items() if lines]
+
+
+def evaluate(name: str, chunks: List[str], index, gold: List[Dict], ks: List[int]) -> List[Dict]:
+    results = []
+    for k in ks:
+        context_tokens = line_recall = complete = 0.0
+        for item in gold:
+            retrieved = [chunks[i] for i in index.search(item["question"], k)]
+            context_tokens += count_tokens("\n\n---\n\n".join(retrieved))
+            found = sum(any(line in chunk for chunk in retrieved) for line in item["lines"])
+            line_recall += found / len(item["lines"])
+            complete += found == len(item["lines"])
+        results.append({
+            "splitter": name,
+            "k": k,
+            "context_tokens": context_tokens / len(gold),
+            "line_recall": line_recall / len(gold),
+            "complete": complete / len(gold),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark knowledge base chunking")
+    parser.add_argument("--kb", default=KB_PATH)
+    parser.add_argument("--embeddings", choices=["tfidf", "openai"], default="tfidf")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 3])
+    args = parser.parse_args()
+
+    with open(args.kb, "r", encoding="utf-8") as f:
+        text = f.read()
+    gold = gold_answers(text)
+    splitters = {
+        f"recursive ({CHUNK_SIZE}/{CHUNK_OVERLAP})": RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP).split_text(text),
+        "qa": [chunk for chunk, _ in QASplitter().split_text_with_metadata(text)],
+    }
+
+    print("=" * 80)
+    print(f"CHUNKING BENCHMARK: {len(gold)} questions, {args.embeddings} retrieval")
+    print("=" * 80)
+
+    print(f"\n{'splitter':<24}{'chunks':>8}{'tokens':>10}")
+    for name, chunks in splitters.items():
+        print(f"{name:<24}{len(chunks):>8}{sum(count_tokens(chunk) for chunk in chunks):>10}")
+
+    print(f"\n{'splitter':<24}{'k':>3}{'context tokens':>16}{'line recall':>13}{'complete':>10}")
+    for name, chunks in splitters.items():
+        index = EmbeddingIndex(chunks) if args.embeddings == "openai" else TfidfIndex(chunks)
+        for row in evaluate(name, chunks, index, gold, args.k):
+            print(f"{row['splitter']:<24}{row['k']:>3}{row['context_tokens']:>16.0f}"
+                  f"{row['line_recall']:>13.1%}{row['complete']:>10.1%}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Script to generate large synthetic analytics fixtures for dashboard benchmarks.
+
+Writes realistic `queries` rows across many tenants and agents (diurnal and
+weekly traffic shape, skewed categories, tenants and agents) into the
+configured analytics store (ANALYTICS_BACKEND=sqlite|postgres), then rebuilds
+rollups for the generated range. Rows are generated with NumPy in chunks and
+inserted with bulk executes inside a single transaction; the same --seed
+always produces the same fixture.
+
+Usage:
+    python generate_synthetic_analytics.py --rows 2000000 --tenants 50 --days 30
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+
+# A one-off load has no use for the dashboard's in-memory window
+os.environ.setdefault("ENABLE_METRICS_BUFFER", "false")
+
+from app.services.analytics_store import get_analytics_store
+from app.services.metrics_service import get_metrics_service
+
+# Category mix (matches detect_question_category in the chat API)
+CATEGORIES = {
+    "Dining": 0.24,
+    "Activities": 0.16,
+    "Room Service": 0.13,
+    "Location & Transport": 0.12,
+    "Facilities": 0.09,
+    "Kids & Family": 0.08,
+    "Spa & Wellness": 0.07,
+    "Concierge": 0.06,
+    "General": 0.05,
+}
+
+QUESTIONS = {
+    "Dining": ["What time is breakfast served?", "Is Mutiara restaurant open for dinner?",
+               "Do you have vegetarian options at the buffet?", "Where is the Rembulan bar?",
+               "Can I book a table at Enak for tonight?"],
+    "Activities": ["What time does the flying trapeze start?", "Is archery included?",
+                   "Can I rent a kayak today?", "Are there tennis lessons for beginners?",
+                   "What is on the activity schedule tomorrow?"],
+    "Room Service": ["Can I get extra towels?", "How do I request laundry service?",
+                     "The AC in my room is not working", "Is the minibar included?",
+                     "How do I connect to the wifi in my room?"],
+    "Location & Transport": ["Where is the nearest pharmacy?", "How do I get a taxi to Kuantan?",
+                             "Is there an ATM nearby?", "What time is the airport shuttle?",
+                             "Where is the closest hospital?"],
+    "Facilities": ["What are the pool opening hours?", "Where is the gym?",
+                   "Is there parking at the resort?", "When does the boutique open?"],
+    "Kids & Family": ["What age is the mini club for?", "Are there baby cots available?",
+                      "What activities are there for children?", "Is the playground supervised?"],
+    "Spa & Wellness": ["How do I book a massage?", "What treatments does the spa offer?",
+                       "Is there a yoga class in the morning?"],
+    "Concierge": ["Can you recommend a day trip?", "Can you arrange a birthday surprise?",
+                  "I need help with my reservation"],
+    "General": ["What is the checkout time?", "Is there a dress code in the evening?",
+                "What is included in the all-inclusive package?"],
+}
+
+ERROR_MESSAGES = ["LLM request timed out", "Vector DB unavailable", "Rate limit exceeded", "Places API error"]
+
+
+def diurnal_weights() -> np.ndarray:
+    """Relative traffic per hour of day: morning and evening peaks, quiet nights"""
+    hours = np.arange(24)
+    weights = 0.15 + np.exp(-((hours - 10) ** 2) / 8) + 0.8 * np.exp(-((hours - 20) ** 2) / 6)
+    return weights / weights.sum()
+
+
+def zipf_weights(n: int, exponent: float) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_chunk(rng: np.random.Generator, n: int, start: datetime, end: datetime,
+                   tenants: list, agents_per_tenant: int, text_ids: dict) -> list:
+    """Generate n rows laid out for AnalyticsStore.insert_queries (start is a midnight)"""
+    # Timestamps: day (weekends busier at a resort), diurnal hour, uniform within the hour
+    days = (end - start).days + 1
+    day_weights = np.array([1.25 if (start + timedelta(days=d)).weekday() >= 5 else 1.0 for d in range(days)])
+    day = rng.choice(days, size=n, p=day_weights / day_weights.sum())
+    hour = rng.choice(24, size=n, p=diurnal_weights())
+    offset_us = (day * 86400 + hour * 3600 + rng.integers(0, 3600, size=n)) * 1_000_000 + rng.integers(0, 1_000_000, size=n)
+    # Later today has not happened yet: wrap those events back by whole days
+    future = offset_us >= int((end - start).total_seconds() * 1_000_000)
+    offset_us[future] -= (days - 1) * 86400 * 1_000_000
+    # Sorted so each chunk appends in index order
+    timestamps = (np.datetime64(start, "us") + np.sort(offset_us).astype("timedelta64[us]")).astype(datetime).tolist()
+
+    tenant = rng.choice(len(tenants), size=n, p=zipf_weights(len(tenants), 0.8))
+    agent = rng.choice(agents_per_tenant, size=n, p=zipf_weights(agents_per_tenant, 1.1))
+
+    category_names = list(CATEGORIES)
+    category = rng.choice(len(category_names), size=n, p=np.array(list(CATEGORIES.values())) / sum(CATEGORIES.values()))
+    is_location = category == category_names.index("Location & Transport")
+    maps = rng.random(n) < np.where(is_location, 0.8, 0.03)
+
+    success = rng.random(n) < 0.97
+    # Maps answers skip the LLM; RAG latency has a long tail
+    response_time = np.where(maps, rng.lognormal(np.log(900), 0.35, n), rng.lognormal(np.log(2200), 0.45, n))
+    response_time = np.clip(response_time, 150, 30000).astype(np.int64)
+    tokens = np.where(success & ~maps, rng.normal(420, 120, n).clip(80, 1500), 0).astype(np.int64)
+    cost = tokens / 1000 * 0.03
+    accuracy = np.where(success, rng.beta(9, 1.5, n).round(4), 0.0)
+    aht_saved = np.where(success, np.maximum(0, 300 - response_time / 1000), 0).astype(np.int64)
+    question = rng.integers(0, 1 << 30, size=n)
+    error = rng.integers(0, len(ERROR_MESSAGES), size=n)
+
+    question_ids = [[text_ids[question] for question in QUESTIONS[name]] for name in category_names]
+    error_ids = [text_ids[message] for message in ERROR_MESSAGES]
+    return [
+        {
+            "timestamp": timestamp,
+            "query_text_id": question_ids[c][q % len(question_ids[c])],
+            "response_time_ms": rt,
+            "question_category": category_names[c],
+            "source_type": "Maps" if m else "RAG",
+            "agent_id": f"{tenants[t][0]}-agent-{a:03d}",
+            "success": ok,
+            "error_message_id": None if ok else error_ids[e],
+            "tokens_used": tk,
+            "cost_estimate": co,
+            "accuracy_score": ac,
+            "aht_saved_s": ah,
+            "org_id": tenants[t][1],
+        }
+        for timestamp, c, q, rt, m, t, a, ok, e, tk, co, ac, ah in zip(
+            timestamps, category.tolist(), question.tolist(), response_time.tolist(), maps.tolist(),
+            tenant.tolist(), agent.tolist(), success.tolist(), error.tolist(), tokens.tolist(),
+            cost.tolist(), accuracy.tolist(), aht_saved.tolist(),
+        )
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic analytics fixtures")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--tenants", type=int, default=20)
+    parser.add_argument("--agents-per-tenant", type=int, default=15)
+    parser.add_argument("--days", type=int, default=30, help="History length ending now")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--replace", action="store_true", help="Delete existing rows of the synthetic tenants first")
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print(f"GENERATING {args.rows:,} SYNTHETIC QUERIES")
+    print("=" * 80)
+
+    # Creating the service first runs any pending schema migrations
+    service = get_metrics_service()
+    store = get_analytics_store()
+    sql = store.sql
+    rng = np.random.default_rng(args.seed)
+
+    tenants = [(f"synthetic-{i:03d}", store.tenant_key(f"synthetic-{i:03d}", create=True)) for i in range(args.tenants)]
+    end = datetime.now()
+    start = (end - timedelta(days=args.days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    conn = store.connect()
+    cursor = conn.cursor()
+
+    texts = [question for questions in QUESTIONS.values() for question in questions] + ERROR_MESSAGES
+    text_ids = dict(zip(texts, store.intern_texts(cursor, texts)))
+    conn.commit()
+
+    if args.replace:
+        print("\n1. Removing previous synthetic rows...")
+        # Dependent rows and rollups first; synthetic tenants have no archive worth keeping
+        for table in ("query_stages", "query_evaluations", "hourly_rollups", "trend_rollups", "queries"):
+            cursor.executemany(sql(f"DELETE FROM {table} WHERE org_id = ?"), [(tenant,) for _slug, tenant in tenants])
+
+    print(f"\n2. Inserting rows in chunks of {args.chunk_size:,} (one transaction)...")
+    started = time.time()
+    agent_counts = {}
+    written = 0
+    while written < args.rows:
+        n = min(args.chunk_size, args.rows - written)
+        rows = generate_chunk(rng, n, start, end, tenants, args.agents_per_tenant, text_ids)
+        store.insert_queries(cursor, rows, return_ids=False)
+        for row in rows:
+            agent_counts[row["agent_id"]] = agent_counts.get(row["agent_id"], 0) + 1
+        written += n
+        print(f"   {written:,} rows ({written / (time.time() - started):,.0f} rows/s)")
+
+    cursor.executemany(sql("""
+        INSERT INTO agents (agent_id, total_queries)
+        VALUES (?, ?)
+        ON CONFLICT(agent_id) DO UPDATE SET
+            last_seen = CURRENT_TIMESTAMP,
+            total_queries = agents.total_queries + excluded.total_queries
+    """), list(agent_counts.items()))
+    conn.commit()
+    conn.close()
+    print(f"   Committed in {time.time() - started:.1f}s")
+
+    print("\n3. Rebuilding rollups for the generated range...")
+    started = time.time()
+    # Only the synthetic tenants: other tenants' rollups (and archived history) are untouched
+    service.rebuild_rollups(since=start, until=end, org_ids=[tenant for _slug, tenant in tenants])
+    print(f"   Done in {time.time() - started:.1f}s")
+
+    print("\n" + "=" * 80)
+    print(f"SUCCESS! {written:,} rows across {len(tenants)} tenants (org_id=synthetic-000 ...)")
+    print("Restart the API so its in-memory metrics window is reloaded.")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,28 @@
 """
-Script to populate ChromaDB v2 with comprehensive knowledge base.
+Script to populate the vector index with comprehensive knowledge base.
+
+Builds a new index version (a copy of the live one, so only changed chunks
+are embedded), checks it, then publishes it. Running API workers pick up the
+new version without a restart.
 """
 import os
 import sys
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
 from dotenv import load_dotenv
+from app.services.embedding_cache import cached_embeddings
+from app.services.index_versions import current_index_path, new_version, publish
+from app.services.ingestion import ingest_documents, EMBEDDING_MODEL
 
 # Load environment variables
 load_dotenv()
 
 # Paths
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
-CHROMA_PATH = os.path.join(os.path.dirname(__file__), "chroma_db_v2")
-
-def load_knowledge_file(filename):
-    """Load text from a file and return as a string."""
-    filepath = os.path.join(DATA_DIR, filename)
-    if not os.path.exists(filepath):
-        print(f"Warning: {filename} not found at {filepath}")
-        return ""
-    
-    with open(filepath, "r", encoding="utf-8") as f:
-        return f.read()
 
 def main():
     print("=" * 80)
-    print("POPULATING CHROMA_DB_V2")
+    print("POPULATING VECTOR INDEX")
     print("=" * 80)
     
     # Check API key
@@ -37,70 +31,30 @@ def main():
         print("Please set your API key in backend/.env file")
         sys.exit(1)
     
-    # Load knowledge files
-    print("\n1. Loading knowledge files...")
-    comprehensive_knowledge = load_knowledge_file("comprehensive_knowledge.txt")
-    questions = load_knowledge_file("questions.txt")
-    
-    if not comprehensive_knowledge and not questions:
-        print("ERROR: No knowledge files found!")
+    # Only new or changed chunks are embedded; pass --rebuild to re-embed everything
+    rebuild = "--rebuild" in sys.argv
+    version, index_path = new_version(base=current_index_path())
+    print(f"\n1. Syncing knowledge files from {DATA_DIR} into version {version}{' (full rebuild)' if rebuild else ''}...")
+    stats = ingest_documents(DATA_DIR, index_path, rebuild=rebuild)
+    if stats is None:
+        print("ERROR: No knowledge files found! Version left unpublished.")
         sys.exit(1)
     
-    # Combine all knowledge
-    all_text = comprehensive_knowledge
-    if questions:
-        all_text += "\n\n" + questions
-    
-    print(f"   Loaded {len(all_text)} characters of knowledge")
-    
-    # Split into chunks
-    print("\n2. Splitting into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    
-    # Create documents
-    documents = [
-        Document(
-            page_content=chunk,
-            metadata={"source": "comprehensive_knowledge.txt"}
-        )
-        for chunk in text_splitter.split_text(all_text)
-    ]
-    
-    print(f"   Created {len(documents)} document chunks")
-    
-    # Clear existing database
-    print("\n3. Clearing existing database...")
-    if os.path.exists(CHROMA_PATH):
-        import shutil
-        shutil.rmtree(CHROMA_PATH)
-        print("   Old database removed")
-    
-    # Create embeddings and populate database
-    print("\n4. Creating embeddings and populating database...")
-    print("   This may take a few minutes...")
-    
-    embedding_function = OpenAIEmbeddings(model="text-embedding-3-small")
-    
-    db = Chroma.from_documents(
-        documents=documents,
-        embedding=embedding_function,
-        persist_directory=CHROMA_PATH
-    )
-    
-    print(f"   Database populated with {len(documents)} chunks")
+    db = Chroma(persist_directory=index_path, embedding_function=cached_embeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL)))
     
     # Test the database
-    print("\n5. Testing database...")
+    print("\n2. Testing database...")
     test_query = "What are the restaurant operating hours?"
     results = db.similarity_search(test_query, k=3)
     print(f"   Test query: '{test_query}'")
     print(f"   Found {len(results)} relevant results")
-    if results:
-        print(f"   Sample result: {results[0].page_content[:100]}...")
+    if not results:
+        print("ERROR: Test query returned nothing! Version left unpublished.")
+        sys.exit(1)
+    print(f"   Sample result: {results[0].page_content[:100]}...")
+    
+    print(f"\n3. Publishing version {version}...")
+    publish(version)
     
     print("\n" + "=" * 80)
     print("DATABASE POPULATION COMPLETE!")
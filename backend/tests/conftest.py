@@ -0,0 +1,113 @@
+"""
+Shared fixtures: a deterministic fake embedder and throwaway storage.
+
+Run from backend/:  python -m pytest -q tests
+"""
+import hashlib
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+
+# Settings are read at import, so they are fixed before any app module loads:
+# keep caches and indexes out of the source tree, read metrics from the store
+# rather than the process-wide ring buffer, embed one chunk per request in
+# order, and fail fast instead of backing off
+_SCRATCH = tempfile.mkdtemp(prefix="kb-tests-")
+os.environ.setdefault("EMBEDDING_CACHE_DIR", os.path.join(_SCRATCH, "embedding_cache"))
+os.environ.setdefault("VECTOR_INDEX_ROOT", os.path.join(_SCRATCH, "vector_indexes"))
+os.environ.setdefault("KB_UPLOAD_DIR", os.path.join(_SCRATCH, "kb_uploads"))
+os.environ["ANALYTICS_BACKEND"] = "sqlite"
+os.environ["ENABLE_METRICS_BUFFER"] = "false"
+os.environ["EMBEDDING_BATCH_SIZE"] = "1"
+os.environ["EMBEDDING_CONCURRENCY"] = "1"
+os.environ["EMBEDDING_MAX_RETRIES"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_DIM = 8
+
+
+def fake_vector(text: str):
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [byte / 255.0 for byte in digest[:EMBEDDING_DIM]]
+
+
+class FakeEmbeddings(Embeddings):
+    """Hash-derived vectors; records every text it embeds and can fail on a marker"""
+
+    def __init__(self):
+        self.texts = []
+        self.fail_on = None
+
+    def embed_documents(self, texts):
+        if self.fail_on and any(self.fail_on in text for text in texts):
+            raise RuntimeError("embedding service unavailable")
+        self.texts.extend(texts)
+        return [fake_vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return fake_vector(text)
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    """Route ingestion's embedding model (and skip its disk cache) to a FakeEmbeddings"""
+    from app.services import ingestion
+
+    embeddings = FakeEmbeddings()
+    monkeypatch.setattr(ingestion, "OpenAIEmbeddings", lambda **kwargs: embeddings)
+    monkeypatch.setattr(ingestion, "cached_embeddings", lambda model: model)
+    return embeddings
+
+
+@pytest.fixture
+def analytics_store(tmp_path, monkeypatch):
+    """A fresh SQLite analytics store, installed as the global one"""
+    from app.services import analytics_store as store_module
+
+    store = store_module.SQLiteAnalyticsStore(tmp_path / "analytics.db")
+    store.create_schema()
+    monkeypatch.setattr(store_module, "_analytics_store", store)
+    return store
+
+
+@pytest.fixture
+def metrics_service(analytics_store, monkeypatch):
+    """A MetricsService on the test store, installed as the global one"""
+    from app.services import metrics_service as service_module
+
+    service = service_module.MetricsService()
+    monkeypatch.setattr(service_module, "_metrics_service", service)
+    return service
+
+
+def query_event(timestamp: datetime, response_time_ms: int = 100, org_id: str = "default", **overrides):
+    """An event as MetricsService.log_query builds it, at a given time"""
+    event = {
+        "timestamp": timestamp.isoformat(),
+        "hour": timestamp.strftime("%Y-%m-%d %H:00:00"),
+        "org_id": org_id,
+        "query_text": "What time is breakfast?",
+        "question_category": "Dining",
+        "source_type": "RAG",
+        "error_message": None,
+        "response_time_ms": response_time_ms,
+        "agent_id": "agent-1",
+        "success": True,
+        "tokens_used": 200,
+        "cost_estimate": 0.006,
+        "accuracy_score": 0.9,
+        "aht_saved_s": 290,
+        "stages": None,
+        "answer": None,
+        "context": None,
+    }
+    event.update(overrides)
+    event["category"] = event["question_category"] or "Uncategorized"
+    event["source"] = event["source_type"] or "Unknown"
+    return event
@@ -0,0 +1,48 @@
+"""Retention of closed days into Parquet (app.services.analytics_archive)"""
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("pyarrow")
+pytest.importorskip("duckdb")
+
+from app.services.analytics_archive import AnalyticsArchive
+from conftest import query_event
+
+
+def count_queries(store):
+    conn = store.connect()
+    count = conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+    conn.close()
+    return count
+
+
+@pytest.fixture
+def old_and_recent(metrics_service):
+    now = datetime.now()
+    metrics_service._write_events([
+        query_event(now - timedelta(days=10), 100),
+        query_event(now - timedelta(days=10), 300),
+        query_event(now - timedelta(hours=1), 200),
+    ])
+
+
+def test_closed_days_move_to_parquet(analytics_store, old_and_recent, tmp_path):
+    archive = AnalyticsArchive(tmp_path / "archive")
+
+    assert archive.archive_closed_days() == 2
+    assert count_queries(analytics_store) == 1
+    assert len(list((tmp_path / "archive").rglob("*.parquet"))) == 1
+
+    history = archive.history(30)
+    assert history["archived_partitions"] == 1
+    assert history["totals"]["query_count"] == 3
+
+
+def test_shared_store_rows_are_not_moved_to_local_disk(analytics_store, old_and_recent, tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics_store, "name", "postgres")
+    archive = AnalyticsArchive(tmp_path / "archive")
+
+    assert archive.archive_closed_days() == 0
+    assert count_queries(analytics_store) == 3
+    assert not (tmp_path / "archive").exists()
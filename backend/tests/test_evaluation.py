@@ -0,0 +1,106 @@
+"""Background accuracy scoring and its high-water mark (app.services.evaluation)"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services import evaluation, metrics_service as service_module
+from app.services.evaluation import EVALUATION_WORKER, EvaluationWorker
+from conftest import query_event
+
+
+class FixedScorer:
+    def __init__(self, score):
+        self.score = score
+        self.batches = []
+
+    def score_batch(self, items):
+        self.batches.append(len(items))
+        return [self.score] * len(items)
+
+
+def answered(timestamp, text="Breakfast is served from 7am."):
+    return query_event(timestamp, accuracy_score=None, answer=text, context=[text])
+
+
+def table_count(store, table, where="1 = 1"):
+    conn = store.connect()
+    count = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}").fetchone()[0]
+    conn.close()
+    return count
+
+
+@pytest.fixture(autouse=True)
+def no_settle(monkeypatch):
+    monkeypatch.setattr(evaluation, "EVALUATION_SETTLE_S", 0)
+
+
+def test_worker_resumes_after_its_high_water_mark(metrics_service, analytics_store):
+    now = datetime.now()
+    metrics_service._write_events([answered(now) for _ in range(5)])
+    scorer = FixedScorer(0.8)
+    worker = EvaluationWorker(scorer=scorer, batch_size=2)
+
+    assert [worker.run_once() for _ in range(4)] == [2, 2, 1, 0]
+    assert scorer.batches == [2, 2, 1]
+    assert metrics_service.get_checkpoint(EVALUATION_WORKER) == 5
+
+    assert table_count(analytics_store, "queries", "accuracy_score = 0.8") == 5
+    assert table_count(analytics_store, "query_evaluations") == 0
+    conn = analytics_store.connect()
+    assert conn.execute(
+        "SELECT accuracy_total, accuracy_count FROM hourly_rollups WHERE dimension = 'all'"
+    ).fetchone() == (pytest.approx(4.0), 5)
+    conn.close()
+
+    # Answers logged after the mark are picked up next
+    metrics_service._write_events([answered(now)])
+    assert worker.run_once() == 1
+    assert metrics_service.get_checkpoint(EVALUATION_WORKER) == 6
+
+
+def test_a_batch_scored_elsewhere_is_not_written_twice(metrics_service, analytics_store):
+    metrics_service._write_events([answered(datetime.now()) for _ in range(3)])
+    batch = metrics_service.pending_evaluations(0, 10)
+    for item in batch:
+        item["score"] = 1.0
+
+    assert metrics_service.record_accuracy_scores(batch, EVALUATION_WORKER, 0) is True
+    # A second worker that read the same batch at the old mark
+    assert metrics_service.record_accuracy_scores(batch, EVALUATION_WORKER, 0) is False
+
+    conn = analytics_store.connect()
+    assert conn.execute("SELECT accuracy_count FROM hourly_rollups WHERE dimension = 'all'").fetchone()[0] == 3
+    conn.close()
+
+
+def test_unscored_answers_expire_from_the_queue(metrics_service, analytics_store, monkeypatch):
+    monkeypatch.setattr(service_module, "EVALUATION_QUEUE_RETENTION_HOURS", 24)
+    metrics_service._write_events([answered(datetime.now() - timedelta(hours=30)), answered(datetime.now())])
+    assert table_count(analytics_store, "query_evaluations") == 2
+
+    metrics_service._evaluation_expiry_at = 0.0
+    metrics_service._write_events([query_event(datetime.now())])
+
+    assert table_count(analytics_store, "query_evaluations") == 1
+
+
+@pytest.mark.parametrize("fallback", [
+    {"answer": "I'm still loading the resort knowledge base.", "sources": ["System: Knowledge base loading"],
+     "error": "Knowledge base loading"},
+    {"answer": "I'm having trouble connecting to my knowledge base.", "sources": ["System Error: timeout"],
+     "error": "timeout"},
+])
+def test_fallback_answers_are_failures_and_not_scored(metrics_service, analytics_store, monkeypatch, fallback):
+    pytest.importorskip("jose")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api import chat
+
+    monkeypatch.setattr(chat, "query_rag", lambda query, org_id: fallback)
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api")
+
+    assert TestClient(app).post("/api/chat", json={"query": "What time is breakfast?"}).status_code == 200
+
+    assert table_count(analytics_store, "queries", "success = 0") == 1
+    assert table_count(analytics_store, "query_evaluations") == 0
@@ -0,0 +1,70 @@
+"""Segmented metrics event log and its compaction (app.services.event_log, MetricsService.compact_event_log)"""
+import shutil
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.event_log import RECORD_HEADER, SegmentLog, read_segment
+from conftest import query_event
+
+
+@pytest.fixture
+def event_log(tmp_path, metrics_service):
+    # Rotation and fsync are driven by the test, not the background thread
+    log = SegmentLog(tmp_path / "metrics_log", max_age_s=3600, fsync_interval_s=3600)
+    metrics_service._event_log = log
+    yield log
+    log.close()
+
+
+def counts(store):
+    conn = store.connect()
+    queries = conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+    rolled_up = conn.execute("SELECT COALESCE(SUM(query_count), 0) FROM hourly_rollups WHERE dimension = 'all'").fetchone()[0]
+    conn.close()
+    return queries, rolled_up
+
+
+def log_events(event_log, count):
+    now = datetime.now()
+    for i in range(count):
+        event_log.append(query_event(now - timedelta(seconds=i), 100 + i))
+    event_log.close()
+
+
+def test_replayed_segment_is_not_counted_twice(event_log, metrics_service, analytics_store, tmp_path):
+    log_events(event_log, 7)
+    [segment] = event_log.closed_segments()
+    shutil.copy(segment, tmp_path / "copy")
+
+    assert metrics_service.compact_event_log(batch_size=3) == 7
+    assert counts(analytics_store) == (7, 7)
+    assert event_log.closed_segments() == []
+
+    # A crash after the batches committed but before the segment was deleted
+    shutil.copy(tmp_path / "copy", segment)
+    assert metrics_service.compact_event_log(batch_size=3) == 0
+    assert counts(analytics_store) == (7, 7)
+    assert event_log.closed_segments() == []
+
+
+def test_partially_loaded_segment_resumes_at_the_next_batch(event_log, metrics_service, analytics_store):
+    log_events(event_log, 7)
+    [segment] = event_log.closed_segments()
+    first_batch = [event for _, event in read_segment(segment)][:3]
+    metrics_service._write_events(first_batch, batch_key=f"{segment.name}:0")
+
+    assert metrics_service.compact_event_log(batch_size=3) == 4
+    assert counts(analytics_store) == (7, 7)
+
+
+def test_torn_tail_is_ignored(event_log, metrics_service, analytics_store):
+    log_events(event_log, 3)
+    [segment] = event_log.closed_segments()
+    with open(segment, "ab") as f:
+        # Header of a record whose payload never reached the disk
+        f.write(RECORD_HEADER.pack(100, 0) + b"{\"timest")
+
+    assert len(list(read_segment(segment))) == 3
+    assert metrics_service.compact_event_log() == 3
+    assert counts(analytics_store) == (3, 3)
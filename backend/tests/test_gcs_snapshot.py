@@ -0,0 +1,61 @@
+"""Snapshot framing and integrity footer (app.services.gcs_utils)"""
+import io
+import tarfile
+
+import pytest
+
+pytest.importorskip("google.cloud.storage")
+zstandard = pytest.importorskip("zstandard")
+
+from app.services.gcs_utils import SNAPSHOT_FOOTER, build_manifest, extract_snapshot, write_snapshot
+
+SNAPSHOT_ERRORS = (ValueError, zstandard.ZstdError, tarfile.TarError)
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    index = tmp_path / "v1"
+    (index / "segment").mkdir(parents=True)
+    (index / "chroma.sqlite3").write_bytes(bytes(range(256)) * 64)
+    (index / "segment" / "data_level0.bin").write_bytes(b"vectors" * 1000)
+
+    out = tmp_path / "v1.tar.zst"
+    write_snapshot(str(index), build_manifest(str(index), "v1")["files"], str(out))
+    return index, out.read_bytes()
+
+
+def test_snapshot_round_trip(snapshot, tmp_path):
+    index, data = snapshot
+    target = tmp_path / "restored"
+
+    extract_snapshot(io.BytesIO(data), target)
+
+    assert (target / "chroma.sqlite3").read_bytes() == (index / "chroma.sqlite3").read_bytes()
+    assert (target / "segment" / "data_level0.bin").read_bytes() == (index / "segment" / "data_level0.bin").read_bytes()
+
+
+def test_corrupted_payload_is_rejected(snapshot, tmp_path):
+    _, data = snapshot
+    corrupted = bytearray(data)
+    corrupted[len(data) // 2] ^= 0xFF
+
+    with pytest.raises(SNAPSHOT_ERRORS):
+        extract_snapshot(io.BytesIO(bytes(corrupted)), tmp_path / "restored")
+
+
+def test_tampered_footer_is_rejected(snapshot, tmp_path):
+    _, data = snapshot
+    corrupted = bytearray(data)
+    corrupted[-SNAPSHOT_FOOTER.size // 2] ^= 0xFF
+
+    with pytest.raises(ValueError, match="integrity"):
+        extract_snapshot(io.BytesIO(bytes(corrupted)), tmp_path / "restored")
+
+
+def test_truncated_snapshot_is_rejected(snapshot, tmp_path):
+    _, data = snapshot
+
+    with pytest.raises(SNAPSHOT_ERRORS):
+        extract_snapshot(io.BytesIO(data[:-10]), tmp_path / "restored")
+    with pytest.raises(SNAPSHOT_ERRORS):
+        extract_snapshot(io.BytesIO(data[:len(data) // 2]), tmp_path / "restored")
@@ -0,0 +1,62 @@
+"""Versioned indexes and the serving hot swap (app.services.index_versions)"""
+from langchain_chroma import Chroma
+
+from app.services.index_versions import IndexManager, collect_garbage, current_version, new_version, publish, RETIRED_MARKER
+from conftest import FakeEmbeddings
+
+
+def build_version(root, texts):
+    version, path = new_version(root)
+    if texts:
+        Chroma(persist_directory=path, embedding_function=FakeEmbeddings()).add_texts(texts)
+    return version, path
+
+
+def test_refresh_swaps_to_the_published_version(tmp_path):
+    manager = IndexManager(root=tmp_path)
+    assert manager.refresh() is False
+    assert manager.get() is None
+
+    v1, v1_path = build_version(tmp_path, ["Breakfast is served from 7am."])
+    publish(v1, tmp_path)
+    assert manager.refresh() is True
+    assert manager.active_path == v1_path
+    assert manager.refresh() is False
+    old_db = manager.get()
+
+    v2, v2_path = build_version(tmp_path, ["Breakfast is served from 7am.", "Dinner is served from 7pm."])
+    publish(v2, tmp_path)
+    assert current_version(tmp_path) == v2
+    assert (tmp_path / v1 / RETIRED_MARKER).exists()
+
+    assert manager.refresh() is True
+    assert manager.active_path == v2_path
+    assert manager.get()._collection.count() == 2
+    # A request that started on the old version finishes on it
+    assert old_db._collection.count() == 1
+
+
+def test_empty_version_is_not_swapped_in(tmp_path):
+    manager = IndexManager(root=tmp_path)
+    v1, v1_path = build_version(tmp_path, ["Breakfast is served from 7am."])
+    publish(v1, tmp_path)
+    manager.refresh()
+
+    v2, _ = build_version(tmp_path, [])
+    publish(v2, tmp_path)
+
+    assert manager.refresh() is False
+    assert manager.active_path == v1_path
+
+
+def test_collect_garbage_keeps_the_current_and_in_use_versions(tmp_path):
+    v1, v1_path = build_version(tmp_path, ["a"])
+    v2, v2_path = build_version(tmp_path, ["b"])
+    v3, _ = build_version(tmp_path, ["c"])
+    for version in (v1, v2, v3):
+        publish(version, tmp_path)
+
+    removed = collect_garbage(tmp_path, grace_s=0, keep=[v2_path])
+
+    assert removed == [v1]
+    assert sorted(entry.name for entry in tmp_path.iterdir() if entry.is_dir()) == sorted([v2, v3])
@@ -0,0 +1,82 @@
+"""Incremental ingestion and checkpoint/resume (app.services.ingestion)"""
+import pytest
+
+from app.services.ingestion import SHARED_ORG_ID, ingest_documents, load_manifest, _open_index
+
+
+def paragraph(topic: str) -> str:
+    # ~600 characters: each paragraph becomes one chunk (CHUNK_SIZE 1000)
+    return " ".join(f"The {topic} schedule, item {i}, is posted at the reception desk." for i in range(10))
+
+
+def write_document(directory, name, topics):
+    (directory / name).write_text("\n\n".join(paragraph(topic) for topic in topics), encoding="utf-8")
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    data, index = tmp_path / "data", tmp_path / "index"
+    data.mkdir()
+    return data, str(index)
+
+
+def test_edit_re_embeds_only_the_changed_chunk(fake_embeddings, dirs):
+    data, index = dirs
+    write_document(data, "guide.txt", ["pool", "spa", "kids club"])
+
+    stats = ingest_documents(str(data), index)
+    assert stats["added"] == 3
+    first_ids = load_manifest(index)["guide.txt"]["chunk_ids"]
+
+    fake_embeddings.texts.clear()
+    write_document(data, "guide.txt", ["pool", "sailing", "kids club"])
+    stats = ingest_documents(str(data), index)
+
+    assert fake_embeddings.texts == [paragraph("sailing")]
+    assert (stats["added"], stats["deleted"]) == (1, 1)
+    ids = load_manifest(index)["guide.txt"]["chunk_ids"]
+    assert ids[0] == first_ids[0] and ids[2] == first_ids[2] and ids[1] != first_ids[1]
+
+    _, db = _open_index(index)
+    stored = db.get(include=["documents", "metadatas"])
+    assert sorted(stored["ids"]) == sorted(ids)
+    assert paragraph("spa") not in stored["documents"]
+    assert all(metadata["org_id"] == SHARED_ORG_ID for metadata in stored["metadatas"])
+
+
+def test_unchanged_files_are_not_embedded_again(fake_embeddings, dirs):
+    data, index = dirs
+    write_document(data, "guide.txt", ["pool", "spa"])
+    ingest_documents(str(data), index)
+
+    fake_embeddings.texts.clear()
+    stats = ingest_documents(str(data), index)
+
+    assert fake_embeddings.texts == []
+    assert (stats["added"], stats["unchanged_files"]) == (0, 1)
+
+
+def test_failed_run_resumes_from_its_checkpoint(fake_embeddings, dirs):
+    data, index = dirs
+    write_document(data, "a_dining.txt", ["breakfast", "dinner"])
+    write_document(data, "b_activities.txt", ["archery", "trapeze", "tennis"])
+
+    # The embedding service goes down at the last chunk of the second file
+    fake_embeddings.fail_on = "tennis"
+    with pytest.raises(RuntimeError):
+        ingest_documents(str(data), index)
+
+    # The first file was checkpointed; the second was not, but its written chunks are kept
+    assert list(load_manifest(index)) == ["a_dining.txt"]
+    assert len(fake_embeddings.texts) == 4
+
+    fake_embeddings.fail_on = None
+    fake_embeddings.texts.clear()
+    stats = ingest_documents(str(data), index)
+
+    assert fake_embeddings.texts == [paragraph("tennis")]
+    assert (stats["added"], stats["unchanged_files"]) == (1, 1)
+    manifest = load_manifest(index)
+    assert len(manifest["b_activities.txt"]["chunk_ids"]) == 3
+    _, db = _open_index(index)
+    assert len(db.get(include=[])["ids"]) == 5
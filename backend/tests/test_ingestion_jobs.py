@@ -0,0 +1,81 @@
+"""Job claiming for knowledge base uploads (app.services.ingestion_jobs)"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.ingestion_jobs import KB_JOB_LEASE_S, IngestionJobQueue
+
+START = datetime(2025, 1, 1, 9, 0)
+
+
+def add_job(store, doc_id, org_id, minute, status="queued", updated_at=None):
+    conn = store.connect()
+    conn.execute(
+        """INSERT INTO kb_documents (doc_id, org_id, filename, file_url, content_hash, uploaded_at, status, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (doc_id, org_id, f"{doc_id}.pdf", f"/uploads/{doc_id}.pdf", f"hash-{doc_id}",
+         START + timedelta(minutes=minute), status, updated_at),
+    )
+    conn.commit()
+    conn.close()
+
+
+def statuses(store):
+    conn = store.connect()
+    rows = dict(conn.execute("SELECT doc_id, status FROM kb_documents").fetchall())
+    conn.close()
+    return rows
+
+
+@pytest.fixture
+def queue(analytics_store, tmp_path):
+    queue = IngestionJobQueue(workers=4, per_tenant=1, root=tmp_path)
+    yield queue
+    queue._executor.shutdown()
+
+
+def claimed_ids(claimed):
+    return [doc_id for doc_id, *_ in claimed]
+
+
+def test_claims_one_job_per_tenant_in_upload_order(queue, analytics_store):
+    add_job(analytics_store, "a1", "orgA", 0)
+    add_job(analytics_store, "a2", "orgA", 1)
+    add_job(analytics_store, "b1", "orgB", 2)
+
+    assert claimed_ids(queue._claim_next()) == ["a1", "b1"]
+    assert statuses(analytics_store) == {"a1": "processing", "a2": "queued", "b1": "processing"}
+
+    # orgA's live job (which may be on another instance) still holds its slot
+    assert queue._claim_next() == []
+
+
+def test_per_tenant_limit_counts_live_leases(analytics_store, tmp_path):
+    queue = IngestionJobQueue(workers=4, per_tenant=2, root=tmp_path)
+    add_job(analytics_store, "a0", "orgA", 0, status="processing", updated_at=datetime.now())
+    add_job(analytics_store, "a1", "orgA", 1)
+    add_job(analytics_store, "a2", "orgA", 2)
+
+    assert claimed_ids(queue._claim_next()) == ["a1"]
+    queue._executor.shutdown()
+
+
+def test_free_worker_slots_bound_the_claim(queue, analytics_store):
+    for i, org in enumerate(["orgA", "orgB", "orgC", "orgD"]):
+        add_job(analytics_store, f"doc{i}", org, i)
+    queue._running = {"busy1": ("orgX", "h1"), "busy2": ("orgY", "h2"), "busy3": ("orgZ", "h3")}
+
+    assert claimed_ids(queue._claim_next()) == ["doc0"]
+
+    queue._running["busy4"] = ("orgW", "h4")
+    assert queue._claim_next() == []
+
+
+def test_expired_lease_is_reclaimed(queue, analytics_store):
+    expired = datetime.now() - timedelta(seconds=KB_JOB_LEASE_S + 60)
+    add_job(analytics_store, "a1", "orgA", 0, status="processing", updated_at=expired)
+    add_job(analytics_store, "a2", "orgA", 1)
+
+    # The instance that held a1 stopped renewing it: it no longer counts, and is retried first
+    assert claimed_ids(queue._claim_next()) == ["a1"]
+    assert statuses(analytics_store) == {"a1": "processing", "a2": "queued"}
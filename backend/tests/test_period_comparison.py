@@ -0,0 +1,77 @@
+"""Period-over-period deltas from hourly rollups (MetricsService._compare_periods)"""
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import dashboard
+from conftest import query_event
+
+
+@pytest.fixture
+def client(metrics_service):
+    app = FastAPI()
+    app.include_router(dashboard.router, prefix="/api")
+    return TestClient(app)
+
+
+def this_hour():
+    return datetime.now().replace(minute=0, second=0, microsecond=0)
+
+
+def test_summary_endpoint_on_an_empty_store(client):
+    response = client.get("/api/metrics/summary", params={"hours": 24})
+
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["total_queries"] == 0
+    assert summary["aht_delta_percent"] is None
+    assert all(metric["delta"] is None for metric in summary["comparison"]["metrics"].values())
+
+
+def test_empty_previous_window_has_no_deltas(client, metrics_service):
+    metrics_service._write_events([query_event(this_hour(), 200), query_event(this_hour(), 400)])
+
+    summary = client.get("/api/metrics/summary", params={"hours": 1}).json()
+
+    assert summary["total_queries"] == 2
+    assert summary["avg_response_time_ms"] == 300
+    assert summary["aht_delta_percent"] is None
+    total = summary["comparison"]["metrics"]["total_queries"]
+    assert (total["current"], total["previous"], total["delta"], total["delta_percent"]) == (2, 0, None, None)
+
+
+def test_deltas_against_the_previous_window(metrics_service):
+    now = this_hour()
+    metrics_service._write_events([
+        query_event(now, 200), query_event(now, 400),
+        query_event(now - timedelta(hours=1), 150),
+        # Outside both one-hour windows
+        query_event(now - timedelta(hours=2), 5000),
+    ])
+
+    comparison = metrics_service.get_period_comparison(hours=1)
+    metrics = comparison["metrics"]
+
+    assert comparison["offset_hours"] == 1
+    assert metrics["total_queries"] == {"current": 2, "previous": 1, "delta": 1, "delta_percent": 100.0}
+    assert metrics["avg_response_time_ms"] == {"current": 300, "previous": 150, "delta": 150, "delta_percent": 100.0}
+
+
+def test_overlapping_windows_count_rows_in_both(metrics_service):
+    now = this_hour()
+    metrics_service._write_events([query_event(now - timedelta(hours=30), 100)])
+
+    # 48h compared with the same 48h a day earlier: the row is in both windows
+    metrics = metrics_service.get_period_comparison(hours=48, compare="day")["metrics"]
+
+    assert (metrics["total_queries"]["current"], metrics["total_queries"]["previous"]) == (1, 1)
+    assert metrics["total_queries"]["delta"] == 0
+
+
+def test_tenants_are_compared_separately(metrics_service):
+    metrics_service._write_events([query_event(this_hour(), 100, org_id="resort-b")])
+
+    assert metrics_service.get_period_comparison(hours=1)["metrics"]["total_queries"]["current"] == 0
+    assert metrics_service.get_period_comparison(hours=1, org_id="resort-b")["metrics"]["total_queries"]["current"] == 1
@@ -0,0 +1,95 @@
+"""Latency quantile sketches and their hourly rollups (app.services.sketches, MetricsService._apply_rollups)"""
+import math
+import random
+from datetime import datetime
+
+import pytest
+
+from app.services.sketches import LATENCY_RELATIVE_ACCURACY, LatencySketch
+from conftest import query_event
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+@pytest.fixture
+def latencies():
+    rng = random.Random(7)
+    return [rng.lognormvariate(math.log(800), 0.8) for _ in range(20000)]
+
+
+def exact_quantile(values, q):
+    return sorted(values)[math.floor(q * (len(values) - 1))]
+
+
+def sketch_of(values):
+    sketch = LatencySketch()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+def test_quantiles_are_within_the_relative_accuracy(latencies):
+    sketch = sketch_of(latencies)
+
+    for q in QUANTILES:
+        exact = exact_quantile(latencies, q)
+        assert abs(sketch.quantile(q) - exact) <= exact * LATENCY_RELATIVE_ACCURACY * 1.0001
+
+
+def test_merged_sketches_equal_one_sketch_of_all_values(latencies):
+    hourly = [sketch_of(latencies[start:start + 1000]) for start in range(0, len(latencies), 1000)]
+
+    merged = LatencySketch.merged(sketch.to_bytes() for sketch in hourly)
+    whole = sketch_of(latencies)
+
+    assert merged.count == whole.count == len(latencies)
+    assert merged.buckets == whole.buckets
+    assert [merged.quantile(q) for q in QUANTILES] == [whole.quantile(q) for q in QUANTILES]
+
+
+def test_serialization_round_trip_and_empty_sketches():
+    sketch = sketch_of([0, 0.005, 12.5, 480, 3100])
+
+    restored = LatencySketch.from_bytes(sketch.to_bytes())
+
+    assert (restored.buckets, restored.zero_count, restored.count) == (sketch.buckets, 2, 5)
+    assert LatencySketch.from_bytes(None).quantile(0.5) is None
+    assert LatencySketch().percentiles(0.5) == {"p50": 0.0}
+
+
+def stored_sketch(store, hour, dimension="all"):
+    conn = store.connect()
+    blob = conn.execute(
+        "SELECT latency_sketch FROM hourly_rollups WHERE hour = ? AND dimension = ?", (hour, dimension)
+    ).fetchone()[0]
+    conn.close()
+    return LatencySketch.from_bytes(blob)
+
+
+def test_rollup_writes_merge_into_the_stored_sketch(metrics_service, analytics_store, latencies):
+    now = datetime.now()
+    values = [round(value) for value in latencies[:3000]]
+    for start in range(0, len(values), 500):
+        metrics_service._write_events([query_event(now, value) for value in values[start:start + 500]])
+
+    sketch = stored_sketch(analytics_store, now.strftime("%Y-%m-%d %H:00:00"))
+
+    assert sketch.count == len(values)
+    assert sketch.buckets == sketch_of(values).buckets
+
+
+def test_rollup_rows_are_locked_before_their_sketch_is_read(metrics_service, analytics_store, monkeypatch):
+    locked = []
+    monkeypatch.setattr(analytics_store, "lock_row", lambda cursor, table, *key: locked.append((table, *key)))
+    now = datetime.now()
+    hour = now.strftime("%Y-%m-%d %H:00:00")
+
+    metrics_service._write_events([query_event(now, 100, agent_id="agent-2"), query_event(now, 200)])
+
+    hourly = [key for key in locked if key[0] == "hourly_rollups"]
+    assert hourly == sorted(hourly)
+    assert set(hourly) == {
+        ("hourly_rollups", hour, "default", dimension, key)
+        for dimension, key in [("all", "all"), ("category", "Dining"), ("source", "RAG"),
+                               ("agent", "agent-1"), ("agent", "agent-2")]
+    }
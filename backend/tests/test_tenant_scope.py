@@ -0,0 +1,53 @@
+"""Knowledge base retrieval is scoped to the caller's tenant (retrieval.tenant_filter, /api/chat)"""
+import pytest
+from langchain_chroma import Chroma
+
+from app.services.ingestion import SHARED_ORG_ID
+from app.services.retrieval import tenant_filter
+from conftest import FakeEmbeddings
+
+
+@pytest.fixture
+def index(tmp_path):
+    db = Chroma(persist_directory=str(tmp_path / "index"), embedding_function=FakeEmbeddings())
+    db.add_texts(
+        ["Breakfast is served from 7am.", "Resort A staff wifi password.", "Resort B staff wifi password."],
+        metadatas=[{"org_id": SHARED_ORG_ID}, {"org_id": "resort-a"}, {"org_id": "resort-b"}],
+    )
+    return db
+
+
+def visible(db, org_id):
+    return sorted(metadata["org_id"] for metadata in db.get(where=tenant_filter(org_id))["metadatas"])
+
+
+def test_tenants_see_shared_chunks_and_their_own_uploads(analytics_store, index):
+    assert visible(index, "resort-a") == ["resort-a", SHARED_ORG_ID]
+    assert visible(index, "resort-b") == ["resort-b", SHARED_ORG_ID]
+
+
+def test_anonymous_callers_see_only_shared_chunks(analytics_store, index):
+    assert visible(index, None) == [SHARED_ORG_ID]
+
+
+def test_chat_ignores_a_tenant_in_the_request_body(monkeypatch, metrics_service):
+    pytest.importorskip("jose")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api import chat
+    from app.services.auth_service import AuthService
+
+    calls = []
+    monkeypatch.setattr(chat, "query_rag", lambda query, org_id: calls.append(org_id) or {"answer": "7am", "sources": []})
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api")
+    client = TestClient(app)
+
+    client.post("/api/chat", json={"query": "Wifi password?", "org_id": "resort-b"})
+    token = AuthService.create_access_token({"user_id": "u1", "org_id": "o1", "org_slug": "resort-a", "role": "agent"})
+    client.post("/api/chat", json={"query": "Wifi password?", "org_id": "resort-b"},
+                headers={"Authorization": f"Bearer {token}"})
+    invalid = client.post("/api/chat", json={"query": "Wifi password?"}, headers={"Authorization": "Bearer forged"})
+
+    assert calls == [None, "resort-a"]
+    assert invalid.status_code == 401
@@ -0,0 +1,62 @@
+"""Multi-resolution trend tiers (MetricsService._resolve_granularity, get_hourly_trends)"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.metrics_service import MetricsService
+from conftest import query_event
+
+
+@pytest.mark.parametrize("hours, granularity, expected", [
+    (1, "1m", ("1m", 60)),
+    (1, "auto", ("1m", 60)),
+    (12, "7m", ("1m", 420)),
+    (24, "auto", ("5m", 300)),
+    (24, "15m", ("5m", 900)),
+    # 288 one-minute points at most: coarsened to the next tier that fits
+    (24, "1m", ("5m", 300)),
+    (24, "2h", ("1h", 7200)),
+    # The 5m tier only keeps 72 hours
+    (168, "5m", ("1h", 3600)),
+    (168, "1d", ("1d", 86400)),
+    (720, "auto", ("1d", 86400)),
+])
+def test_granularity_picks_the_coarsest_tier_that_serves_it(hours, granularity, expected):
+    assert MetricsService._resolve_granularity(hours, granularity) == expected
+
+
+@pytest.mark.parametrize("granularity", ["90s", "0m", "1w", "hourly"])
+def test_invalid_granularity_is_rejected(granularity):
+    with pytest.raises(ValueError):
+        MetricsService._resolve_granularity(24, granularity)
+
+
+def test_tiers_hold_the_same_events_at_each_resolution(metrics_service):
+    now = datetime.now()
+    metrics_service._write_events([
+        query_event(now - timedelta(minutes=10), 100),
+        query_event(now - timedelta(minutes=10), 300),
+        query_event(now - timedelta(minutes=3), 200, success=False),
+    ])
+
+    minutes = metrics_service.get_hourly_trends(hours=1, granularity="1m")
+    assert [point["queryVolume"] for point in minutes] == [2, 1]
+    assert minutes[0]["avg_response_time_ms"] == 200
+    assert minutes[1]["success_rate"] == 0
+
+    for granularity in ("5m", "15m", "1h"):
+        points = metrics_service.get_hourly_trends(hours=1, granularity=granularity)
+        assert sum(point["queryVolume"] for point in points) == 3
+
+    daily = metrics_service.get_hourly_trends(hours=720, granularity="1d")
+    assert sum(point["queryVolume"] for point in daily) == 3
+
+
+def test_fine_tiers_skip_events_past_their_retention(metrics_service, analytics_store):
+    metrics_service._write_events([query_event(datetime.now() - timedelta(hours=13), 100)])
+
+    conn = analytics_store.connect()
+    resolutions = sorted(row[0] for row in conn.execute("SELECT resolution FROM trend_rollups"))
+    conn.close()
+
+    assert resolutions == ["1d", "5m"]
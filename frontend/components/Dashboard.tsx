@@ -13,10 +13,17 @@ import { useState, useEffect } from "react";
 // API Base URL
 const API_BASE = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
 
+// Snapshot refresh: on each hour boundary, a few seconds after rollups close the hour
+const HOUR_MS = 60 * 60 * 1000;
+const SNAPSHOT_REFRESH_DELAY_MS = 5000;
+
 // Types matching new API response
 interface MetricsSummary {
     total_queries: number;
     avg_response_time_ms: number;
+    p50_response_time_ms: number;
+    p90_response_time_ms: number;
+    p99_response_time_ms: number;
     success_rate: number;
     unique_agents: number;
     period_hours: number;
@@ -25,7 +32,7 @@ interface MetricsSummary {
     internal_accuracy_percent: number;
     external_accuracy_percent: number;
     aht_reduction_percent: number;
-    aht_delta_percent: number;
+    aht_delta_percent: number | null;
 
     rag_count: number;
     rag_percentage: number;
@@ -36,6 +43,23 @@ interface MetricsSummary {
     estimated_cost: number;
     rate_limit_status: string;
     cost_breakdown: string;
+
+    comparison?: PeriodComparison;
+}
+
+interface MetricDelta {
+    current: number;
+    previous: number;
+    delta: number | null;
+    delta_percent: number | null;
+}
+
+interface PeriodComparison {
+    compare: string;
+    offset_hours: number;
+    current_start: string;
+    previous_start: string;
+    metrics: Record<string, MetricDelta>;
 }
 
 interface CategoryMetric {
@@ -49,6 +73,9 @@ interface HourlyTrend {
     time: string;
     queryVolume: number;
     avg_response_time_ms: number;
+    p50_response_time_ms: number;
+    p90_response_time_ms: number;
+    p99_response_time_ms: number;
     success_rate: number;
 }
 
@@ -56,10 +83,35 @@ interface AgentMetric {
     name: string;
     queryCount: number;
     avgTimeMs: number;
+    p50TimeMs: number;
+    p90TimeMs: number;
+    p99TimeMs: number;
     accuracyPercent: number;
     lastActive: string;
 }
 
+interface GroupDelta {
+    count: number;
+    success_count: number;
+    total_response_time_ms: number;
+}
+
+// Incremental update pushed over /api/metrics/stream
+interface MetricsDelta {
+    query_count: number;
+    success_count: number;
+    total_response_time_ms: number;
+    tokens_used: number;
+    estimated_cost: number;
+    aht_saved_s: number;
+    latency_buckets: Record<string, number>;
+    categories: Record<string, GroupDelta>;
+    sources: Record<string, GroupDelta>;
+    agents: Record<string, GroupDelta>;
+    hours: Record<string, GroupDelta>;
+    last_timestamp: string;
+}
+
 export default function Dashboard() {
     const [timeRange, setTimeRange] = useState<number>(24);
     const [summary, setSummary] = useState<MetricsSummary | null>(null);
@@ -94,10 +146,115 @@ export default function Dashboard() {
         }
     };
 
+    // Apply an incremental delta pushed by /api/metrics/stream
+    const applyDelta = (delta: MetricsDelta) => {
+        const n = delta.query_count;
+
+        setSummary((prev) => {
+            if (!prev) return prev;
+            const total = prev.total_queries + n;
+            const rag = prev.rag_count + (delta.sources["RAG"]?.count ?? 0);
+            const maps = prev.maps_count + (delta.sources["Maps"]?.count ?? 0);
+            return {
+                ...prev,
+                total_queries: total,
+                avg_response_time_ms:
+                    (prev.avg_response_time_ms * prev.total_queries + delta.total_response_time_ms) / total,
+                success_rate:
+                    (prev.success_rate * prev.total_queries + delta.success_count * 100) / total,
+                rag_count: rag,
+                rag_percentage: (rag / total) * 100,
+                maps_count: maps,
+                maps_percentage: (maps / total) * 100,
+                tokens_used: prev.tokens_used + delta.tokens_used,
+                estimated_cost: prev.estimated_cost + delta.estimated_cost,
+            };
+        });
+
+        setCategories((prev) => {
+            const next = [...prev];
+            for (const [category, stats] of Object.entries(delta.categories)) {
+                const i = next.findIndex((c) => c.category === category);
+                if (i === -1) {
+                    next.push({ category, count: stats.count, avg_ai_time: stats.total_response_time_ms / stats.count, accuracy: 0 });
+                } else {
+                    const c = next[i];
+                    const count = c.count + stats.count;
+                    next[i] = { ...c, count, avg_ai_time: (c.avg_ai_time * c.count + stats.total_response_time_ms) / count };
+                }
+            }
+            return next.sort((a, b) => b.count - a.count);
+        });
+
+        setTrends((prev) => {
+            const next = [...prev];
+            for (const [time, stats] of Object.entries(delta.hours)) {
+                const i = next.findIndex((t) => t.time === time);
+                if (i === -1) {
+                    // Percentiles of a new hour are approximated by its mean until the next snapshot
+                    const avg = stats.total_response_time_ms / stats.count;
+                    next.push({
+                        time,
+                        queryVolume: stats.count,
+                        avg_response_time_ms: avg,
+                        p50_response_time_ms: avg,
+                        p90_response_time_ms: avg,
+                        p99_response_time_ms: avg,
+                        success_rate: (stats.success_count * 100) / stats.count,
+                    });
+                } else {
+                    const t = next[i];
+                    const volume = t.queryVolume + stats.count;
+                    next[i] = {
+                        ...t,
+                        queryVolume: volume,
+                        avg_response_time_ms: (t.avg_response_time_ms * t.queryVolume + stats.total_response_time_ms) / volume,
+                        success_rate: (t.success_rate * t.queryVolume + stats.success_count * 100) / volume,
+                    };
+                }
+            }
+            return next;
+        });
+
+        setAgents((prev) => {
+            const next = [...prev];
+            for (const [name, stats] of Object.entries(delta.agents)) {
+                const i = next.findIndex((a) => a.name === name);
+                if (i === -1) {
+                    const avg = stats.total_response_time_ms / stats.count;
+                    next.push({ name, queryCount: stats.count, avgTimeMs: avg, p50TimeMs: avg, p90TimeMs: avg, p99TimeMs: avg, accuracyPercent: 0, lastActive: delta.last_timestamp });
+                } else {
+                    const a = next[i];
+                    const count = a.queryCount + stats.count;
+                    next[i] = { ...a, queryCount: count, avgTimeMs: (a.avgTimeMs * a.queryCount + stats.total_response_time_ms) / count, lastActive: delta.last_timestamp };
+                }
+            }
+            return next.sort((a, b) => b.queryCount - a.queryCount);
+        });
+    };
+
     useEffect(() => {
+        // Load the snapshot once, then follow server-pushed deltas
         fetchMetrics();
-        const interval = setInterval(fetchMetrics, 60000);
-        return () => clearInterval(interval);
+        const stream = new EventSource(`${API_BASE}/api/metrics/stream`);
+        stream.addEventListener("delta", (e) => applyDelta(JSON.parse((e as MessageEvent).data)));
+        // Re-sync the snapshot after a dropped connection so missed deltas are recovered
+        let connected = false;
+        stream.onopen = () => {
+            if (connected) fetchMetrics();
+            connected = true;
+        };
+        // Deltas only add; re-fetch at each hour boundary so expired hours leave the window
+        let hourly: ReturnType<typeof setInterval> | undefined;
+        const boundary = setTimeout(() => {
+            fetchMetrics();
+            hourly = setInterval(fetchMetrics, HOUR_MS);
+        }, HOUR_MS - (Date.now() % HOUR_MS) + SNAPSHOT_REFRESH_DELAY_MS);
+        return () => {
+            stream.close();
+            clearTimeout(boundary);
+            if (hourly) clearInterval(hourly);
+        };
     }, [timeRange]);
 
     if (loading && !summary) {
@@ -152,12 +309,20 @@ export default function Dashboard() {
                             label="Total Queries Today"
                             value={summary.total_queries.toLocaleString()}
                             icon="💬"
+                            subValues={summary.comparison ? [
+                                formatDelta("vs prev", summary.comparison.metrics.total_queries?.delta_percent, "%")
+                            ] : undefined}
                         />
                         <KPICard
                             label="Avg Response Time"
                             value={`${summary.avg_response_time_ms.toFixed(0)}ms`}
                             icon="⚡"
                             badge={summary.avg_response_time_ms > 3000 ? { text: "Needs improvement", color: "warning" } : undefined}
+                            subValues={[
+                                { label: "p50", value: `${summary.p50_response_time_ms.toFixed(0)}ms` },
+                                { label: "p90", value: `${summary.p90_response_time_ms.toFixed(0)}ms` },
+                                { label: "p99", value: `${summary.p99_response_time_ms.toFixed(0)}ms` }
+                            ]}
                         />
                         <KPICard
                             label="Accuracy Score"
@@ -173,7 +338,7 @@ export default function Dashboard() {
                             value={`${summary.aht_reduction_percent}%`}
                             icon="📉"
                             subValues={[
-                                { label: "Delta", value: `+${summary.aht_delta_percent}%`, color: "text-green-600" }
+                                formatDelta("Delta", summary.aht_delta_percent, "pp")
                             ]}
                         />
                     </div>
@@ -248,6 +413,7 @@ export default function Dashboard() {
                                         <th className="px-6 py-4 font-medium">Agent</th>
                                         <th className="px-6 py-4 font-medium text-right">Queries Handled</th>
                                         <th className="px-6 py-4 font-medium text-right">Avg Response Time</th>
+                                        <th className="px-6 py-4 font-medium text-right">p90</th>
                                         <th className="px-6 py-4 font-medium text-right">Accuracy</th>
                                         <th className="px-6 py-4 font-medium text-right">Last Active</th>
                                     </tr>
@@ -258,6 +424,7 @@ export default function Dashboard() {
                                             <td className="px-6 py-4 font-medium text-slate-900">{agent.name}</td>
                                             <td className="px-6 py-4 text-right text-slate-600">{agent.queryCount}</td>
                                             <td className="px-6 py-4 text-right text-slate-600">{agent.avgTimeMs.toFixed(0)}ms</td>
+                                            <td className="px-6 py-4 text-right text-slate-600">{agent.p90TimeMs.toFixed(0)}ms</td>
                                             <td className="px-6 py-4 text-right">
                                                 <span className={`inline-flex items-center px-2.5 py-0.5 rounded-full text-xs font-medium ${agent.accuracyPercent >= 90 ? "bg-green-100 text-green-800" : "bg-yellow-100 text-yellow-800"
                                                     }`}>
@@ -302,6 +469,16 @@ export default function Dashboard() {
 
 // Sub-components
 
+// Signed change for KPI sub-values (green when up, red when down)
+function formatDelta(label: string, value: number | null | undefined, unit: string) {
+    if (value === null || value === undefined) return { label, value: "n/a" };
+    return {
+        label,
+        value: `${value > 0 ? "+" : ""}${value}${unit}`,
+        color: value >= 0 ? "text-green-600" : "text-red-600"
+    };
+}
+
 function KPICard({ label, value, icon, badge, subValues }: any) {
     return (
         <div className="bg-white rounded-xl border border-slate-200 p-5 shadow-sm flex flex-col justify-between h-full">
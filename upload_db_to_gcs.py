@@ -1,6 +1,9 @@
 """
 Upload local vector database to Google Cloud Storage.
 Run this script after populating the database locally.
+
+Uploads the files that changed, a single compressed snapshot of the index
+for cold starts, and the manifest, then makes the version live.
 """
 import sys
 import os
@@ -9,17 +12,18 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
 
 from app.services.gcs_utils import upload_vector_db_to_gcs
+from app.services.index_versions import current_index_path
 
 if __name__ == "__main__":
     print("=" * 80)
     print("UPLOAD VECTOR DB TO GOOGLE CLOUD STORAGE")
     print("=" * 80)
     
-    # Path to local vector DB
-    local_db_path = os.path.join(os.path.dirname(__file__), "backend", "chroma_db_v2")
+    # Live local index version
+    local_db_path = current_index_path()
     
-    if not os.path.exists(local_db_path):
-        print(f"\n✗ ERROR: Vector database not found at {local_db_path}")
+    if local_db_path is None:
+        print("\n✗ ERROR: No published vector index found")
         print("Please run 'python backend/populate_db.py' first to create the database.")
         sys.exit(1)
     